@@ -0,0 +1,234 @@
+"""
+Admission Control (負載保護)：伺服器過載時，優先處理結帳與賽事報名，先捨棄可以稍後重試的瀏覽請求。
+
+請求依 method 與路徑分成三類 (見 classify)，依序為：
+    critical  POST /market/buy、POST /player/join_event
+    default   其餘 API
+    browse    GET /market、/cards、/events、/shop/{s_id}/sales_detail (大量、可重試的列表讀取)
+同時執行的請求數上限 (limit) 預設等於每個 worker 的連線池上限 (db.POOL_MAX)，超過時排隊，空出位置時依上面的順序放行：
+- 保留 ADMISSION_RESERVED 比例的位置只給 critical，default 與 browse 合計不會用到
+- browse 另外最多使用 limit 的 ADMISSION_BROWSE_SHARE
+- 每一類有自己的佇列長度與等待上限，browse 的佇列短、只等 0.1 秒，超過時立即回 503 與 Retry-After
+  (前端的 GET 會依 Retry-After 自動重試)，不讓瀏覽請求排在結帳前面佔用連線
+limit 依實際延遲調整 (AIMD)：每 ADMISSION_WINDOW 秒檢查放行後的處理時間，p90 超過 ADMISSION_TARGET_MS 時
+乘以 0.9，否則在請求數曾達到上限時加 1，範圍為 ADMISSION_MIN_LIMIT ~ ADMISSION_MAX_LIMIT。
+狀態只在 event loop 上讀寫，不需要 lock；每個 worker 各自計算。
+"""
+import asyncio
+import collections
+import json
+import math
+import os
+import re
+import time
+from dotenv import load_dotenv
+from . import db
+from . import metrics
+
+load_dotenv()
+
+ENABLED = os.getenv("ADMISSION_CONTROL", "1") == "1"
+ADMISSION_MAX_LIMIT = int(os.getenv("ADMISSION_MAX_LIMIT") or db.POOL_MAX)
+ADMISSION_MIN_LIMIT = int(os.getenv("ADMISSION_MIN_LIMIT", "2"))
+ADMISSION_TARGET_MS = float(os.getenv("ADMISSION_TARGET_MS", "250"))
+ADMISSION_WINDOW = float(os.getenv("ADMISSION_WINDOW", "1"))
+ADMISSION_RESERVED = float(os.getenv("ADMISSION_RESERVED", "0.2"))
+ADMISSION_BROWSE_SHARE = float(os.getenv("ADMISSION_BROWSE_SHARE", "0.5"))
+
+CRITICAL = {("POST", "/market/buy"), ("POST", "/player/join_event")}
+BROWSE = re.compile(r"/(market|cards|events|shop/\d+/sales_detail)")
+# 監控用的路由不受限制：過載時更需要看得到狀態；SSE 長時間連線，不佔用執行位置 (上限見 live)
+EXEMPT = {"/healthz", "/readyz", "/metrics", "/stats/coalescing", "/stats/admission", "/live/events", "/live/market"}
+
+class _Class:
+    __slots__ = ("name", "max_queue", "max_wait", "retry_after", "in_flight", "waiting",
+                 "admitted", "rejected", "wait_seconds")
+
+    def __init__(self, name, max_queue, max_wait, retry_after):
+        self.name = name
+        self.max_queue = max_queue      # limit 的倍數
+        self.max_wait = max_wait        # 秒
+        self.retry_after = retry_after  # 被拒絕時的 Retry-After (秒)
+        self.in_flight = 0
+        self.waiting = collections.deque()
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "timeout": 0}
+        self.wait_seconds = 0.0
+
+# 依放行的優先順序排列
+CLASSES = {
+    "critical": _Class("critical", max_queue=4, max_wait=5.0, retry_after=2),
+    "default": _Class("default", max_queue=2, max_wait=1.0, retry_after=1),
+    "browse": _Class("browse", max_queue=1, max_wait=0.1, retry_after=1),
+}
+
+limit = float(ADMISSION_MAX_LIMIT)
+_in_flight = 0
+_samples = []
+_peak = 0
+_window_start = time.monotonic()
+
+def classify(method, path):
+    """回傳類別名稱，None 表示不受 admission control 限制"""
+    if path in EXEMPT:
+        return None
+    if (method, path) in CRITICAL:
+        return "critical"
+    if method == "GET" and BROWSE.fullmatch(path):
+        return "browse"
+    return "default"
+
+def _reserved():
+    return max(1, round(limit * ADMISSION_RESERVED))
+
+def _can_admit(cls):
+    current = int(limit)
+    if _in_flight >= current:
+        return False
+    if cls.name == "critical":
+        return True
+    if _in_flight - CLASSES["critical"].in_flight >= max(current - _reserved(), 1):
+        return False
+    if cls.name == "browse":
+        return cls.in_flight < max(int(current * ADMISSION_BROWSE_SHARE), 1)
+    return True
+
+def _admit(cls):
+    global _in_flight, _peak
+    _in_flight += 1
+    cls.in_flight += 1
+    cls.admitted += 1
+    _peak = max(_peak, _in_flight)
+
+def _dispatch():
+    """空出位置時依優先順序放行等待中的請求"""
+    for cls in CLASSES.values():
+        while cls.waiting and _can_admit(cls):
+            waiter = cls.waiting.popleft()
+            if not waiter.done():
+                _admit(cls)
+                waiter.set_result(True)
+
+async def acquire(cls):
+    """取得執行位置，回傳 None 表示放行，否則為拒絕的原因"""
+    if not cls.waiting and _can_admit(cls):
+        _admit(cls)
+        return None
+    if len(cls.waiting) >= max(int(limit * cls.max_queue), 1):
+        cls.rejected["queue_full"] += 1
+        return "queue_full"
+    waiter = asyncio.get_running_loop().create_future()
+    cls.waiting.append(waiter)
+    start = time.perf_counter()
+    try:
+        # shield：逾時只取消等待，不取消 waiter，才能分辨「逾時」與「逾時的同時剛好被放行」
+        await asyncio.wait_for(asyncio.shield(waiter), cls.max_wait)
+    except asyncio.TimeoutError:
+        pass
+    except asyncio.CancelledError:
+        if waiter.done() and not waiter.cancelled():
+            release(cls, None)
+        else:
+            waiter.cancel()
+            _remove(cls, waiter)
+        raise
+    finally:
+        cls.wait_seconds += time.perf_counter() - start
+    if waiter.done() and not waiter.cancelled():
+        return None
+    waiter.cancel()
+    _remove(cls, waiter)
+    cls.rejected["timeout"] += 1
+    return "timeout"
+
+def _remove(cls, waiter):
+    try:
+        cls.waiting.remove(waiter)
+    except ValueError:
+        pass
+
+def release(cls, seconds):
+    """seconds 為放行後的處理時間，None 表示不列入延遲統計"""
+    global _in_flight
+    _in_flight -= 1
+    cls.in_flight -= 1
+    if seconds is not None:
+        _samples.append(seconds)
+        _adjust()
+    _dispatch()
+
+def _adjust():
+    """AIMD：每個 window 依 p90 處理時間調整 limit"""
+    global limit, _samples, _peak, _window_start
+    now = time.monotonic()
+    if now - _window_start < ADMISSION_WINDOW:
+        return
+    if len(_samples) >= 10:
+        p90 = sorted(_samples)[math.ceil(len(_samples) * 0.9) - 1] * 1000
+        if p90 > ADMISSION_TARGET_MS:
+            limit = max(float(ADMISSION_MIN_LIMIT), limit * 0.9)
+        elif _peak >= int(limit):
+            limit = min(float(ADMISSION_MAX_LIMIT), limit + 1)
+    _samples, _peak, _window_start = [], _in_flight, now
+
+# --- ASGI middleware ---
+def _reject(cls, reason):
+    body = json.dumps({"detail": "Server busy, please retry later", "reason": reason}).encode()
+    return [
+        {"type": "http.response.start", "status": 503, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(cls.retry_after).encode()),
+        ]},
+        {"type": "http.response.body", "body": body},
+    ]
+
+class AdmissionMiddleware:
+    """純 ASGI middleware：路由比對之前就依路徑分類，被拒絕的請求不會進入 FastAPI 與 threadpool"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        name = classify(scope.get("method"), scope.get("path")) if ENABLED and scope["type"] == "http" else None
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+        cls = CLASSES[name]
+        reason = await acquire(cls)
+        if reason is not None:
+            for message in _reject(cls, reason):
+                await send(message)
+            return
+        start = time.perf_counter()
+        failed = True
+        try:
+            await self.app(scope, receive, send)
+            failed = False
+        finally:
+            # 失敗的請求可能很快結束 (例如連線池錯誤)，不列入延遲統計以免 limit 因此上升
+            release(cls, None if failed else time.perf_counter() - start)
+
+def stats():
+    return {
+        "limit": int(limit),
+        "in_flight": _in_flight,
+        "classes": {name: {"in_flight": cls.in_flight, "queued": len(cls.waiting), "admitted": cls.admitted,
+                           "rejected": dict(cls.rejected)} for name, cls in CLASSES.items()},
+    }
+
+def _admission_metrics():
+    if not ENABLED:
+        return []
+    classes = CLASSES.items()
+    return [
+        ("tcg_admission_limit", "gauge", "目前的同時執行請求數上限 (依延遲調整)", [({}, int(limit))]),
+        ("tcg_admission_in_flight", "gauge", "執行中的請求數", [({"class": n}, c.in_flight) for n, c in classes]),
+        ("tcg_admission_queued", "gauge", "排隊中的請求數", [({"class": n}, len(c.waiting)) for n, c in classes]),
+        ("tcg_admission_requests_total", "counter", "admission 結果 (admitted / queue_full / timeout)",
+         [({"class": n, "result": "admitted"}, c.admitted) for n, c in classes] +
+         [({"class": n, "result": r}, count) for n, c in classes for r, count in c.rejected.items()]),
+        ("tcg_admission_wait_seconds_total", "counter", "請求排隊的累計時間",
+         [({"class": n}, c.wait_seconds) for n, c in classes]),
+    ]
+
+metrics.register(_admission_metrics)
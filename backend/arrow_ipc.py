@@ -0,0 +1,63 @@
+"""
+Apache Arrow IPC 回應格式。
+
+直接把 tuple cursor 的查詢結果 (db.ColumnarRows) 依欄位轉成 Arrow column batches，
+前端可以不經過 JSON 解析就讀成 DataFrame，省去兩端逐列建立 / 解析 dict 的成本。
+"""
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow 為選用套件，沒有安裝時只提供 JSON
+    pa = None
+
+MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# 每個 RecordBatch 的最大列數
+BATCH_SIZE = 65536
+
+# numeric 的 OID：與 JSON 回應一樣轉成浮點數
+_PG_NUMERIC = 1700
+
+# PostgreSQL 型別 OID -> Arrow 型別，未列出的型別交給 pyarrow 推斷
+_PG_TYPES = {
+    16: "bool",
+    20: "int64", 21: "int16", 23: "int32",
+    700: "float32", 701: "float64",
+    18: "string", 19: "string", 25: "string", 1042: "string", 1043: "string",
+    1082: "date32",
+    1083: "time64",
+    1114: "timestamp",
+    1184: "timestamptz",
+}
+
+def available():
+    return pa is not None
+
+def _arrow_type(type_code):
+    name = _PG_TYPES.get(type_code)
+    if name is None:
+        return None
+    if name == "time64":
+        return pa.time64("us")
+    if name == "timestamp":
+        return pa.timestamp("us")
+    if name == "timestamptz":
+        return pa.timestamp("us", tz="UTC")
+    return getattr(pa, name)()
+
+def encode(result):
+    """將 db.ColumnarRows 編碼成 Arrow IPC stream bytes"""
+    columns = list(zip(*result.rows)) if result.rows else [()] * len(result.description)
+    arrays = []
+    for col, values in zip(result.description, columns):
+        if col.type_code == _PG_NUMERIC:
+            # Decimal 無法直接轉成 double，先推斷成 decimal128 再轉型
+            arrays.append(pa.array(values).cast(pa.float64()))
+        else:
+            arrays.append(pa.array(values, type=_arrow_type(col.type_code)))
+    table = pa.Table.from_arrays(arrays, names=result.columns)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=BATCH_SIZE):
+            writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,121 @@
+"""
+多個 worker 之間的訊息廣播 (PostgreSQL LISTEN / NOTIFY)。
+
+每個 worker 都有自己的記憶體狀態 (資料表版本號、登入 session)，多行程模式下必須互相同步：
+寫入方以 pg_notify 送出訊息，每個 worker 各有一條專用連線 LISTEN 同一個 channel，收到後交給 subscribe 註冊的 handler。
+訊息附帶送出行程的 SOURCE_ID，自己送出的訊息不會再處理一次。
+同一條連線也可以 LISTEN 其他 channel (listen)，例如資料庫 trigger 送出的即時更新 (見 live)。
+LISTEN 需要 session 層級的連線，使用 PgBouncer transaction pooling 時請以 DB_DIRECT_HOST / DB_DIRECT_PORT 直連 PostgreSQL。
+"""
+import json
+import os
+import select
+import threading
+import uuid
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CHANNEL = "tcg_broadcast"
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# 多個 worker 時預設開啟；單一行程也可用 DB_BROADCAST=1 強制開啟 (例如多台主機)
+ENABLED = os.getenv("DB_BROADCAST", "1" if WEB_CONCURRENCY > 1 else "0") == "1"
+
+SOURCE_ID = uuid.uuid4().hex[:12]
+
+_handlers = {}
+_channels = {}  # 其他 channel -> [handler]，handler 收到原始 payload
+_reconnect_handlers = []
+_thread = None
+_stop = threading.Event()
+
+def message(kind, **fields):
+    return json.dumps({"source": SOURCE_ID, "kind": kind, **fields}, default=str)
+
+def subscribe(kind, handler):
+    _handlers.setdefault(kind, []).append(handler)
+
+def listen(channel, handler):
+    """LISTEN 額外的 channel：不論訊息來自哪個行程 (或 trigger) 都交給 handler"""
+    _channels.setdefault(channel, []).append(handler)
+
+def active():
+    return ENABLED or bool(_channels)
+
+def on_reconnect(handler):
+    """(重新) 開始 LISTEN 時呼叫：中斷期間可能漏掉訊息，handler 應讓相關的本地狀態失效"""
+    _reconnect_handlers.append(handler)
+
+def _dispatch(payload):
+    try:
+        msg = json.loads(payload)
+    except ValueError:
+        return
+    if msg.get("source") == SOURCE_ID:
+        return
+    for handler in _handlers.get(msg.get("kind"), []):
+        try:
+            handler(msg)
+        except Exception as e:
+            print(f"Broadcast handler error: {e}")
+
+def _dispatch_raw(channel, payload):
+    for handler in _channels.get(channel, []):
+        try:
+            handler(payload)
+        except Exception as e:
+            print(f"Broadcast handler error: {e}")
+
+def _listen(conn_kwargs):
+    delay = 1
+    while not _stop.is_set():
+        conn = None
+        try:
+            conn = psycopg2.connect(**conn_kwargs)
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                for channel in ([CHANNEL] if ENABLED else []) + list(_channels):
+                    cur.execute(f"LISTEN {channel}")
+            for handler in _reconnect_handlers:
+                handler()
+            delay = 1
+            while not _stop.is_set():
+                if select.select([conn], [], [], 1.0)[0]:
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        if notify.channel == CHANNEL:
+                            _dispatch(notify.payload)
+                        else:
+                            _dispatch_raw(notify.channel, notify.payload)
+        except Exception as e:
+            print(f"Broadcast listener error: {e}")
+            _stop.wait(delay)
+            delay = min(delay * 2, 30)
+        finally:
+            if conn is not None:
+                conn.close()
+
+def start(conn_kwargs):
+    global _thread
+    if not active() or (_thread is not None and _thread.is_alive()):
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_listen, args=(conn_kwargs,), name="broadcast-listener", daemon=True)
+    _thread.start()
+
+def stop(timeout=2):
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout)
+        _thread = None
+
+def _after_fork():
+    global SOURCE_ID, _thread
+    # gunicorn --preload 會在 import 之後才 fork：每個 worker 需要自己的 SOURCE_ID 與 listener
+    SOURCE_ID = uuid.uuid4().hex[:12]
+    _thread = None
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,160 @@
+"""
+流量紀錄 (Traffic Capture)：設定 CAPTURE_LOG 後，依 CAPTURE_SAMPLE 抽樣把請求記成 JSON Lines，
+再以 python -m bench.replay 在本機依原本的時間間隔與交錯順序重播，比較兩個版本的延遲分布。
+
+每行一個請求 (欄位名稱縮短以節省空間)：
+    t 開始時間 (epoch 秒)、m method、r 路徑樣板 (例如 /player/{p_id}/cards)、p path 參數、q query 參數、
+    b JSON body、a Accept header、s 狀態碼、d 伺服器端耗時 (ms)
+匿名化：不記錄任何 header (Authorization、Cookie 等) 與比對不到路由的請求；SENSITIVE 內的欄位 (密碼、電話、email、名稱)
+一律只記長度 ({"$s": 長度})。JSON 數字、KEEP_STRINGS 內的欄位 (列舉值、日期時間、分頁 cursor)、path / query 參數
+與 ID_FIELDS 內的純數字字串保留原值，其餘字串 (包括 body 內的純數字字串，例如數字密碼或電話) 只記長度，
+非 JSON 的 body 只記大小 ({"$bytes": 大小})。
+紀錄先放在記憶體，由背景執行緒每秒以單次 append 寫入，多個 worker 可共用同一個檔案。
+"""
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import parse_qsl
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CAPTURE_LOG = os.getenv("CAPTURE_LOG", "")
+CAPTURE_SAMPLE = float(os.getenv("CAPTURE_SAMPLE", "1"))
+ENABLED = bool(CAPTURE_LOG)
+FLUSH_INTERVAL = 1.0
+MAX_BODY = 64 * 1024
+# 保留原值的字串欄位：不含個人資料，且重播時需要原值才是合法的請求
+KEEP_STRINGS = {"role", "e_format", "e_date", "e_time", "e_size", "e_round", "card_type", "rarity", "cursor"}
+# 純數字字串只有這些欄位 (以及 path / query 參數) 保留原值
+ID_FIELDS = {"p_id", "s_id", "prod_id", "e_id", "d_id", "c_id", "limit"}
+# 不論型別與位置一律遮蔽
+SENSITIVE = {"password", "phone", "s_phone", "email", "name"}
+
+_lock = threading.Lock()
+_pending = []
+_stop = threading.Event()
+_flush_thread = None
+
+def anonymize(value, key=None, params=False):
+    """params=True 表示 path / query 參數：數字參數以字串傳入，純數字字串保留原值"""
+    if isinstance(value, dict):
+        return {k: anonymize(v, k, params) for k, v in value.items()}
+    if isinstance(value, list):
+        return [anonymize(v, key, params) for v in value]
+    if key in SENSITIVE and isinstance(value, (str, int, float)):
+        return {"$s": len(str(value))}
+    if isinstance(value, str) and key not in KEEP_STRINGS:
+        keep = value.isdigit() and (params or key in ID_FIELDS)
+        return value if keep else {"$s": len(value)}
+    return value
+
+def _body(chunks):
+    raw = b"".join(chunks)
+    if not raw:
+        return None
+    try:
+        return anonymize(json.loads(raw))
+    except ValueError:
+        return {"$bytes": len(raw)}
+
+def _record(entry):
+    line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+    with _lock:
+        _pending.append(line)
+
+class CaptureMiddleware:
+    """純 ASGI middleware：包裝 receive 取得 body、包裝 send 取得狀態碼"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not ENABLED or scope["type"] != "http" or random.random() >= CAPTURE_SAMPLE:
+            await self.app(scope, receive, send)
+            return
+        started_at = time.time()
+        start = time.perf_counter()
+        chunks, size = [], [0]
+        status = [500]
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request" and size[0] < MAX_BODY:
+                chunks.append(message.get("body", b""))
+                size[0] += len(chunks[-1])
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            route = scope.get("route")
+            if route is not None:
+                accept = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"accept"), None)
+                query = [[k, anonymize(v, k, params=True)] for k, v in parse_qsl(scope["query_string"].decode("latin-1"))]
+                _record({
+                    "t": round(started_at, 3),
+                    "m": scope["method"],
+                    "r": route.path,
+                    "p": anonymize({k: str(v) for k, v in scope.get("path_params", {}).items()}, params=True),
+                    "q": query,
+                    "b": _body(chunks),
+                    "a": accept,
+                    "s": status[0],
+                    "d": round((time.perf_counter() - start) * 1000, 2),
+                })
+
+# --- 背景寫入 ---
+def _flush():
+    global _pending
+    with _lock:
+        lines, _pending = _pending, []
+    if not lines:
+        return
+    # O_APPEND 單次 write：多個 worker 寫同一個檔案時每批紀錄不會互相穿插
+    fd = os.open(CAPTURE_LOG, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, ("\n".join(lines) + "\n").encode("utf-8"))
+    finally:
+        os.close(fd)
+
+def _flusher():
+    while not _stop.wait(FLUSH_INTERVAL):
+        try:
+            _flush()
+        except OSError as e:
+            print(f"Capture write error: {e}")
+
+def start():
+    global _flush_thread
+    if not ENABLED or (_flush_thread is not None and _flush_thread.is_alive()):
+        return
+    _stop.clear()
+    _flush_thread = threading.Thread(target=_flusher, name="capture-flush", daemon=True)
+    _flush_thread.start()
+
+def stop():
+    global _flush_thread
+    _stop.set()
+    if _flush_thread is not None:
+        _flush_thread.join(1)
+        _flush_thread = None
+    if ENABLED:
+        try:
+            _flush()
+        except OSError as e:
+            print(f"Capture write error: {e}")
+
+def _after_fork():
+    global _lock, _pending, _flush_thread
+    _lock = threading.Lock()
+    _pending = []
+    _flush_thread = None
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -4,8 +4,21 @@ from psycopg2 import pool
 from psycopg2.extras import RealDictCursor
 from contextlib import contextmanager
 from dotenv import load_dotenv
+import contextvars
+import hashlib
+import json
 import pymongo
 import datetime
+import queue
+import sys
+import threading
+import time
+from . import broadcast
+from . import live
+from . import metrics
+from . import slowlog
+from . import table_versions
+from . import tracing
 
 load_dotenv()
 
@@ -15,68 +28,620 @@ DB_CONFIG = {
     "user": os.getenv("DB_USER", "postgres"),
     "password": os.getenv("DB_PASSWORD", "password"),
     "host": os.getenv("DB_HOST", "localhost"),
-    "port": os.getenv("DB_PORT", "5432")
+    "port": os.getenv("DB_PORT", "5432"),
+    "connect_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", "5")),
 }
 
+# --- 效能優化：多行程模式 (Multi-worker) ---
+# DB_MAX_CONNECTIONS 為所有 worker 共用的 PostgreSQL 連線預算，依 WEB_CONCURRENCY 平均分給每個 worker
+# (多行程或啟用即時更新時，每個 worker 另外保留一條給 broadcast 的 LISTEN 連線)；DB_POOL_MAX 可直接指定每個 worker 的上限。
+# DB_POOL_MODE=transaction 表示經由 PgBouncer transaction pooling 連線：同一個 session 的連續交易
+# 可能落在不同的後端連線上，因此不使用任何 session 層級的狀態 (SET、LISTEN、prepared statement)，
+# LISTEN 改以 DB_DIRECT_HOST / DB_DIRECT_PORT 直連 PostgreSQL。
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "20"))
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "session")
+
+def _pool_max():
+    if os.getenv("DB_POOL_MAX"):
+        return int(os.getenv("DB_POOL_MAX"))
+    per_worker = DB_MAX_CONNECTIONS // max(WEB_CONCURRENCY, 1)
+    if broadcast.ENABLED or live.ENABLED:
+        per_worker -= 1
+    return max(per_worker, 2)
+
+DIRECT_DB_CONFIG = dict(DB_CONFIG,
+                        host=os.getenv("DB_DIRECT_HOST", DB_CONFIG["host"]),
+                        port=os.getenv("DB_DIRECT_PORT", DB_CONFIG["port"]))
+
 # MongoDB Config
 MONGO_URI = os.getenv("MONGODB_URI")
 mongo_client = None
 mongo_db = None
 
-try:
-    if MONGO_URI:
-        mongo_client = pymongo.MongoClient(MONGO_URI)
-        mongo_db = mongo_client["tcg_logs"]
-        print("Connected to MongoDB Atlas successfully!")
-    else:
-        print("MongoDB URI not found in .env, skipping Mongo connection.")
-except Exception as e:
-    print(f"Error connecting to MongoDB: {e}")
-
-# --- 效能優化：建立連線池 (Connection Pool) ---
-try:
-    connection_pool = psycopg2.pool.ThreadedConnectionPool(
-        minconn=1,
-        maxconn=20,
-        cursor_factory=RealDictCursor, 
-        **DB_CONFIG
-    )
-    print("Database connection pool created successfully")
-except Exception as e:
-    print(f"Error creating connection pool: {e}")
-    connection_pool = None
+# --- 效能優化：延遲建立連線池 (Lazy Connection Pool) ---
+# import 時不做任何網路 I/O：連線池在第一次使用 (或 lifespan 的 warm_up) 時才建立，
+# 失敗時以指數退避重試；剛失敗過的 DB_RETRY_COOLDOWN 秒內直接回報錯誤，不讓每個請求都等一輪重試。
+POOL_MIN = 1
+POOL_MAX = _pool_max()
+DB_CONNECT_RETRIES = int(os.getenv("DB_CONNECT_RETRIES", "3"))
+DB_RETRY_COOLDOWN = float(os.getenv("DB_RETRY_COOLDOWN", "2"))
+
+connection_pool = None
+replica_pool = None
+_pool_lock = threading.Lock()
+_pool_failed_at = {"primary": 0.0, "replica": 0.0}
+
+def _open_pool(name, config, maxconn, retries):
+    """建立連線池 (呼叫端須持有 _pool_lock)，失敗時以指數退避重試"""
+    if time.monotonic() - _pool_failed_at[name] < DB_RETRY_COOLDOWN:
+        raise Exception(f"Connection pool is not initialized ({name})")
+    delay = 0.2
+    for attempt in range(retries + 1):
+        try:
+            pool_ = psycopg2.pool.ThreadedConnectionPool(
+                minconn=POOL_MIN,
+                maxconn=maxconn,
+                connection_factory=_Connection,
+                cursor_factory=_TimedDictCursor, 
+                **config
+            )
+            print(f"Database connection pool created successfully ({name})")
+            return pool_
+        except psycopg2.OperationalError as e:
+            print(f"Error creating connection pool ({name}, attempt {attempt + 1}): {e}")
+            if attempt < retries:
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
+    _pool_failed_at[name] = time.monotonic()
+    raise Exception(f"Connection pool is not initialized ({name})")
+
+def get_pool(retries=DB_CONNECT_RETRIES):
+    global connection_pool
+    if connection_pool is not None:
+        return connection_pool
+    with _pool_lock:
+        if connection_pool is None:
+            connection_pool = _open_pool("primary", DB_CONFIG, POOL_MAX, retries)
+        return connection_pool
+
+# --- 效能優化：讀取副本 (Read Replica) ---
+# 設定 DB_REPLICA_HOST 後，唯讀的列表查詢改走 streaming replica，主資料庫留給 buy_product 等寫入交易。
+# - 延遲：每 REPLICA_LAG_CHECK_INTERVAL 秒量一次 replica 的重播延遲，超過 DB_REPLICA_MAX_LAG 秒就退回主資料庫。
+# - 讀到自己的寫入 (read-your-writes)：資料表被寫入後 DB_PIN_SECONDS 秒內，讀取該資料表的請求固定走主資料庫
+#   (見 main.conditional)，寫入者不會讀到寫入前的資料，新版本的 ETag 也不會對應到 replica 上的舊資料。
+REPLICA_CONFIG = None
+if os.getenv("DB_REPLICA_HOST"):
+    REPLICA_CONFIG = dict(DB_CONFIG,
+                          host=os.getenv("DB_REPLICA_HOST"),
+                          port=os.getenv("DB_REPLICA_PORT", DB_CONFIG["port"]),
+                          dbname=os.getenv("DB_REPLICA_NAME", DB_CONFIG["dbname"]),
+                          user=os.getenv("DB_REPLICA_USER", DB_CONFIG["user"]),
+                          password=os.getenv("DB_REPLICA_PASSWORD", DB_CONFIG["password"]))
+REPLICA_POOL_MAX = int(os.getenv("DB_REPLICA_POOL_MAX", "0")) or POOL_MAX
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "1.0"))
+DB_PIN_SECONDS = float(os.getenv("DB_PIN_SECONDS", "5"))
+REPLICA_LAG_CHECK_INTERVAL = 1.0
+
+# 最近一次量到的 replica 延遲秒數 (None 表示尚未量測或無法連線)
+replica_lag = None
+_lag_checked_at = 0.0
+_lag_lock = threading.Lock()
+
+# 目前的請求是否必須讀主資料庫
+_pin_primary = contextvars.ContextVar("pin_primary", default=False)
+
+_REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END AS lag
+"""
+
+def get_replica_pool():
+    global replica_pool
+    if replica_pool is not None:
+        return replica_pool
+    with _pool_lock:
+        if replica_pool is None:
+            # replica 無法連線時直接退回主資料庫，不重試
+            replica_pool = _open_pool("replica", REPLICA_CONFIG, REPLICA_POOL_MAX, 0)
+        return replica_pool
+
+def _check_replica_lag():
+    global replica_lag, _lag_checked_at
+    _lag_checked_at = time.monotonic()
+    try:
+        pool_ = get_replica_pool()
+        conn = pool_.getconn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(_REPLICA_LAG_SQL)
+                replica_lag = float(cur.fetchone()["lag"])
+            conn.rollback()
+        finally:
+            pool_.putconn(conn)
+    except Exception as e:
+        replica_lag = None
+        print(f"Replica lag check failed: {e}")
+
+def _use_replica():
+    if REPLICA_CONFIG is None or _pin_primary.get():
+        return False
+    # 量測過期時由第一個發現的請求重新量測，其他請求沿用上一次的結果
+    if time.monotonic() - _lag_checked_at >= REPLICA_LAG_CHECK_INTERVAL and _lag_lock.acquire(blocking=False):
+        try:
+            _check_replica_lag()
+        finally:
+            _lag_lock.release()
+    return replica_lag is not None and replica_lag <= DB_REPLICA_MAX_LAG
 
 @contextmanager
-def get_db_connection():
-    if connection_pool is None:
-        raise Exception("Connection pool is not initialized")
-    
-    conn = connection_pool.getconn()
+def pin_primary(pinned=True):
+    """區塊內 readonly 的查詢也走主資料庫"""
+    token = _pin_primary.set(pinned)
+    try:
+        yield
+    finally:
+        _pin_primary.reset(token)
+
+def replica_status():
+    if REPLICA_CONFIG is None:
+        return "disabled"
+    if replica_lag is None:
+        return "unavailable"
+    return "ok" if replica_lag <= DB_REPLICA_MAX_LAG else "lagging"
+
+def warm_up(connections=POOL_MIN, prime=False):
+    """
+    預先建立 connections 條連線放進連線池，避免第一批請求各自付出建立連線的成本；
+    prime=True 時再把熱門的讀取查詢各執行一次，預先載入系統目錄與資料頁的快取。
+    """
+    pool_ = get_pool()
+    conns = []
+    try:
+        for _ in range(min(connections, POOL_MAX)):
+            conn = pool_.getconn()
+            conns.append(conn)
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+    finally:
+        for conn in conns:
+            pool_.putconn(conn)
+    if prime:
+        for query in _PRIME_QUERIES:
+            try:
+                query()
+            except Exception as e:
+                print(f"Priming query failed: {e}")
+    print(f"Connection pool warmed up ({len(conns)} connections{', primed' if prime else ''})")
+
+def ping():
+    """readiness 檢查：不重試，資料庫可用時回傳 True"""
+    try:
+        with get_db_connection(retries=0) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+        return True
+    except Exception as e:
+        print(f"Database ping failed: {e}")
+        return False
+
+def close_pool():
+    global connection_pool, replica_pool
+    with _pool_lock:
+        for pool_ in (connection_pool, replica_pool):
+            if pool_ is not None:
+                pool_.closeall()
+        connection_pool = None
+        replica_pool = None
+
+# read_snapshot() 期間共用的連線
+_snapshot_conn = contextvars.ContextVar("snapshot_conn", default=None)
+
+# --- 效能優化：效能指標 (Metrics) ---
+# 每次使用連線都以呼叫的 db 函式名稱記錄次數與時間 (見 metrics)；
+# ThreadedConnectionPool 在連線用完時直接丟出 PoolError 而不排隊，因此記錄的是正在取得連線 (含建立新連線) 的執行緒數與用完的次數。
+_stats_lock = threading.Lock()
+_pool_stats = {"waiting": 0, "checkouts": 0, "checkout_seconds": 0.0, "exhausted": 0}
+
+def _checkout(pool_):
+    start = time.perf_counter()
+    with _stats_lock:
+        _pool_stats["waiting"] += 1
+    try:
+        with tracing.span("pool.checkout", pool="replica" if pool_ is replica_pool else "primary"):
+            return pool_.getconn()
+    except psycopg2.pool.PoolError:
+        with _stats_lock:
+            _pool_stats["exhausted"] += 1
+        raise
+    finally:
+        with _stats_lock:
+            _pool_stats["waiting"] -= 1
+            _pool_stats["checkouts"] += 1
+            _pool_stats["checkout_seconds"] += time.perf_counter() - start
+
+def _metrics():
+    pools = [("primary", connection_pool), ("replica", replica_pool)]
+    pools = [(name, pool_) for name, pool_ in pools if pool_ is not None]
+    with _stats_lock:
+        stats = dict(_pool_stats)
+    return [
+        ("tcg_db_pool_connections", "gauge", "連線池中的連線數",
+         [({"pool": name, "state": "in_use"}, len(pool_._used)) for name, pool_ in pools]
+         + [({"pool": name, "state": "idle"}, len(pool_._pool)) for name, pool_ in pools]),
+        ("tcg_db_pool_max_connections", "gauge", "連線池上限", [({"pool": name}, pool_.maxconn) for name, pool_ in pools]),
+        ("tcg_db_pool_waiting", "gauge", "正在取得連線的執行緒數", [({}, stats["waiting"])]),
+        ("tcg_db_pool_checkouts_total", "counter", "取得連線次數", [({}, stats["checkouts"])]),
+        ("tcg_db_pool_checkout_seconds_total", "counter", "取得連線累計時間", [({}, stats["checkout_seconds"])]),
+        ("tcg_db_pool_exhausted_total", "counter", "連線池用完的次數", [({}, stats["exhausted"])]),
+        ("tcg_db_replica_lag_seconds", "gauge", "replica 重播延遲", [({}, replica_lag)] if replica_lag is not None else []),
+        ("tcg_db_prepared_disabled_total", "counter", "prepared statement 重新 PREPARE 後仍失敗、改送一般 SQL 的連線數",
+         [({}, prepared_disabled)]),
+        ("tcg_mongo_queue_depth", "gauge", "搜尋紀錄佇列長度", [({}, mongo_queue_depth())]),
+        ("tcg_mongo_dropped_total", "counter", "佇列已滿或寫入失敗而丟棄的搜尋紀錄", [({}, mongo_dropped)]),
+    ]
+
+metrics.register(_metrics)
+
+# --- 效能優化：查詢計時與慢查詢紀錄 ---
+# 連線池發出的 cursor 會為每個 SQL 計時，標上呼叫的 db 函式名稱 (get_db_connection 記在 _query_tag)，
+# 計入 metrics；超過 slowlog.SLOW_QUERY_MS 的交給 slowlog 記錄，最慢的會在背景抽樣 EXPLAIN。
+_query_tag = contextvars.ContextVar("query_tag", default=None)
+
+class _TimedCursorMixin:
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            seconds = time.perf_counter() - start
+            function = _query_tag.get() or sys._getframe(1).f_code.co_name
+            metrics.observe_statement(function, seconds)
+            if seconds * 1000 >= slowlog.SLOW_QUERY_MS and isinstance(query, str):
+                slowlog.record(function, _original_sql(query), vars, seconds, self.rowcount)
+            span = tracing.current()
+            if span is not None and isinstance(query, str):
+                tracing.add_span(span, "sql", time.time_ns() - int(seconds * 1e9), seconds * 1000,
+                                 sql=" ".join(_original_sql(query).split())[:300], rows=self.rowcount)
+
+class _TimedCursor(_TimedCursorMixin, psycopg2.extensions.cursor):
+    """tuple cursor (列表查詢的 columnar 模式)"""
+
+class _TimedDictCursor(_TimedCursorMixin, RealDictCursor):
+    """連線池預設的 cursor"""
+
+@contextmanager
+def _explain_connection():
+    """slowlog 背景 EXPLAIN 用的連線，用完一律 rollback"""
+    pool_ = get_pool(retries=0)
+    conn = pool_.getconn()
     try:
         yield conn
-        conn.commit() 
+    finally:
+        conn.rollback()
+        pool_.putconn(conn)
+
+slowlog.connect = _explain_connection
+
+# --- 效能優化：Statement Timeout 與用戶端斷線時取消查詢 ---
+# 每個 HTTP 請求有一個 RequestQueries (由 main 的 middleware 建立)，記錄該路由的 statement timeout 與使用中的連線。
+# 取得連線後以 SET LOCAL statement_timeout 套用 timeout (只在該交易內有效，PgBouncer transaction pooling 下也安全)；
+# 用戶端斷線時 cancel() 對使用中的連線送出 cancel request (等同 pg_cancel_backend)，查詢以 ClientDisconnected 結束，
+# 連線 rollback 後立即歸還連線池，不再為沒有人會讀的結果佔用連線與 CPU。
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+
+class ClientDisconnected(Exception):
+    """查詢因用戶端斷線而被取消"""
+
+class RequestQueries:
+    __slots__ = ("_timeout", "cancelled", "active", "lock")
+
+    def __init__(self, timeout=None):
+        # timeout: 回傳毫秒數的函式，第一次使用連線時才呼叫 (此時已完成路由比對)
+        self._timeout = timeout
+        self.cancelled = False
+        self.active = set()
+        self.lock = threading.Lock()
+
+    def timeout_ms(self):
+        if callable(self._timeout):
+            self._timeout = self._timeout()
+        return DB_STATEMENT_TIMEOUT_MS if self._timeout is None else self._timeout
+
+    def cancel(self):
+        """取消使用中的查詢 (由其他執行緒呼叫)，回傳送出 cancel 的連線數"""
+        with self.lock:
+            self.cancelled = True
+            for conn in self.active:
+                try:
+                    conn.cancel()
+                except psycopg2.Error as e:
+                    print(f"Cancel failed: {e}")
+            return len(self.active)
+
+_request_queries = contextvars.ContextVar("request_queries", default=None)
+
+@contextmanager
+def track_request(queries):
+    """區塊內 (含複製 context 的 threadpool) 的查詢套用 queries 的 timeout，並可被 queries.cancel() 取消"""
+    token = _request_queries.set(queries)
+    try:
+        yield queries
+    finally:
+        _request_queries.reset(token)
+
+def check_cancelled():
+    """目前的請求已被取消 (用戶端斷線) 時丟出 ClientDisconnected，給不使用連線的等待迴圈檢查"""
+    queries = _request_queries.get()
+    if queries is not None and queries.cancelled:
+        raise ClientDisconnected()
+
+def _attach(queries, conn):
+    with queries.lock:
+        if queries.cancelled:
+            raise ClientDisconnected()
+        queries.active.add(conn)
+    timeout = queries.timeout_ms()
+    if timeout:
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+            cur.execute("SET LOCAL statement_timeout = %s", (timeout,))
+
+def _detach(queries, conn):
+    # 歸還連線池之前移除，cancel() 不會取消到其他請求的查詢
+    with queries.lock:
+        queries.active.discard(conn)
+
+@contextmanager
+def get_db_connection(writes=(), retries=DB_CONNECT_RETRIES, readonly=False):
+    """
+    writes: 此交易會修改的資料表，commit 成功後遞增其版本號，
+    讓讀取 API 的 ETag 失效 (見 table_versions)。
+    retries: 連線池尚未建立時的重試次數。
+    readonly: 唯讀查詢，replica 可用時改走 replica。
+    """
+    # 呼叫端的 db 函式名稱 (上一層是 contextmanager 的 __enter__)
+    name = sys._getframe(2).f_code.co_name
+    start = time.perf_counter()
+    error = False
+    tag = _query_tag.set(name)
+    try:
+        with tracing.span("db." + name), _connection(writes, retries, readonly) as conn:
+            yield conn
+    except ClientDisconnected:
+        error = True
+        metrics.observe_cancel(name, "client_disconnect", time.perf_counter() - start)
+        raise
+    except psycopg2.errors.QueryCanceled:
+        error = True
+        metrics.observe_cancel(name, "statement_timeout", time.perf_counter() - start)
+        raise
+    except Exception:
+        error = True
+        raise
+    finally:
+        _query_tag.reset(tag)
+        # read_snapshot 內的查詢已計入 read_snapshot 的時間，不重複計入請求的資料庫時間
+        metrics.observe_query(name, time.perf_counter() - start, error, nested=_snapshot_conn.get() is not None)
+
+@contextmanager
+def _connection(writes, retries, readonly):
+    snapshot_conn = _snapshot_conn.get()
+    if snapshot_conn is not None:
+        # 在 read_snapshot() 內：沿用同一條連線與交易，由 read_snapshot 負責結束交易
+        yield snapshot_conn
+        return
+
+    queries = _request_queries.get()
+    pool_ = get_replica_pool() if readonly and _use_replica() else get_pool(retries)
+    conn = _checkout(pool_)
+    try:
+        if queries is not None:
+            _attach(queries, conn)
+        yield conn
+        if writes and broadcast.ENABLED:
+            # 與寫入同一個交易送出：commit 成功時其他 worker 才會收到版本號變更
+            _notify(conn, "versions", tables=list(writes))
+        with tracing.span("db.commit"):
+            conn.commit()
     except Exception as e:
         conn.rollback() 
+        if queries is not None and queries.cancelled and isinstance(e, psycopg2.errors.QueryCanceled):
+            raise ClientDisconnected() from e
         raise e
     finally:
-        connection_pool.putconn(conn) 
+        if queries is not None:
+            _detach(queries, conn)
+        pool_.putconn(conn) 
+    if writes:
+        table_versions.bump(*writes)
+
+def _notify(conn, kind, **fields):
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_notify(%s, %s)", (broadcast.CHANNEL, broadcast.message(kind, **fields)))
+
+def publish(kind, **fields):
+    """以一個獨立的交易廣播訊息給其他 worker (見 broadcast)"""
+    if not broadcast.ENABLED:
+        return
+    try:
+        with get_db_connection() as conn:
+            _notify(conn, kind, **fields)
+    except Exception as e:
+        print(f"Broadcast publish failed: {e}")
+
+@contextmanager
+def read_snapshot():
+    """
+    以單一連線、單一 REPEATABLE READ 唯讀交易執行區塊內的所有查詢：
+    聚合 API 一次取回整頁資料只需一次 pool checkout，且每個查詢看到同一個時間點的資料。
+    """
+    with get_db_connection(readonly=True) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        token = _snapshot_conn.set(conn)
+        try:
+            yield conn
+        finally:
+            _snapshot_conn.reset(token)
+
+# --- 效能優化：欄式查詢結果 (Columnar Rows) ---
+class ColumnarRows:
+    """
+    tuple cursor 的查詢結果：一份欄位描述 + tuple rows，不為每一列建立 dict。
+    支援 len() 與切片；以整數索引取單列時才轉成 dict (分頁取排序鍵用)。
+    """
+    __slots__ = ("description", "rows")
+
+    def __init__(self, description, rows):
+        self.description = description
+        self.rows = rows
+
+    @property
+    def columns(self):
+        return [col.name for col in self.description]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ColumnarRows(self.description, self.rows[index])
+        return dict(zip(self.columns, self.rows[index]))
+
+def _list_cursor(conn, columnar=False):
+    """columnar=True 時改用 tuple cursor，省去 RealDictCursor 逐列建立 dict 的成本"""
+    if columnar:
+        return conn.cursor(cursor_factory=_TimedCursor)
+    return conn.cursor()
+
+def _fetch_all(cur, columnar=False):
+    if columnar:
+        return ColumnarRows(cur.description, cur.fetchall())
+    return cur.fetchall()
+
+# --- 效能優化：伺服器端 Prepared Statements ---
+# 熱門查詢在每條連線上只 PREPARE 一次，之後以 EXECUTE 名稱執行，PostgreSQL 不必每次重新解析與規劃。
+# 經由 PgBouncer transaction pooling (DB_POOL_MODE=transaction) 時同一條連線的交易可能落在不同的後端 session，
+# 因此不使用。每個 EXECUTE 與一個 savepoint 同一次送出 (上一句的 savepoint 同時 RELEASE，交易內只保留一層)，
+# 發現 prepared statement 不存在或重複 (session 被換掉) 時只還原這一句，清空後重新 PREPARE 一次；
+# 仍然失敗的連線改送一般 SQL (計入 tcg_db_prepared_disabled_total)。
+PREPARED_STATEMENTS = DB_POOL_MODE != "transaction" and os.getenv("DB_PREPARED_STATEMENTS", "1") == "1"
+_SAVEPOINT = "SAVEPOINT tcg_prepared; "
+_RELEASE = "RELEASE SAVEPOINT tcg_prepared; "
+prepared_disabled = 0
+
+class _Connection(psycopg2.extensions.connection):
+    """記錄這條連線上已經 PREPARE 過的查詢 (None 表示這條連線不使用 prepared statement)"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.savepoint = False  # 目前的交易內是否有尚未 RELEASE 的 tcg_prepared
+
+    def commit(self):
+        self.savepoint = False
+        super().commit()
+
+    def rollback(self):
+        self.savepoint = False
+        super().rollback()
+
+# SQL -> statement 名稱，所有連線共用同一份命名；_statement_sql 為反查 (慢查詢紀錄用)
+_statement_names = {}
+_statement_sql = {}
+
+def _statement_name(sql):
+    name = _statement_names.get(sql)
+    if name is None:
+        name = "tcg_" + hashlib.sha1(sql.encode()).hexdigest()[:16]
+        _statement_names[sql] = name
+        _statement_sql[name] = sql
+    return name
+
+def _original_sql(query):
+    """EXECUTE tcg_xxx (...) 還原成原本的 SQL (參數順序相同)"""
+    query = query.removeprefix(_RELEASE).removeprefix(_SAVEPOINT)
+    if query.startswith("EXECUTE tcg_"):
+        return _statement_sql.get(query.split(None, 2)[1], query)
+    return query
+
+def _numbered(sql):
+    """把 psycopg2 的 %s 依序換成 PREPARE 使用的 $1, $2, ..."""
+    parts = sql.split("%s")
+    return parts[0] + "".join(f"${i}{part}" for i, part in enumerate(parts[1:], 1))
+
+def _execute_prepared(cur, name, sql, params):
+    conn = cur.connection
+    prefix = (_RELEASE if conn.savepoint else "") + _SAVEPOINT
+    conn.savepoint = True
+    if name not in conn.prepared:
+        cur.execute(f"{prefix}PREPARE {name} AS {_numbered(sql)}")
+        conn.prepared.add(name)
+        prefix = ""
+    if params:
+        cur.execute(f"{prefix}EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f"{prefix}EXECUTE {name}")
+
+def _execute(cur, sql, params=()):
+    """以 prepared statement 執行查詢，參數與 cur.execute 相同 (%s 佔位)"""
+    global prepared_disabled
+    conn = cur.connection
+    if not PREPARED_STATEMENTS or not isinstance(conn, _Connection) or conn.prepared is None:
+        cur.execute(sql, params)
+        return
+    name = _statement_name(sql)
+    error = None
+    for _ in range(2):
+        try:
+            _execute_prepared(cur, name, sql, params)
+            return
+        except (psycopg2.errors.InvalidSqlStatementName, psycopg2.errors.DuplicatePreparedStatement) as e:
+            error = e
+            # session 上的 prepared statement 與 conn.prepared 不一致：只還原這一句，兩邊都清空後重新 PREPARE 一次
+            cur.execute("ROLLBACK TO SAVEPOINT tcg_prepared; DEALLOCATE ALL")
+            conn.prepared.clear()
+    # 重來一次仍然失敗 (例如每個交易都換了 session)：這條連線改送一般 SQL，其他連線不受影響
+    print(f"Prepared statements disabled on connection: {error}")
+    conn.prepared = None
+    prepared_disabled += 1
+    cur.execute(sql, params)
+
+# --- 效能優化：Keyset 分頁 ---
+def _keyset(sort_cols, after=None, limit=None):
+    """
+    依排序鍵產生 keyset 分頁的 SQL 片段，回傳 (WHERE 片段, WHERE 參數, ORDER BY 片段, ORDER BY 參數)。
+    after 為上一頁最後一筆的排序鍵，用 row value 比較取代 OFFSET，讓第 N 頁與第一頁的成本相同。
+    """
+    where_sql, where_params = "", []
+    if after:
+        where_sql = " AND ({}) > ({})".format(", ".join(sort_cols), ", ".join(["%s"] * len(sort_cols)))
+        where_params = list(after)
+    order_sql, order_params = " ORDER BY " + ", ".join(sort_cols), []
+    if limit:
+        order_sql += " LIMIT %s"
+        order_params = [limit]
+    return where_sql, where_params, order_sql, order_params
 
 # --- User / Auth ---
 def get_player_by_email(email):
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute('SELECT * FROM "PLAYER" WHERE "email" = %s', (email,))
+            _execute(cur, 'SELECT * FROM "PLAYER" WHERE "email" = %s', (email,))
             return cur.fetchone()
 
 def get_shop_by_name(name):
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute('SELECT * FROM "SHOP" WHERE "s_name" = %s', (name,))
+            _execute(cur, 'SELECT * FROM "SHOP" WHERE "s_name" = %s', (name,))
             return cur.fetchone()
 
 def create_player(name, email, hashed_pw):
     try:
-        with get_db_connection() as conn:
+        with get_db_connection(writes=("PLAYER",)) as conn:
             with conn.cursor() as cur:
                 cur.execute('INSERT INTO "PLAYER" ("p_name", "email", "password") VALUES (%s, %s, %s)', (name, email, hashed_pw))
         return True
@@ -86,7 +651,7 @@ def create_player(name, email, hashed_pw):
 
 def create_shop(name, addr, phone, hashed_pw):
     try:
-        with get_db_connection() as conn:
+        with get_db_connection(writes=("SHOP",)) as conn:
             with conn.cursor() as cur:
                 cur.execute('INSERT INTO "SHOP" ("s_name", "s_addr", "s_phone", "password") VALUES (%s, %s, %s, %s)', (name, addr, phone, hashed_pw))
         return True
@@ -95,27 +660,30 @@ def create_shop(name, addr, phone, hashed_pw):
         return False
 
 # --- Player Features ---
-def get_player_cards(p_id):
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
+def get_player_cards(p_id, limit=None, after=None, columnar=False):
+    where_sql, where_params, order_sql, order_params = _keyset(['phc."c_id"'], after, limit)
+    with get_db_connection(readonly=True) as conn:
+        with _list_cursor(conn, columnar) as cur:
+            _execute(cur, """
                 SELECT c."c_id", c."c_name" AS "卡牌名稱", c."c_rarity" AS "稀有度", phc."qty" AS "擁有量"
                 FROM "PLAYER_HAS_CARD" phc
                 JOIN "CARD" c ON phc."c_id" = c."c_id"
                 WHERE phc."p_id" = %s
-            """, (p_id,))
-            return cur.fetchall()
+            """ + where_sql + order_sql, (p_id, *where_params, *order_params))
+            return _fetch_all(cur, columnar)
 
-def get_all_card_names_and_ids():
+def get_all_card_names_and_ids(limit=None, after=None, columnar=False):
     """登錄卡牌功能用，回傳 ID、名稱和稀有度。"""
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute('SELECT "c_id", "c_name", "c_rarity" FROM "CARD"')
-            return cur.fetchall()
+    where_sql, where_params, order_sql, order_params = _keyset(['"c_id"'], after, limit)
+    with get_db_connection(readonly=True) as conn:
+        with _list_cursor(conn, columnar) as cur:
+            _execute(cur, 'SELECT "c_id", "c_name", "c_rarity" FROM "CARD" WHERE 1=1' + where_sql + order_sql,
+                        (*where_params, *order_params))
+            return _fetch_all(cur, columnar)
 
 def upsert_player_card(p_id, c_id, qty):
     try:
-        with get_db_connection() as conn:
+        with get_db_connection(writes=("PLAYER_HAS_CARD",)) as conn:
             with conn.cursor() as cur:
                 cur.execute('SELECT 1 FROM "PLAYER_HAS_CARD" WHERE "p_id"=%s AND "c_id"=%s', (p_id, c_id))
                 if cur.fetchone():
@@ -129,7 +697,7 @@ def upsert_player_card(p_id, c_id, qty):
     
 def delete_player_card(p_id, c_id, qty):
     try:
-        with get_db_connection() as conn:
+        with get_db_connection(writes=("PLAYER_HAS_CARD",)) as conn:
             with conn.cursor() as cur:
                 cur.execute('SELECT "qty" FROM "PLAYER_HAS_CARD" WHERE "p_id"=%s AND "c_id"=%s', (p_id, c_id))
                 original = cur.fetchone()['qty']
@@ -142,20 +710,21 @@ def delete_player_card(p_id, c_id, qty):
         print(e)
         return False
 
-def get_player_decks(p_id):
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
+def get_player_decks(p_id, columnar=False):
+    with get_db_connection(readonly=True) as conn:
+        with _list_cursor(conn, columnar) as cur:
+            _execute(cur, """
                 SELECT d."d_id", d."d_name" AS "牌組名稱"
                 FROM "DECK" d 
                 JOIN "PLAYER_BUILDS_DECK" pbd ON d."d_id" = pbd."d_id" 
                 WHERE pbd."p_id" = %s
+                ORDER BY d."d_id"
             """, (p_id,))
-            return cur.fetchall()
+            return _fetch_all(cur, columnar)
 
 def create_deck(p_id, d_name):
     try:
-        with get_db_connection() as conn:
+        with get_db_connection(writes=("DECK", "PLAYER_BUILDS_DECK")) as conn:
             with conn.cursor() as cur:
                 cur.execute('INSERT INTO "DECK" ("d_name") VALUES (%s) RETURNING "d_id"', (d_name,))
                 new_d_id = cur.fetchone()['d_id']
@@ -167,7 +736,7 @@ def create_deck(p_id, d_name):
 
 def remove_deck(p_id, d_id):
     try:
-        with get_db_connection() as conn:
+        with get_db_connection(writes=("PLAYER_BUILDS_DECK",)) as conn:
             with conn.cursor() as cur:
                 cur.execute('DELETE FROM "PLAYER_BUILDS_DECK" WHERE "p_id"=%s AND "d_id"=%s', (p_id, d_id))
         return True
@@ -176,20 +745,20 @@ def remove_deck(p_id, d_id):
         return False
 
 # --- 牌組組成功能 ---
-def get_deck_composition(d_id):
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
+def get_deck_composition(d_id, columnar=False):
+    with get_db_connection(readonly=True) as conn:
+        with _list_cursor(conn, columnar) as cur:
+            _execute(cur, """
                 SELECT c."c_name" AS "卡牌名稱", dcoc."qty" AS "組成數量"
                 FROM "DECK_CONSISTS_OF_CARD" dcoc
                 JOIN "CARD" c ON dcoc."c_id" = c."c_id"
                 WHERE dcoc."d_id" = %s
             """, (d_id,))
-            return cur.fetchall()
+            return _fetch_all(cur, columnar)
 
 def upsert_deck_card(d_id, c_id, qty):
     try:
-        with get_db_connection() as conn:
+        with get_db_connection(writes=("DECK_CONSISTS_OF_CARD",)) as conn:
             with conn.cursor() as cur:
                 # 檢查是否已存在，並更新數量
                 cur.execute('SELECT 1 FROM "DECK_CONSISTS_OF_CARD" WHERE "d_id"=%s AND "c_id"=%s', (d_id, c_id))
@@ -208,10 +777,10 @@ def upsert_deck_card(d_id, c_id, qty):
         return False
 
 # --- 缺卡計算邏輯 ---
-def get_missing_cards_for_deck(p_id, d_id):
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
+def get_missing_cards_for_deck(p_id, d_id, columnar=False):
+    with get_db_connection(readonly=True) as conn:
+        with _list_cursor(conn, columnar) as cur:
+            _execute(cur, """
                 -- DCOC: Deck Consists Of Card (牌組需求)
                 -- PHC: Player Has Card (玩家擁有)
                 SELECT
@@ -229,34 +798,144 @@ def get_missing_cards_for_deck(p_id, d_id):
                   AND (dco."qty" - COALESCE(phc."qty", 0)) > 0
                 ORDER BY "缺少數量" DESC;
             """, (p_id, d_id))
-            return cur.fetchall()
+            return _fetch_all(cur, columnar)
 
-def log_search_history(c_name, c_type, c_rarity):
-    if mongo_db is not None:
+# --- 效能優化：MongoDB 背景寫入 ---
+# 搜尋紀錄先放進佇列，由背景執行緒批次寫入 MongoDB：查詢 API 不等待 Atlas 的往返，
+# Atlas 無法連線時也只是丟棄紀錄，不影響 API。MongoClient 在背景執行緒第一次寫入時才建立
+# (mongodb+srv 的 DNS 查詢不會卡在啟動或 import)，失敗時以指數退避重試。
+MONGO_QUEUE_SIZE = 1000
+MONGO_BATCH_SIZE = 100
+
+_mongo_queue = queue.Queue(maxsize=MONGO_QUEUE_SIZE)
+_mongo_thread = None
+_mongo_thread_lock = threading.Lock()
+# 最近一次寫入是否成功 (None 表示尚未寫入過)
+mongo_ok = None
+mongo_dropped = 0
+
+def _get_mongo_db():
+    global mongo_client, mongo_db
+    if mongo_db is None:
+        mongo_client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+        mongo_db = mongo_client["tcg_logs"]
+        print("Connected to MongoDB Atlas successfully!")
+    return mongo_db
+
+def _mongo_writer():
+    global mongo_ok
+    delay = 1
+    stopping = False
+    while not stopping:
+        item = _mongo_queue.get()
+        if item is None:
+            break
+        batch = [item]
+        while len(batch) < MONGO_BATCH_SIZE:
+            try:
+                item = _mongo_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+        start_ns = time.time_ns()
+        error = None
         try:
-            collection = mongo_db["search_history"]
-            
-            log_data = {
-                "timestamp": datetime.datetime.now(),
-                "search_criteria": {
-                    "name": c_name,
-                    "type": c_type,
-                    "rarity": c_rarity
-                },
-            }
-            
-            collection.insert_one(log_data)
+            _get_mongo_db()["search_history"].insert_many([doc for doc, _ in batch])
+            mongo_ok = True
+            delay = 1
         except Exception as e:
+            mongo_ok = False
+            error = repr(e)[:200]
             print(f"Failed to log search to MongoDB: {e}")
+        # 把批次寫入的時間記到每個來源請求的 trace
+        duration_ms = (time.time_ns() - start_ns) / 1e6
+        for _, span in batch:
+            if span is not None:
+                tracing.add_span(span, "mongo.insert_many", start_ns, duration_ms,
+                                 batch=len(batch), **({"error": error} if error else {}))
+        if error is not None and not stopping:
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+
+def start_mongo_writer():
+    global _mongo_thread
+    if not MONGO_URI:
+        return
+    with _mongo_thread_lock:
+        if _mongo_thread is None or not _mongo_thread.is_alive():
+            _mongo_thread = threading.Thread(target=_mongo_writer, name="mongo-writer", daemon=True)
+            _mongo_thread.start()
+
+def stop_mongo_writer(timeout=5):
+    """送出佇列中剩下的紀錄後結束背景執行緒"""
+    global _mongo_thread
+    with _mongo_thread_lock:
+        thread, _mongo_thread = _mongo_thread, None
+    if thread is not None:
+        try:
+            _mongo_queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        thread.join(timeout)
+
+def mongo_queue_depth():
+    return _mongo_queue.qsize()
+
+def _after_fork():
+    """
+    fork 出來的 worker 不能沿用父行程的連線池、MongoClient 與背景執行緒：
+    直接丟掉參照 (不 close，以免關掉父行程仍在使用的連線)，之後在 worker 內重新建立。
+    """
+    global connection_pool, replica_pool, _pool_lock, _lag_lock
+    global mongo_client, mongo_db, _mongo_queue, _mongo_thread, _mongo_thread_lock, _stats_lock
+    connection_pool = None
+    replica_pool = None
+    _lag_lock = threading.Lock()
+    _pool_lock = threading.Lock()
+    mongo_client = None
+    mongo_db = None
+    _mongo_queue = queue.Queue(maxsize=MONGO_QUEUE_SIZE)
+    _mongo_thread = None
+    _mongo_thread_lock = threading.Lock()
+    _stats_lock = threading.Lock()
+    _pool_stats.update(waiting=0, checkouts=0, checkout_seconds=0.0, exhausted=0)
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def log_search_history(c_name, c_type, c_rarity):
+    global mongo_dropped
+    if not MONGO_URI:
+        return
+    start_mongo_writer()
+    log_data = {
+        "timestamp": datetime.datetime.now(),
+        "search_criteria": {
+            "name": c_name,
+            "type": c_type,
+            "rarity": c_rarity
+        },
+    }
+    try:
+        # 連同目前的 span 一起放進佇列，背景寫入完成後記到同一個 trace
+        _mongo_queue.put_nowait((log_data, tracing.current()))
+    except queue.Full:
+        # MongoDB 長時間無法寫入時丟棄新紀錄，不讓佇列無限成長
+        mongo_dropped += 1
 
 # --- 卡牌篩選查詢 ---
-def filter_cards(c_name=None, c_type=None, c_rarity=None):
-    log_search_history(c_name, c_type, c_rarity)
+def filter_cards(c_name=None, c_type=None, c_rarity=None, limit=None, after=None, columnar=False):
+    # 翻頁不是新的搜尋，只記錄第一頁
+    if after is None:
+        log_search_history(c_name, c_type, c_rarity)
 
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
+    with get_db_connection(readonly=True) as conn:
+        with _list_cursor(conn, columnar) as cur:
             query = """
                 SELECT 
+                    c."c_id",
                     c."c_name" AS "卡牌名稱", 
                     c."c_type" AS "類型", 
                     c."c_rarity" AS "稀有度", 
@@ -272,57 +951,133 @@ def filter_cards(c_name=None, c_type=None, c_rarity=None):
                 query += " AND c.\"c_name\" ILIKE %s" # ILIKE 實現大小寫不敏感搜尋
                 params.append(f'%{c_name}%')
             if c_type:
-                query += " AND c.\"c_type\" IN %s"
-                params.append(tuple(c_type))
+                query += " AND c.\"c_type\" = ANY(%s)"
+                params.append(list(c_type))
             if c_rarity:
                 query += " AND c.\"c_rarity\" = %s"
                 params.append(c_rarity)
             
-            query += " ORDER BY c.\"c_name\""
+            # c_id 作為同名卡牌的排序鍵，確保分頁順序穩定
+            where_sql, where_params, order_sql, order_params = _keyset(['c."c_name"', 'c."c_id"'], after, limit)
+            query += where_sql + order_sql
+            params += where_params + order_params
             
-            cur.execute(query, tuple(params))
-            return cur.fetchall()
+            _execute(cur, query, tuple(params))
+            return _fetch_all(cur, columnar)
         
-def join_event(p_id, e_id, d_id):
-    SIZE_MAPPING = {
-        "POD": 8, "LOCAL": 16, "REGIONAL": 32, "MAJOR": 64
-    }
-    try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT "e_size" FROM "EVENT"
-                    WHERE "e_id" = %s
-                    FOR UPDATE
-                """, (e_id,))
-                event_row = cur.fetchone()
-                if not event_row:
-                    return {"success": False, "message": "賽事不存在"}
-                
-                e_size_str = event_row['e_size']
-                limit_qty = SIZE_MAPPING.get(e_size_str)
+# --- 效能優化：冪等寫入 (Idempotency-Key) ---
+# 用戶端逾時後以相同的 Idempotency-Key 重送購買或報名時，直接回傳第一次的結果，不會重複扣庫存或建立第二筆 SALES。
+# 結果與寫入在同一個交易內存進 IDEMPOTENCY_KEY (migration 0003)：交易 rollback 時 key 一起消失，重送會重新執行；
+# 第一次執行還沒 commit 時，相同 key 的 INSERT 會等在該列的鎖上，commit 後讀到結果 (跨 worker 也成立)。
+# 超過 IDEMPOTENCY_TTL 秒的 key 可重新使用，並由 purge_idempotency_keys 分批刪除。
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_PURGE_EVERY = 100  # 每儲存幾個結果清理一次過期的 key
+_idempotency_stored = 0
 
-                cur.execute("""
-                    SELECT COUNT(*) AS participate_cnt
-                    FROM "PLAYER_PARTICIPATES_EVENT_WITH_DECK"
-                    WHERE "e_id" = %s
-                """, (e_id,))
-                current_qty = cur.fetchone()['participate_cnt']
+class IdempotencyKeyReused(Exception):
+    """同一個 Idempotency-Key 用在參數不同的請求"""
 
-                if current_qty >= limit_qty:
-                    return {"success": False, "message": f"報名失敗：人數已滿 ({current_qty}/{limit_qty})"}
+def _fingerprint(request):
+    return hashlib.sha256(json.dumps(request, default=str).encode()).hexdigest()
 
-                cur.execute("""
-                    INSERT INTO "PLAYER_PARTICIPATES_EVENT_WITH_DECK" ("p_id", "e_id", "d_id") VALUES (%s, %s, %s)
-                """, (p_id, e_id, d_id))
-        return True
+def _idempotent(cur, endpoint, key, request, fn, *args):
+    """以 key 執行 fn(cur, *args) 一次，回傳 fn 的結果 (必須可轉成 JSON)；key 為 None 時直接執行"""
+    global _idempotency_stored
+    if key is None:
+        return fn(cur, *args)
+    fingerprint = _fingerprint(request)
+    cur.execute("""
+        INSERT INTO "IDEMPOTENCY_KEY" ("endpoint", "key", "fingerprint") VALUES (%s, %s, %s)
+        ON CONFLICT ("endpoint", "key") DO UPDATE
+            SET "fingerprint" = EXCLUDED."fingerprint", "result" = NULL, "created_at" = now()
+            WHERE "IDEMPOTENCY_KEY"."created_at" < now() - make_interval(secs => %s)
+        RETURNING 1
+    """, (endpoint, key, fingerprint, IDEMPOTENCY_TTL))
+    if cur.fetchone() is None:
+        # 已有未過期的結果 (READ COMMITTED：這個 SELECT 看得到剛 commit 的第一次執行)
+        cur.execute('SELECT "fingerprint", "result" FROM "IDEMPOTENCY_KEY" WHERE "endpoint" = %s AND "key" = %s',
+                    (endpoint, key))
+        row = cur.fetchone()
+        if row["fingerprint"] != fingerprint:
+            raise IdempotencyKeyReused(f"Idempotency-Key {key!r} was used with a different {endpoint} request")
+        return row["result"]
+    result = fn(cur, *args)
+    cur.execute('UPDATE "IDEMPOTENCY_KEY" SET "result" = %s WHERE "endpoint" = %s AND "key" = %s',
+                (json.dumps(result), endpoint, key))
+    _idempotency_stored += 1
+    if _idempotency_stored % IDEMPOTENCY_PURGE_EVERY == 0:
+        threading.Thread(target=purge_idempotency_keys, name="idempotency-purge", daemon=True).start()
+    return result
+
+def purge_idempotency_keys(batch=1000):
+    """分批刪除過期的 key，每批一個短交易，回傳刪除的數量"""
+    deleted = 0
+    try:
+        while True:
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        DELETE FROM "IDEMPOTENCY_KEY" WHERE ctid IN (
+                            SELECT ctid FROM "IDEMPOTENCY_KEY"
+                            WHERE "created_at" < now() - make_interval(secs => %s)
+                            LIMIT %s
+                        )
+                    """, (IDEMPOTENCY_TTL, batch))
+                    count = cur.rowcount
+            deleted += count
+            if count < batch:
+                return deleted
+    except Exception as e:
+        print(f"Idempotency purge error: {e}")
+        return deleted
+
+def join_event(p_id, e_id, d_id, idempotency_key=None):
+    try:
+        with get_db_connection(writes=("PLAYER_PARTICIPATES_EVENT_WITH_DECK",)) as conn:
+            with conn.cursor() as cur:
+                return _idempotent(cur, "join_event", idempotency_key, [p_id, e_id, d_id],
+                                   _join_event, p_id, e_id, d_id)
+    except (IdempotencyKeyReused, psycopg2.errors.QueryCanceled, ClientDisconnected):
+        # 逾時與斷線交給 main 回 503 / 499 (並計入 metrics)，前端才會以同一個 Idempotency-Key 重送
+        raise
     except Exception as e:
         print(f"{type(e).__name__}: {str(e)}")
         return False
+
+def _join_event(cur, p_id, e_id, d_id):
+    SIZE_MAPPING = {
+        "POD": 8, "LOCAL": 16, "REGIONAL": 32, "MAJOR": 64
+    }
+    cur.execute("""
+        SELECT "e_size" FROM "EVENT"
+        WHERE "e_id" = %s
+        FOR UPDATE
+    """, (e_id,))
+    event_row = cur.fetchone()
+    if not event_row:
+        return {"success": False, "message": "賽事不存在"}
+    
+    e_size_str = event_row['e_size']
+    limit_qty = SIZE_MAPPING.get(e_size_str)
+
+    cur.execute("""
+        SELECT COUNT(*) AS participate_cnt
+        FROM "PLAYER_PARTICIPATES_EVENT_WITH_DECK"
+        WHERE "e_id" = %s
+    """, (e_id,))
+    current_qty = cur.fetchone()['participate_cnt']
+
+    if current_qty >= limit_qty:
+        return {"success": False, "message": f"報名失敗：人數已滿 ({current_qty}/{limit_qty})"}
+
+    cur.execute("""
+        INSERT INTO "PLAYER_PARTICIPATES_EVENT_WITH_DECK" ("p_id", "e_id", "d_id") VALUES (%s, %s, %s)
+    """, (p_id, e_id, d_id))
+    return True
     
 def leave_event(p_id, e_id):
     try:
-        with get_db_connection() as conn:
+        with get_db_connection(writes=("PLAYER_PARTICIPATES_EVENT_WITH_DECK",)) as conn:
             with conn.cursor() as cur:
                 cur.execute("""
                     SELECT 1 FROM "PLAYER_PARTICIPATES_EVENT_WITH_DECK"
@@ -340,9 +1095,9 @@ def leave_event(p_id, e_id):
         print(f"{type(e).__name__}: {str(e)}")
         return {"success": False, "message": f"退出失敗: {str(e)}"}
 
-def get_player_participations_detailed(p_id):
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
+def get_player_participations_detailed(p_id, columnar=False):
+    with get_db_connection(readonly=True) as conn:
+        with _list_cursor(conn, columnar) as cur:
             sql = """
                 SELECT 
                     pped."p_id",
@@ -360,115 +1115,122 @@ def get_player_participations_detailed(p_id):
                 JOIN "DECK" AS d ON pped.d_id = d.d_id
                 WHERE pped.p_id = %s
             """
-            cur.execute(sql, (p_id,))
-            return cur.fetchall()
+            _execute(cur, sql, (p_id,))
+            return _fetch_all(cur, columnar)
         
-def buy_product(p_id, s_id, prod_id, buy_qty):
+def buy_product(p_id, s_id, prod_id, buy_qty, idempotency_key=None):
     """
     [購買交易]
     1. 扣除商店架上庫存
     2. 建立銷售紀錄 (SALES + SALES_DETAIL)
     3. (若是卡片) 將商品加入玩家庫存
+    idempotency_key: 重送同一個購買時回傳第一次的結果 (見 _idempotent)
     """
     try:
-        with get_db_connection() as conn:
+        with get_db_connection(writes=("SHOP_SELLS_PRODUCT", "SALES", "SALES_DETAIL", "PLAYER_HAS_CARD")) as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT "qty", "price" FROM "SHOP_SELLS_PRODUCT" 
-                    WHERE "s_id"=%s AND "prod_id"=%s 
-                    FOR UPDATE
-                """, (s_id, prod_id))
-                row = cur.fetchone()
-                
-                if not row:
-                    return {"success": False, "message": "商品已下架"}
-                
-                current_qty = row['qty'] if isinstance(row, dict) else row[0]
-                price = row['price'] if isinstance(row, dict) else row[1]
-                
-                if current_qty < buy_qty:
-                    return {"success": False, "message": f"庫存不足 (剩餘: {current_qty})"}
+                return _idempotent(cur, "buy_product", idempotency_key, [p_id, s_id, prod_id, buy_qty],
+                                   _buy_product, p_id, s_id, prod_id, buy_qty)
+    except (IdempotencyKeyReused, psycopg2.errors.QueryCanceled, ClientDisconnected):
+        # 逾時與斷線交給 main 回 503 / 499 (並計入 metrics)，前端才會以同一個 Idempotency-Key 重送
+        raise
+    except Exception as e:
+        print(f"Buy Error: {e}")
+        return {"success": False, "message": f"交易失敗: {str(e)}"}
 
-                cur.execute("""
-                    UPDATE "SHOP_SELLS_PRODUCT" 
-                    SET "qty" = "qty" - %s 
-                    WHERE "s_id"=%s AND "prod_id"=%s
-                """, (buy_qty, s_id, prod_id))
+def _buy_product(cur, p_id, s_id, prod_id, buy_qty):
+    cur.execute("""
+        SELECT "qty", "price" FROM "SHOP_SELLS_PRODUCT" 
+        WHERE "s_id"=%s AND "prod_id"=%s 
+        FOR UPDATE
+    """, (s_id, prod_id))
+    row = cur.fetchone()
+    
+    if not row:
+        return {"success": False, "message": "商品已下架"}
+    
+    current_qty = row['qty'] if isinstance(row, dict) else row[0]
+    price = row['price'] if isinstance(row, dict) else row[1]
+    
+    if current_qty < buy_qty:
+        return {"success": False, "message": f"庫存不足 (剩餘: {current_qty})"}
 
-                import datetime
-                now = datetime.datetime.now()
-                cur.execute("""
-                    INSERT INTO "SALES" ("datetime", "p_id", "s_id") 
-                    VALUES (%s, %s, %s) 
-                    RETURNING "sales_id"
-                """, (now, p_id, s_id))
-                
-                sales_row = cur.fetchone()
-                sales_id = sales_row['sales_id'] if isinstance(sales_row, dict) else sales_row[0]
+    cur.execute("""
+        UPDATE "SHOP_SELLS_PRODUCT" 
+        SET "qty" = "qty" - %s 
+        WHERE "s_id"=%s AND "prod_id"=%s
+    """, (buy_qty, s_id, prod_id))
 
-                cur.execute("""
-                    INSERT INTO "SALES_DETAIL" ("sales_id", "prod_id", "qty") 
-                    VALUES (%s, %s, %s)
-                """, (sales_id, prod_id, buy_qty))
-
-                cur.execute('SELECT "c_id" FROM "PRODUCT" WHERE "prod_id"=%s', (prod_id,))
-                prod_row = cur.fetchone()
-                target_c_id = prod_row['c_id'] if isinstance(prod_row, dict) else prod_row[0]
-
-                if target_c_id:
-                    cur.execute('SELECT 1 FROM "PLAYER_HAS_CARD" WHERE "p_id"=%s AND "c_id"=%s', (p_id, target_c_id))
-                    if cur.fetchone():
-                        cur.execute("""
-                            UPDATE "PLAYER_HAS_CARD" 
-                            SET "qty" = "qty" + %s 
-                            WHERE "p_id"=%s AND "c_id"=%s
-                        """, (buy_qty, p_id, target_c_id))
-                    else:
-                        cur.execute("""
-                            INSERT INTO "PLAYER_HAS_CARD" ("p_id", "c_id", "qty") 
-                            VALUES (%s, %s, %s)
-                        """, (p_id, target_c_id, buy_qty))
+    import datetime
+    now = datetime.datetime.now()
+    cur.execute("""
+        INSERT INTO "SALES" ("datetime", "p_id", "s_id") 
+        VALUES (%s, %s, %s) 
+        RETURNING "sales_id"
+    """, (now, p_id, s_id))
+    
+    sales_row = cur.fetchone()
+    sales_id = sales_row['sales_id'] if isinstance(sales_row, dict) else sales_row[0]
 
-                return {"success": True, "message": f"訂單成立！請支付 ${price * buy_qty} 給店家"}
+    cur.execute("""
+        INSERT INTO "SALES_DETAIL" ("sales_id", "prod_id", "qty") 
+        VALUES (%s, %s, %s)
+    """, (sales_id, prod_id, buy_qty))
 
-    except Exception as e:
-        print(f"Buy Error: {e}")
-        return {"success": False, "message": f"交易失敗: {str(e)}"}
+    cur.execute('SELECT "c_id" FROM "PRODUCT" WHERE "prod_id"=%s', (prod_id,))
+    prod_row = cur.fetchone()
+    target_c_id = prod_row['c_id'] if isinstance(prod_row, dict) else prod_row[0]
 
-# --- Shop Features ---
-def get_shop_inventory(s_id):
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
+    if target_c_id:
+        cur.execute('SELECT 1 FROM "PLAYER_HAS_CARD" WHERE "p_id"=%s AND "c_id"=%s', (p_id, target_c_id))
+        if cur.fetchone():
             cur.execute("""
+                UPDATE "PLAYER_HAS_CARD" 
+                SET "qty" = "qty" + %s 
+                WHERE "p_id"=%s AND "c_id"=%s
+            """, (buy_qty, p_id, target_c_id))
+        else:
+            cur.execute("""
+                INSERT INTO "PLAYER_HAS_CARD" ("p_id", "c_id", "qty") 
+                VALUES (%s, %s, %s)
+            """, (p_id, target_c_id, buy_qty))
+
+    return {"success": True, "message": f"訂單成立！請支付 ${price * buy_qty} 給店家"}
+
+# --- Shop Features ---
+def get_shop_inventory(s_id, limit=None, after=None, columnar=False):
+    where_sql, where_params, order_sql, order_params = _keyset(['sp."prod_id"'], after, limit)
+    with get_db_connection(readonly=True) as conn:
+        with _list_cursor(conn, columnar) as cur:
+            _execute(cur, """
                 SELECT p."prod_id", p."prod_name", p."prod_type", sp."qty", sp."price"
                 FROM "SHOP_SELLS_PRODUCT" sp
                 JOIN "PRODUCT" p ON sp."prod_id" = p."prod_id"
                 WHERE sp."s_id" = %s
-                ORDER BY p."prod_id"
-            """, (s_id,))
-            return cur.fetchall()
+            """ + where_sql + order_sql, (s_id, *where_params, *order_params))
+            return _fetch_all(cur, columnar)
 
-def get_shop_storage(s_id):
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
+def get_shop_storage(s_id, columnar=False):
+    with get_db_connection(readonly=True) as conn:
+        with _list_cursor(conn, columnar) as cur:
+            _execute(cur, """
                 SELECT p."prod_id", p."prod_name", p."prod_type", st."qty"
                 FROM "SHOP_STORES_PRODUCT" st
                 JOIN "PRODUCT" p ON st."prod_id" = p."prod_id"
                 WHERE st."s_id" = %s AND st."qty" > 0
                 ORDER BY p."prod_id"
             """, (s_id,))
-            return cur.fetchall()
+            return _fetch_all(cur, columnar)
 
-def get_all_products_list():
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute('SELECT "prod_id", "prod_name", "prod_type" FROM "PRODUCT"')
-            return cur.fetchall()
+def get_all_products_list(columnar=False):
+    with get_db_connection(readonly=True) as conn:
+        with _list_cursor(conn, columnar) as cur:
+            _execute(cur, 'SELECT "prod_id", "prod_name", "prod_type" FROM "PRODUCT"')
+            return _fetch_all(cur, columnar)
         
 def restock_shop_product(s_id, prod_id, qty):
     try:
-        with get_db_connection() as conn:
+        with get_db_connection(writes=("SHOP_STORES_PRODUCT",)) as conn:
             with conn.cursor() as cur:
                 # 檢查倉庫是否已有此商品
                 cur.execute('SELECT 1 FROM "SHOP_STORES_PRODUCT" WHERE "s_id"=%s AND "prod_id"=%s', (s_id, prod_id))
@@ -490,7 +1252,7 @@ def restock_shop_product(s_id, prod_id, qty):
 
 def move_product_to_shelf(s_id, prod_id, move_qty, price):
     try:
-        with get_db_connection() as conn:
+        with get_db_connection(writes=("SHOP_STORES_PRODUCT", "SHOP_SELLS_PRODUCT")) as conn:
             with conn.cursor() as cur:
                 # 1. 檢查倉庫庫存是否足夠
                 cur.execute('SELECT "qty" FROM "SHOP_STORES_PRODUCT" WHERE "s_id"=%s AND "prod_id"=%s', (s_id, prod_id))
@@ -533,7 +1295,7 @@ def move_product_to_shelf(s_id, prod_id, move_qty, price):
 
 def create_event(e_name, e_format, e_date, e_time, e_size, e_round, s_id):
     try:
-        with get_db_connection() as conn:
+        with get_db_connection(writes=("EVENT",)) as conn:
             with conn.cursor() as cur:
                 cur.execute("""
                     INSERT INTO "EVENT" ("e_name", "e_format", "e_date", "e_time", "e_size", "e_roundtype", "org_shop_id")
@@ -544,10 +1306,10 @@ def create_event(e_name, e_format, e_date, e_time, e_size, e_round, s_id):
         print(e)
         return False
 
-def get_sales_detail(s_id):
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
+def get_sales_detail(s_id, columnar=False):
+    with get_db_connection(readonly=True) as conn:
+        with _list_cursor(conn, columnar) as cur:
+            _execute(cur, """
                 SELECT 
                     sa."sales_id",
                     sa."datetime",
@@ -564,26 +1326,30 @@ def get_sales_detail(s_id):
                 WHERE sa."s_id" = %s
                 ORDER BY sa."datetime" DESC
             """, (s_id,))
-            return cur.fetchall()
+            return _fetch_all(cur, columnar)
 
 # --- Common Features ---
-def get_all_upcoming_events():
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
+def get_all_upcoming_events(limit=None, after=None, columnar=False):
+    where_sql, where_params, order_sql, order_params = _keyset(['e."e_date"', 'e."e_time"', 'e."e_id"'], after, limit)
+    with get_db_connection(readonly=True) as conn:
+        with _list_cursor(conn, columnar) as cur:
+            _execute(cur, """
                 SELECT e."e_id", e."e_name", e."e_date", e."e_time", e."e_size", e."e_format", e."e_roundtype", s."s_name", COUNT(p."p_id") as current_participants
                 FROM "EVENT" AS e
                 JOIN "SHOP" AS s ON e."org_shop_id" = s."s_id"
                 LEFT JOIN "PLAYER_PARTICIPATES_EVENT_WITH_DECK" AS p ON e."e_id" = p."e_id"
                 WHERE e."e_date" >= CURRENT_DATE
+            """ + where_sql + """
                 GROUP BY e."e_id", s."s_name"
-            """)
-            return cur.fetchall()
+            """ + order_sql, (*where_params, *order_params))
+            return _fetch_all(cur, columnar)
         
-def get_market_listings():
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
+def get_market_listings(limit=None, after=None, columnar=False):
+    # (price, s_id, prod_id) 為穩定的排序鍵：同價商品依店家、商品編號排序
+    where_sql, where_params, order_sql, order_params = _keyset(['sp."price"', 'sp."s_id"', 'sp."prod_id"'], after, limit)
+    with get_db_connection(readonly=True) as conn:
+        with _list_cursor(conn, columnar) as cur:
+            _execute(cur, """
                 SELECT 
                     sp."s_id", 
                     s."s_name", 
@@ -597,6 +1363,13 @@ def get_market_listings():
                 JOIN "PRODUCT" p ON sp."prod_id" = p."prod_id"
                 JOIN "SHOP" s ON sp."s_id" = s."s_id"
                 WHERE sp."qty" > 0
-                ORDER BY sp."price" ASC
-            """)
-            return cur.fetchall()
\ No newline at end of file
+            """ + where_sql + order_sql, (*where_params, *order_params))
+            return _fetch_all(cur, columnar)
+
+# warm_up(prime=True) 預先執行一次的熱門讀取查詢 (首頁會用到的第一頁)
+_PRIME_QUERIES = [
+    lambda: get_market_listings(limit=50, columnar=True),
+    lambda: get_all_upcoming_events(limit=50, columnar=True),
+    lambda: get_all_card_names_and_ids(columnar=True),
+    lambda: get_all_products_list(columnar=True),
+]
\ No newline at end of file
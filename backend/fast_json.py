@@ -0,0 +1,35 @@
+"""
+以 orjson 序列化的 JSON 回應。
+
+FastAPI 預設會先用 jsonable_encoder 逐層走訪每一個 dict 再交給 json.dumps，
+列表 API 改為直接回傳這裡的 Response，datetime / date / time 由 orjson 原生處理，
+Decimal 則透過 default hook 轉換，結果與 jsonable_encoder 相同。
+"""
+from decimal import Decimal
+import orjson
+from fastapi.responses import JSONResponse
+
+# 欄式 JSON：一份欄位名稱 + 每列一個 array，不為每一列重複欄位名稱
+COLUMNS_MEDIA_TYPE = "application/vnd.tcg.columns+json"
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        # 與 fastapi.encoders.decimal_encoder 一致：整數值轉 int，其餘轉 float
+        return int(obj) if obj.as_tuple().exponent >= 0 else float(obj)
+    raise TypeError
+
+def dumps(content):
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content):
+        return dumps(content)
+
+def records(result):
+    """db.ColumnarRows -> 預設的 list of objects 格式"""
+    columns = result.columns
+    return [dict(zip(columns, row)) for row in result.rows]
+
+def columns_payload(result):
+    """db.ColumnarRows -> {"columns": [...], "rows": [[...], ...]}"""
+    return {"columns": result.columns, "rows": result.rows}
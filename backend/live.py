@@ -0,0 +1,130 @@
+"""
+即時更新 (Server-Sent Events)：賽事報名人數與商城庫存變動時主動推送給正在看的頁面，
+取代前端不斷重新整理 /events (含 GROUP BY) 與 /market。
+
+資料來源為資料庫 trigger (migration 0004)：PLAYER_PARTICIPATES_EVENT_WITH_DECK 或 SHOP_SELLS_PRODUCT 有變動時，
+在同一個交易內以 pg_notify 送到 CHANNEL：
+    {"topic": "events", "e_id": ..., "participants": ...}
+    {"topic": "market", "s_id": ..., "prod_id": ..., "qty": ..., "price": ...}   (下架時 qty 為 0)
+通知在 commit 後才送達，rollback 的寫入不會推送；不論寫入來自哪個 worker 或直接執行的 SQL 都會推送。
+每個 worker 只用 broadcast 的那一條 LISTEN 連線，收到後在 event loop 上分送給所有訂閱者。
+每個訂閱者只保留每個 key (e_id 或 s_id + prod_id) 的最新值，每 LIVE_INTERVAL 秒最多送出一次，
+報名湧入時慢的用戶端不會累積訊息。LISTEN 中斷後重新連上時送出 resync 事件：期間可能漏掉變動，用戶端應重新讀取 API。
+設定 LIVE_UPDATES=1 才啟用 (需先套用 migration 0004，並多用一條 LISTEN 連線)。
+"""
+import asyncio
+import json
+import os
+from dotenv import load_dotenv
+from . import metrics
+
+load_dotenv()
+
+ENABLED = os.getenv("LIVE_UPDATES", "0") == "1"
+CHANNEL = "tcg_live"  # 與 migrations/0004_live_notify_triggers.sql 相同
+LIVE_INTERVAL = float(os.getenv("LIVE_INTERVAL", "0.5"))
+LIVE_MAX_SUBSCRIBERS = int(os.getenv("LIVE_MAX_SUBSCRIBERS", "1000"))
+HEARTBEAT = 15  # 秒，讓 proxy 與用戶端的讀取逾時不會在沒有變動時斷線
+
+TOPICS = {"events": ("e_id",), "market": ("s_id", "prod_id")}
+
+_loop = None
+_subscribers = {topic: set() for topic in TOPICS}
+_stats = {"notifications": 0, "sent": 0}
+
+class _Subscriber:
+    __slots__ = ("topic", "field", "values", "pending", "resync", "wake")
+
+    def __init__(self, topic, field=None, values=None):
+        self.topic = topic
+        self.field = field    # 只推送 msg[field] 在 values 內的變動，None 表示全部
+        self.values = values
+        self.pending = {}     # key -> 最新的訊息
+        self.resync = False
+        self.wake = asyncio.Event()
+
+    def push(self, key, msg):
+        if self.values is None or msg.get(self.field) in self.values:
+            self.pending[key] = msg
+            self.wake.set()
+
+def _fanout(msg):
+    fields = TOPICS.get(msg.get("topic"))
+    if fields is None:
+        return
+    key = tuple(msg.get(f) for f in fields)
+    for subscriber in _subscribers[msg["topic"]]:
+        subscriber.push(key, msg)
+
+def _resync():
+    for subscribers in _subscribers.values():
+        for subscriber in subscribers:
+            subscriber.resync = True
+            subscriber.pending.clear()
+            subscriber.wake.set()
+
+# --- 由 broadcast 的 listener 執行緒呼叫 ---
+def on_notify(payload):
+    _stats["notifications"] += 1
+    if _loop is None:
+        return
+    try:
+        msg = json.loads(payload)
+    except ValueError:
+        return
+    _loop.call_soon_threadsafe(_fanout, msg)
+
+def on_reconnect():
+    if _loop is not None:
+        _loop.call_soon_threadsafe(_resync)
+
+# --- SSE ---
+def full():
+    return sum(len(s) for s in _subscribers.values()) >= LIVE_MAX_SUBSCRIBERS
+
+def _event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def stream(topic, field=None, values=None):
+    """SSE 內容 (StreamingResponse 的 async generator)；用戶端斷線時 Starlette 會取消這個 generator"""
+    subscriber = _Subscriber(topic, field, values)
+    _subscribers[topic].add(subscriber)
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                await asyncio.wait_for(subscriber.wake.wait(), HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            subscriber.wake.clear()
+            if subscriber.resync:
+                subscriber.resync = False
+                yield _event("resync", {})
+            pending, subscriber.pending = subscriber.pending, {}
+            if pending:
+                _stats["sent"] += len(pending)
+                yield "".join(_event(topic, msg) for msg in pending.values())
+            await asyncio.sleep(LIVE_INTERVAL)
+    finally:
+        _subscribers[topic].discard(subscriber)
+
+def start():
+    """lifespan 內呼叫：記下 worker 的 event loop，listener 執行緒把通知交給它分送"""
+    global _loop
+    _loop = asyncio.get_running_loop()
+
+def stop():
+    global _loop
+    _loop = None
+
+def _live_metrics():
+    if not ENABLED:
+        return []
+    return [
+        ("tcg_live_subscribers", "gauge", "SSE 訂閱者數", [({"topic": t}, len(s)) for t, s in _subscribers.items()]),
+        ("tcg_live_notifications_total", "counter", "收到的資料庫變動通知數", [({}, _stats["notifications"])]),
+        ("tcg_live_messages_sent_total", "counter", "送給訂閱者的更新數 (合併後)", [({}, _stats["sent"])]),
+    ]
+
+metrics.register(_live_metrics)
@@ -1,10 +1,325 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
 from typing import List, Optional
-import bcrypt
+from email.utils import formatdate, parsedate_to_datetime
+import asyncio
+import base64
+import datetime
+import functools
+import hashlib
+import json
+import os
+import threading
+import psycopg2.errors
 from . import db
-
-app = FastAPI()
+from . import admission
+from . import arrow_ipc
+from . import broadcast
+from . import capture
+from . import fast_json
+from . import live
+from . import metrics
+from . import passwords
+from . import sessions
+from . import singleflight
+from . import table_versions
+from . import tracing
+
+# --- 資源生命週期 (Lifespan) ---
+# 啟動時不等待任何外部服務：PostgreSQL 連線池與 MongoDB 都在第一次使用時才建立並自動重試，
+# 即使 Atlas 無法連線，冷啟動與 worker 重新載入也只需幾毫秒。
+# DB_WARMUP > 0 時於背景預先建立該數量的連線，DB_PRIME=1 時另外預先執行熱門查詢。
+DB_WARMUP = int(os.getenv("DB_WARMUP", "0"))
+DB_PRIME = os.getenv("DB_PRIME", "0") == "1"
+
+def _warm_up():
+    try:
+        db.warm_up(DB_WARMUP, prime=DB_PRIME)
+    except Exception as e:
+        print(f"Warm-up skipped: {e}")
+
+# 多行程模式：資料表版本號與登入 session 透過 broadcast 在 worker 之間同步
+if broadcast.ENABLED:
+    broadcast.subscribe("versions", lambda msg: table_versions.bump(*msg["tables"]))
+    broadcast.subscribe("session", sessions.apply)
+    # LISTEN 中斷期間可能漏掉其他 worker 的寫入
+    broadcast.on_reconnect(table_versions.reset)
+    sessions.publisher = lambda **fields: db.publish("session", **fields)
+
+# 即時更新：trigger 的通知與 worker 之間的廣播共用同一條 LISTEN 連線
+if live.ENABLED:
+    broadcast.listen(live.CHANNEL, live.on_notify)
+    broadcast.on_reconnect(live.on_reconnect)
+
+@asynccontextmanager
+async def lifespan(app):
+    # 所有資源都在 worker 行程內才建立 (fork 之後)
+    db.start_mongo_writer()
+    live.start()
+    broadcast.start(db.DIRECT_DB_CONFIG)
+    metrics.start()
+    capture.start()
+    if DB_WARMUP:
+        threading.Thread(target=_warm_up, name="db-warmup", daemon=True).start()
+    yield
+    capture.stop()
+    metrics.stop()
+    broadcast.stop()
+    live.stop()
+    db.stop_mongo_writer()
+    db.close_pool()
+    passwords.shutdown()
+
+# --- 效能優化：Statement Timeout 與用戶端斷線時取消查詢 ---
+# 各路由的 statement timeout (毫秒)，未列出的路由使用 db.DB_STATEMENT_TIMEOUT_MS。
+# 瀏覽用的讀取短於前端的讀取逾時 (GET 5 秒)：前端放棄之前資料庫先放棄，不替沒有人等待的請求繼續掃描；
+# 寫入可能在資料列鎖上排隊，給較寬的上限 (前端 POST 逾時為 15 秒)。
+STATEMENT_TIMEOUTS = {
+    "/cards": 2000,
+    "/market": 2000,
+    "/events": 2000,
+    "/shop/{s_id}/sales_detail": 4000,
+    "/market/buy": 10000,
+    "/player/join_event": 10000,
+}
+
+def _route_path(scope, default=None):
+    return getattr(scope.get("route"), "path", default)
+
+class CancelOnDisconnectMiddleware:
+    """
+    純 ASGI middleware：以背景 task 持續讀取 receive，回應開始前收到 http.disconnect 時，
+    對該請求使用中的連線送出 cancel，之後的查詢也不再執行 (見 db.RequestQueries)。
+    查詢因此以 db.ClientDisconnected 結束時回 499 (nginx 慣例，用戶端已離開，不會真的收到)。
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        queries = db.RequestQueries(lambda: STATEMENT_TIMEOUTS.get(_route_path(scope)))
+        messages = asyncio.Queue()
+        started = [False]
+
+        async def listen():
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    if not started[0]:
+                        metrics.observe_disconnect(_route_path(scope, "unmatched"))
+                        # cancel request 需要另開一條到資料庫的連線，不在 event loop 上執行
+                        await asyncio.get_running_loop().run_in_executor(None, queries.cancel)
+                    return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                started[0] = True
+            await send(message)
+
+        listener = asyncio.create_task(listen())
+        try:
+            with db.track_request(queries):
+                await self.app(scope, messages.get, send_wrapper)
+        except db.ClientDisconnected:
+            if not started[0]:
+                await send({"type": "http.response.start", "status": 499, "headers": []})
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            listener.cancel()
+
+app = FastAPI(lifespan=lifespan)
+# 排隊中斷線的請求放行後由 CancelOnDisconnectMiddleware 在第一個查詢前結束；trace 與 metrics 包含排隊時間
+app.add_middleware(admission.AdmissionMiddleware)
+app.add_middleware(CancelOnDisconnectMiddleware)
+app.add_middleware(tracing.TracingMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(capture.CaptureMiddleware)
+
+@app.exception_handler(psycopg2.errors.QueryCanceled)
+async def statement_timeout_handler(request, exc):
+    """讀取超過該路由的 statement timeout：回 503 讓用戶端稍後重試，而不是 500"""
+    return JSONResponse({"detail": "Query timed out"}, status_code=503, headers={"Retry-After": "1"})
+
+# --- 效能優化：Keyset 分頁 ---
+# 單頁上限，避免一次回傳整張表
+MAX_PAGE_SIZE = 200
+
+# cursor 內各排序鍵的型別：日期與時間以 ISO 字串保存，未列出的為 INTEGER 欄位 (ID、價格)。
+# 型別不符時回 400，不讓格式正確但內容錯誤的 cursor 到資料庫轉型失敗變成 500
+CURSOR_TYPES = {
+    "卡牌名稱": str,
+    "e_date": datetime.date.fromisoformat,
+    "e_time": datetime.time.fromisoformat,
+}
+
+def _valid_cursor_value(key, value):
+    kind = CURSOR_TYPES.get(key, int)
+    if kind is int:
+        return type(value) is int and -2**31 <= value < 2**31
+    if not isinstance(value, str):
+        return False
+    try:
+        kind(value)
+    except ValueError:
+        return False
+    return True
+
+def _decode_cursor(cursor, keys):
+    """將 X-Next-Cursor 還原成上一頁最後一筆的排序鍵"""
+    if not cursor:
+        return None
+    try:
+        after = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if (not isinstance(after, list) or len(after) != len(keys)
+            or not all(_valid_cursor_value(key, value) for key, value in zip(keys, after))):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return tuple(after)
+
+def _page_limit(limit):
+    return limit + 1 if limit else None
+
+def _paginate(rows, limit, keys, headers):
+    """
+    分頁時 db 以 limit + 1 筆查詢，多出來的一筆代表還有下一頁，
+    此時將本頁最後一筆的排序鍵編碼後放進 X-Next-Cursor header。
+    """
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        last_key = json.dumps([rows[-1][k] for k in keys], default=str)
+        headers["X-Next-Cursor"] = base64.urlsafe_b64encode(last_key.encode()).decode()
+    return rows
+
+# --- 效能優化：列表回應格式 (Content Negotiation) ---
+def _list_response(request, rows, limit=None, keys=None):
+    """
+    列表 API 的共用回應，rows 為 tuple cursor 查詢的 db.ColumnarRows。
+    依 Accept header 回傳 Arrow IPC 或欄式 JSON，預設為 list of objects 的 JSON，
+    皆不經過 jsonable_encoder。
+    """
+    headers = {"Vary": "Accept"}
+    rows = _paginate(rows, limit, keys, headers)
+
+    accept = request.headers.get("accept", "")
+    if arrow_ipc.available() and arrow_ipc.MEDIA_TYPE in accept:
+        return Response(content=arrow_ipc.encode(rows), media_type=arrow_ipc.MEDIA_TYPE, headers=headers)
+    if fast_json.COLUMNS_MEDIA_TYPE in accept:
+        return fast_json.FastJSONResponse(fast_json.columns_payload(rows), headers=headers,
+                                          media_type=fast_json.COLUMNS_MEDIA_TYPE)
+    return fast_json.FastJSONResponse(fast_json.records(rows), headers=headers)
+
+def _view_response(request, parts, headers):
+    """
+    聚合 API 的共用回應：{名稱: 資料}，其中 db.ColumnarRows 依 Accept 轉成欄式 JSON
+    或 list of objects，其餘值 (例如選定的 d_id) 原樣輸出。
+    一次回應包含多個表格，因此不提供 Arrow IPC。
+    """
+    headers["Vary"] = "Accept"
+    columnar = fast_json.COLUMNS_MEDIA_TYPE in request.headers.get("accept", "")
+    encode = fast_json.columns_payload if columnar else fast_json.records
+    payload = {name: encode(value) if isinstance(value, db.ColumnarRows) else value
+               for name, value in parts.items()}
+    if columnar:
+        return fast_json.FastJSONResponse(payload, headers=headers, media_type=fast_json.COLUMNS_MEDIA_TYPE)
+    return fast_json.FastJSONResponse(payload, headers=headers)
+
+# --- 效能優化：HTTP 條件式快取 (ETag / 304) 與請求合併 (Single-flight) ---
+# 相同 ETag 的並行讀取共用同一次查詢；SINGLEFLIGHT_TTL > 0 時另外保留結果數秒 (micro-cache)。
+# ETag 已包含資料表版本號，寫入後 key 隨之改變，不會讀到寫入前的結果。
+# leader 的用戶端斷線時，等待中的請求改由其中一個重新查詢，不共用 ClientDisconnected。
+# 等待中的請求最多等 SINGLEFLIGHT_MAX_WAIT 秒，leader 的查詢卡住時改為自己查詢 (套用自己的 statement timeout)；
+# 自己的用戶端斷線時立即放棄等待 (499)，不佔著 threadpool。
+read_flight = singleflight.SingleFlight(ttl=float(os.getenv("SINGLEFLIGHT_TTL", "0")),
+                                        retry_on=(db.ClientDisconnected,),
+                                        max_wait=float(os.getenv("SINGLEFLIGHT_MAX_WAIT", "2")),
+                                        check=db.check_cancelled)
+
+def _coalescing_metrics():
+    stats = read_flight.stats()
+    return [
+        ("tcg_singleflight_total", "counter", "讀取請求合併統計 (executed 為實際執行的查詢數)",
+         [({"result": result}, stats[result]) for result in ("executed", "coalesced", "cache_hits", "wait_timeouts")]),
+        ("tcg_singleflight_in_flight", "gauge", "執行中的合併查詢", [({}, stats["in_flight"])]),
+    ]
+
+metrics.register(_coalescing_metrics)
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return last_modified <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def conditional(*tables, daily=False):
+    """
+    讀取 API 的條件式快取。tables 為此 API 查詢的資料表，
+    ETag 由這些資料表的版本號 + URL + Accept 組成；用戶端帶著相同的 If-None-Match 時，
+    直接回 304 而不執行查詢。daily=True 表示結果會隨日期改變 (例如 CURRENT_DATE 篩選)。
+    ETag 相同的並行請求透過 read_flight 合併成一次執行。
+    被裝飾的 route 必須有 request 參數並回傳 Response。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            request = kwargs["request"]
+            # 先取版本再查詢：查詢期間若有寫入，下次比對時版本已不同，不會回傳過期資料
+            versions, last_modified = table_versions.snapshot(tables)
+            key = [table_versions.BOOT_ID, versions, str(request.url.path), str(request.url.query),
+                   request.headers.get("accept", "")]
+            if daily:
+                today = datetime.date.today()
+                key.append(today.isoformat())
+                # 只帶 If-Modified-Since 的用戶端在跨日後也要重新取得：Last-Modified 不早於今天 0 點
+                last_modified = max(last_modified, datetime.datetime.combine(today, datetime.time()).timestamp())
+            etag = '"' + hashlib.sha1(repr(key).encode()).hexdigest()[:20] + '"'
+            headers = {
+                "ETag": etag,
+                "Last-Modified": formatdate(last_modified, usegmt=True),
+                "Cache-Control": "no-cache",
+                "Vary": "Accept",
+            }
+            if _not_modified(request, etag, last_modified):
+                return Response(status_code=304, headers=headers)
+
+            # read-your-writes：剛被寫入的資料表改讀主資料庫，replica 可能還沒重播到這次寫入
+            pinned = db.REPLICA_CONFIG is not None and table_versions.modified_within(tables, db.DB_PIN_SECONDS)
+
+            def render():
+                with db.pin_primary(pinned):
+                    response = func(*args, **kwargs)
+                return response.status_code, response.body, dict(response.headers)
+
+            status_code, body, response_headers = read_flight.do(etag, render)
+            response = Response(content=body, status_code=status_code, headers=response_headers)
+            response.headers.update(headers)
+            return response
+        return wrapper
+    return decorator
+
+# --- 效能優化：冪等寫入 (Idempotency-Key) ---
+# 購買與報名接受 Idempotency-Key header：用戶端可以用較短的逾時並安全地重送，
+# 相同 key 的重送直接取得第一次的結果 (見 db._idempotent)。
+IDEMPOTENCY_KEY_HEADER = Header(None, min_length=1, max_length=255)
+
+def _idempotent_call(fn, *args, idempotency_key=None):
+    try:
+        return fn(*args, idempotency_key=idempotency_key)
+    except db.IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
 # --- Pydantic Models ---
 class LoginRequest(BaseModel):
@@ -74,59 +389,99 @@ class UpsertDeckCardRequest(BaseModel):
     qty: int # 數量設為 0 時會被刪除
 
 # --- Auth Routes ---
+# 登入 / 註冊為 async route：bcrypt 交給 passwords 的 process pool，資料庫查詢交給 threadpool，
+# 等待 bcrypt 時不佔用任何 threadpool worker。
+def _bearer_token(authorization):
+    if authorization and authorization.lower().startswith("bearer "):
+        return authorization[7:].strip()
+    return None
+
 @app.post("/login")
-def login(data: LoginRequest):
+async def login(data: LoginRequest):
     user = None
     if data.role == "player":
-        user = db.get_player_by_email(data.username)
+        user = await run_in_threadpool(db.get_player_by_email, data.username)
     else:
-        user = db.get_shop_by_name(data.username)
+        user = await run_in_threadpool(db.get_shop_by_name, data.username)
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    if bcrypt.checkpw(data.password.encode('utf-8'), user['password'].encode('utf-8')):
+    if await passwords.check_password(data.password, user['password']):
         del user['password']
-        return {"status": "success", "user": user, "role": "player" if data.role == "player" else "shop"}
+        role = "player" if data.role == "player" else "shop"
+        token = await run_in_threadpool(sessions.create, {"user": user, "role": role})
+        return {"status": "success", "user": user, "role": role, "token": token}
     else:
         raise HTTPException(status_code=401, detail="Wrong password")
 
 @app.post("/register")
-def register(data: RegisterRequest):
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(data.password.encode('utf-8'), salt).decode('utf-8')
-    
+async def register(data: RegisterRequest):
     success = False
     if data.role == "player":
-        if db.get_player_by_email(data.account_id):
+        if await run_in_threadpool(db.get_player_by_email, data.account_id):
             raise HTTPException(status_code=400, detail="Email taken")
-        success = db.create_player(data.name, data.account_id, hashed)
+        hashed = await passwords.hash_password(data.password)
+        success = await run_in_threadpool(db.create_player, data.name, data.account_id, hashed)
     else:
-        if db.get_shop_by_name(data.account_id):
+        if await run_in_threadpool(db.get_shop_by_name, data.account_id):
             raise HTTPException(status_code=400, detail="Shop name taken")
-        success = db.create_shop(data.account_id, data.extra_info, data.phone, hashed)
+        hashed = await passwords.hash_password(data.password)
+        success = await run_in_threadpool(db.create_shop, data.account_id, data.extra_info, data.phone, hashed)
     
     if success:
         return {"status": "success"}
     raise HTTPException(status_code=500, detail="DB Error")
 
+@app.get("/session")
+def get_session(authorization: Optional[str] = Header(None)):
+    """以登入時取得的 token 取回登入資訊，用戶端重新造訪時不必再送出密碼"""
+    session = sessions.get(_bearer_token(authorization))
+    if session is None:
+        raise HTTPException(status_code=401, detail="Session expired")
+    return {"status": "success", "user": session["user"], "role": session["role"]}
+
+@app.post("/logout")
+def logout(authorization: Optional[str] = Header(None)):
+    token = _bearer_token(authorization)
+    if token:
+        sessions.revoke(token)
+    return {"status": "success"}
+
 # --- Player Routes ---
 @app.get("/player/{p_id}/cards")
-def get_cards(p_id: int):
-    return db.get_player_cards(p_id)
+@conditional("PLAYER_HAS_CARD", "CARD")
+def get_cards(
+    p_id: int,
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="每頁筆數"),
+    cursor: Optional[str] = Query(None, description="上一頁回傳的 X-Next-Cursor")
+):
+    keys = ["c_id"]
+    rows = db.get_player_cards(p_id, _page_limit(limit), _decode_cursor(cursor, keys), columnar=True)
+    return _list_response(request, rows, limit, keys)
 
 @app.get("/cards")
+@conditional("CARD", "SERIES")
 def get_all_cards(
+    request: Request,
     name: Optional[str] = Query(None, description="卡牌名稱關鍵字"),
     card_type: Optional[List[str]] = Query(None, description="卡牌類型"),
-    rarity: Optional[str] = Query(None, description="稀有度")
+    rarity: Optional[str] = Query(None, description="稀有度"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="每頁筆數"),
+    cursor: Optional[str] = Query(None, description="上一頁回傳的 X-Next-Cursor")
 ):
     # 如果有任何篩選參數，則呼叫 filter_cards
     if name or card_type or rarity:
-        return db.filter_cards(name, card_type, rarity)
+        keys = ["卡牌名稱", "c_id"]
+        rows = db.filter_cards(name, card_type, rarity, _page_limit(limit), _decode_cursor(cursor, keys),
+                               columnar=True)
+        return _list_response(request, rows, limit, keys)
     
     # 否則回傳精簡列表（供前端的 SelectBox 使用）
-    return db.get_all_card_names_and_ids()
+    keys = ["c_id"]
+    rows = db.get_all_card_names_and_ids(_page_limit(limit), _decode_cursor(cursor, keys), columnar=True)
+    return _list_response(request, rows, limit, keys)
 
 @app.post("/player/add_card")
 def add_card(data: AlterCardRequest):
@@ -141,8 +496,9 @@ def remove_card(data: AlterCardRequest):
     raise HTTPException(status_code=500, detail="Failed to delete card")
 
 @app.get("/player/{p_id}/decks")
-def get_decks(p_id: int):
-    return db.get_player_decks(p_id)
+@conditional("DECK", "PLAYER_BUILDS_DECK")
+def get_decks(p_id: int, request: Request):
+    return _list_response(request, db.get_player_decks(p_id, columnar=True))
 
 @app.post("/player/create_deck")
 def create_deck(data: CreateDeckRequest):
@@ -157,16 +513,18 @@ def remove_deck(data: RemoveDeckRequest):
     raise HTTPException(status_code=500, detail="Failed to remove deck")
 
 @app.get("/player/{p_id}/events")
-def get_player_events(p_id: int):
-    return db.get_player_participations_detailed(p_id)
+@conditional("PLAYER_PARTICIPATES_EVENT_WITH_DECK", "EVENT", "SHOP", "DECK")
+def get_player_events(p_id: int, request: Request):
+    return _list_response(request, db.get_player_participations_detailed(p_id, columnar=True))
 
 @app.post("/player/join_event")
-def join_event(data: JoinEventRequest):
-    result = db.join_event(data.p_id, data.e_id, data.d_id)
+def join_event(data: JoinEventRequest, idempotency_key: Optional[str] = IDEMPOTENCY_KEY_HEADER):
+    result = _idempotent_call(db.join_event, data.p_id, data.e_id, data.d_id, idempotency_key=idempotency_key)
     if result is True:
         return {"status": "success"}
-    elif isinstance(result, dict) and "error" in result:
-        raise HTTPException(status_code=400, detail=result["error"])
+    elif isinstance(result, dict):
+        # 賽事不存在或人數已滿：報名被拒絕，不是伺服器錯誤
+        raise HTTPException(status_code=400, detail=result.get("message") or result.get("error"))
     raise HTTPException(status_code=500, detail="Failed to join event")
 
 @app.post("/player/leave_event")
@@ -180,8 +538,9 @@ def leave_event(data: LeaveEventRequest):
 
 # --- 取得牌組組成 ---
 @app.get("/deck/{d_id}/composition")
-def get_deck_composition(d_id: int):
-    return db.get_deck_composition(d_id)
+@conditional("DECK_CONSISTS_OF_CARD", "CARD")
+def get_deck_composition(d_id: int, request: Request):
+    return _list_response(request, db.get_deck_composition(d_id, columnar=True))
 
 # --- 新增卡片到牌組 ---
 @app.post("/deck/add_card")
@@ -192,21 +551,32 @@ def add_card_to_deck(data: UpsertDeckCardRequest):
 
 # --- 查詢缺卡 ---
 @app.get("/player/{p_id}/decks/{d_id}/missing_cards")
-def get_missing_deck_cards(p_id: int, d_id: int):
-    return db.get_missing_cards_for_deck(p_id, d_id)
+@conditional("DECK_CONSISTS_OF_CARD", "CARD", "PLAYER_HAS_CARD")
+def get_missing_deck_cards(p_id: int, d_id: int, request: Request):
+    return _list_response(request, db.get_missing_cards_for_deck(p_id, d_id, columnar=True))
 
 # --- Shop Routes ---
 @app.get("/shop/{s_id}/products")
-def get_shop_inventory(s_id: int):
-    return db.get_shop_inventory(s_id)
+@conditional("SHOP_SELLS_PRODUCT", "PRODUCT")
+def get_shop_inventory(
+    s_id: int,
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="每頁筆數"),
+    cursor: Optional[str] = Query(None, description="上一頁回傳的 X-Next-Cursor")
+):
+    keys = ["prod_id"]
+    rows = db.get_shop_inventory(s_id, _page_limit(limit), _decode_cursor(cursor, keys), columnar=True)
+    return _list_response(request, rows, limit, keys)
 
 @app.get("/shop/{s_id}/storage")
-def get_shop_storage(s_id: int):
-    return db.get_shop_storage(s_id)
+@conditional("SHOP_STORES_PRODUCT", "PRODUCT")
+def get_shop_storage(s_id: int, request: Request):
+    return _list_response(request, db.get_shop_storage(s_id, columnar=True))
 
 @app.get("/products_list")
-def get_products_list():
-    return db.get_all_products_list()
+@conditional("PRODUCT")
+def get_products_list(request: Request):
+    return _list_response(request, db.get_all_products_list(columnar=True))
 
 @app.post("/shop/restock")
 def restock_shop_product(data: RestockRequest):
@@ -229,17 +599,26 @@ def create_event(data: CreateEventRequest):
     raise HTTPException(status_code=500, detail="Failed to create event")
 
 @app.get("/shop/{s_id}/sales_detail")
-def get_sales_detail(s_id: int):
-    return db.get_sales_detail(s_id)
+@conditional("SALES", "SALES_DETAIL", "PLAYER", "PRODUCT")
+def get_sales_detail(s_id: int, request: Request):
+    return _list_response(request, db.get_sales_detail(s_id, columnar=True))
 
 # --- Public Routes ---
 @app.get("/market")
-def get_market_listings():
-    return db.get_market_listings()
+@conditional("SHOP_SELLS_PRODUCT", "PRODUCT", "SHOP")
+def get_market_listings(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="每頁筆數"),
+    cursor: Optional[str] = Query(None, description="上一頁回傳的 X-Next-Cursor")
+):
+    keys = ["price", "s_id", "prod_id"]
+    rows = db.get_market_listings(_page_limit(limit), _decode_cursor(cursor, keys), columnar=True)
+    return _list_response(request, rows, limit, keys)
 
 @app.post("/market/buy")
-def buy_product(data: BuyProductRequest):
-    result = db.buy_product(data.p_id, data.s_id, data.prod_id, data.qty)
+def buy_product(data: BuyProductRequest, idempotency_key: Optional[str] = IDEMPOTENCY_KEY_HEADER):
+    result = _idempotent_call(db.buy_product, data.p_id, data.s_id, data.prod_id, data.qty,
+                              idempotency_key=idempotency_key)
     
     if result["success"]:
         return {"status": "success", "message": result["message"]}
@@ -247,5 +626,121 @@ def buy_product(data: BuyProductRequest):
     raise HTTPException(status_code=400, detail=result["message"])
 
 @app.get("/events")
-def get_events():
-    return db.get_all_upcoming_events()
\ No newline at end of file
+@conditional("EVENT", "SHOP", "PLAYER_PARTICIPATES_EVENT_WITH_DECK", daily=True)
+def get_events(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="每頁筆數"),
+    cursor: Optional[str] = Query(None, description="上一頁回傳的 X-Next-Cursor")
+):
+    keys = ["e_date", "e_time", "e_id"]
+    rows = db.get_all_upcoming_events(_page_limit(limit), _decode_cursor(cursor, keys), columnar=True)
+    return _list_response(request, rows, limit, keys)
+
+# --- 效能優化：頁面聚合 API (View Routes) ---
+# 前端一個頁面需要的資料一次取回：所有查詢在 db.read_snapshot() 內共用一條連線與同一個唯讀快照，
+# 省去多次 HTTP 往返與 pool checkout，各表格之間也不會因中途的寫入而不一致。
+@app.get("/views/player/{p_id}/event_registration")
+@conditional("EVENT", "SHOP", "PLAYER_PARTICIPATES_EVENT_WITH_DECK", "DECK", "PLAYER_BUILDS_DECK", daily=True)
+def get_event_registration_view(
+    p_id: int,
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="賽事每頁筆數"),
+    cursor: Optional[str] = Query(None, description="上一頁回傳的 X-Next-Cursor (賽事列表)")
+):
+    """賽事報名頁：即將舉行的賽事 (分頁)、玩家的牌組、玩家已報名的賽事"""
+    keys = ["e_date", "e_time", "e_id"]
+    after = _decode_cursor(cursor, keys)
+    with db.read_snapshot():
+        events = db.get_all_upcoming_events(_page_limit(limit), after, columnar=True)
+        decks = db.get_player_decks(p_id, columnar=True)
+        participations = db.get_player_participations_detailed(p_id, columnar=True)
+    headers = {}
+    events = _paginate(events, limit, keys, headers)
+    return _view_response(request, {"events": events, "decks": decks, "participations": participations}, headers)
+
+@app.get("/views/player/{p_id}/deck_builder")
+@conditional("DECK", "PLAYER_BUILDS_DECK", "CARD", "SERIES", "DECK_CONSISTS_OF_CARD", "PLAYER_HAS_CARD")
+def get_deck_builder_view(
+    p_id: int,
+    request: Request,
+    d_id: Optional[int] = Query(None, description="要管理的牌組，未指定或不屬於該玩家時取第一副")
+):
+    """牌組管理頁：玩家的牌組、卡牌總表，以及選定牌組的組成與缺卡"""
+    with db.read_snapshot():
+        decks = db.get_player_decks(p_id, columnar=True)
+        d_id_index = decks.columns.index("d_id")
+        deck_ids = [row[d_id_index] for row in decks.rows]
+        if d_id not in deck_ids:
+            d_id = deck_ids[0] if deck_ids else None
+        cards = db.get_all_card_names_and_ids(columnar=True)
+        composition = db.get_deck_composition(d_id, columnar=True) if d_id is not None else []
+        missing_cards = db.get_missing_cards_for_deck(p_id, d_id, columnar=True) if d_id is not None else []
+    return _view_response(request, {
+        "d_id": d_id,
+        "decks": decks,
+        "cards": cards,
+        "composition": composition,
+        "missing_cards": missing_cards,
+    }, {})
+
+# --- 效能優化：即時更新 (Server-Sent Events) ---
+# 正在看賽事或商城的頁面訂閱 SSE，報名人數與架上數量變動時由伺服器推送 (見 live)，不必反覆重新讀取列表。
+def _live_response(topic, field=None, values=None):
+    if not live.ENABLED:
+        raise HTTPException(status_code=404, detail="Live updates are disabled")
+    if live.full():
+        raise HTTPException(status_code=503, detail="Too many live subscribers", headers={"Retry-After": "5"})
+    return StreamingResponse(
+        live.stream(topic, field, set(values) if values else None),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/live/events")
+async def live_events(e_id: Optional[List[int]] = Query(None, description="只推送這些賽事，未指定時推送全部")):
+    """SSE：賽事報名人數變動 (event: events，data 為 e_id 與 participants)"""
+    return _live_response("events", "e_id", e_id)
+
+@app.get("/live/market")
+async def live_market(prod_id: Optional[List[int]] = Query(None, description="只推送這些商品，未指定時推送全部")):
+    """SSE：商城架上數量與價格變動 (event: market，data 為 s_id、prod_id、qty、price)"""
+    return _live_response("market", "prod_id", prod_id)
+
+# --- Monitoring Routes ---
+@app.get("/healthz")
+def healthz():
+    """liveness：行程還活著即回 200，不檢查外部服務"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    """readiness：主資料庫可用才回 200；replica 無法使用時會自動退回主資料庫，MongoDB 只記錄搜尋紀錄，兩者狀態僅供參考"""
+    postgres = db.ping()
+    if not db.MONGO_URI:
+        mongo = "disabled"
+    else:
+        mongo = {None: "pending", True: "ok", False: "unavailable"}[db.mongo_ok]
+    body = {
+        "status": "ready" if postgres else "unavailable",
+        "postgres": "ok" if postgres else "unavailable",
+        "replica": db.replica_status(),
+        "replica_lag": db.replica_lag,
+        "mongo": mongo,
+        "mongo_queue": db.mongo_queue_depth(),
+    }
+    return JSONResponse(body, status_code=200 if postgres else 503)
+
+@app.get("/stats/coalescing")
+def get_coalescing_stats():
+    """請求合併的統計：executed 為實際執行的查詢數，coalesced + cache_hits 為省下的查詢數"""
+    return read_flight.stats()
+
+@app.get("/stats/admission")
+def get_admission_stats():
+    """admission control 的狀態：目前的 limit 與各類請求的執行中、排隊、放行與拒絕數"""
+    return admission.stats()
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus 格式的效能指標 (見 metrics)"""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
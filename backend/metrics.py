@@ -0,0 +1,280 @@
+"""
+Prometheus 格式的效能指標 (/metrics)。
+
+- 每個 route 的延遲分布 (histogram) 與狀態碼計數，route 以路徑樣板 (例如 /player/{p_id}/cards) 為 label
+- 每個請求花在資料庫的時間 (含向連線池取得連線) 與總時間，可看出時間花在資料庫還是序列化 / 網路
+- 每個 db 函式 (查詢) 的執行次數與累計時間
+- 其他模組以 register() 提供的即時數值 (連線池使用量、MongoDB 佇列長度等)
+
+只用標準函式庫：每次記錄只是在 lock 內加總幾個數字，可在正式環境常態開啟。
+多行程模式 (WEB_CONCURRENCY > 1) 下每個 worker 每 METRICS_FLUSH_INTERVAL 秒把自己的數值寫到 METRICS_DIR，
+/metrics 不論由哪個 worker 回應都會合併所有 worker 的數值，並以 worker label (pid) 區分。
+"""
+import bisect
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+METRICS_DIR = os.getenv("METRICS_DIR") or os.path.join(tempfile.gettempdir(), "tcg_metrics")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+# 秒
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_requests = {}        # (method, route, status) -> 次數
+_request_seconds = {} # route -> histogram
+_db_seconds = {}      # route -> histogram (每個請求的資料庫時間)
+_queries = {}         # db 函式名稱 -> [次數, 累計秒數, 錯誤次數]
+_statements = {}      # db 函式名稱 -> [SQL 數, 累計秒數]
+_cancelled = {}       # (db 函式名稱, 原因) -> [次數, 取消前已執行的秒數]
+_disconnects = {}     # route -> 回應前就斷線的請求數
+_collectors = []
+
+# 目前請求累計的資料庫時間；route 在 threadpool 內執行時 contextvar 會一併複製，指向同一個 list
+_request_db = contextvars.ContextVar("request_db", default=None)
+
+def _histogram():
+    # 各 bucket 的計數 (最後一格為 +Inf)、總和、總數
+    return [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+
+def _observe(histogram, seconds):
+    histogram[0][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+    histogram[1] += seconds
+    histogram[2] += 1
+
+def observe_query(name, seconds, error=False, nested=False):
+    """由 db 呼叫：記錄一次查詢 (一個 db 函式的一次連線使用)；nested 的時間已包含在外層查詢內"""
+    with _lock:
+        entry = _queries.get(name)
+        if entry is None:
+            entry = _queries[name] = [0, 0.0, 0]
+        entry[0] += 1
+        entry[1] += seconds
+        if error:
+            entry[2] += 1
+    cell = _request_db.get()
+    if cell is not None and not nested:
+        cell[0] += seconds
+
+def observe_statement(name, seconds):
+    """由 db 的 cursor 呼叫：記錄一個 SQL 的執行時間"""
+    with _lock:
+        entry = _statements.get(name)
+        if entry is None:
+            entry = _statements[name] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += seconds
+
+def observe_cancel(name, reason, seconds):
+    """由 db 呼叫：查詢因 statement_timeout 或用戶端斷線 (client_disconnect) 而被取消"""
+    with _lock:
+        entry = _cancelled.get((name, reason))
+        if entry is None:
+            entry = _cancelled[(name, reason)] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += seconds
+
+def observe_disconnect(route):
+    with _lock:
+        _disconnects[route] = _disconnects.get(route, 0) + 1
+
+def observe_request(method, route, status, seconds, db_seconds):
+    with _lock:
+        key = (method, route, status)
+        _requests[key] = _requests.get(key, 0) + 1
+        histogram = _request_seconds.get(route)
+        if histogram is None:
+            histogram = _request_seconds[route] = _histogram()
+            _db_seconds[route] = _histogram()
+        _observe(histogram, seconds)
+        _observe(_db_seconds[route], db_seconds)
+
+def register(collector):
+    """collector() 回傳 [(名稱, 型別, 說明, [(labels, 數值), ...]), ...]，每次輸出 /metrics 時呼叫"""
+    _collectors.append(collector)
+
+# --- ASGI middleware ---
+class MetricsMiddleware:
+    """純 ASGI middleware (不經過 BaseHTTPMiddleware)，只包裝 send 取得狀態碼"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        cell = [0.0]
+        token = _request_db.set(cell)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_db.reset(token)
+            # 路由比對後 FastAPI 會把 route 放進 scope；比對不到的路徑歸為同一類，避免 label 無限增加
+            route = scope.get("route")
+            observe_request(scope["method"], getattr(route, "path", "unmatched"), status[0],
+                            time.perf_counter() - start, cell[0])
+
+# --- 輸出 ---
+def _histogram_samples(name, histograms):
+    samples = []
+    for route, (buckets, total, count) in histograms.items():
+        cumulative = 0
+        for bound, n in zip(LATENCY_BUCKETS + ("+Inf",), buckets):
+            cumulative += n
+            samples.append((name + "_bucket", {"route": route, "le": str(bound)}, cumulative))
+        samples.append((name + "_sum", {"route": route}, total))
+        samples.append((name + "_count", {"route": route}, count))
+    return samples
+
+def families():
+    """本行程的所有指標：[(名稱, 型別, 說明, [(樣本名稱, labels, 數值), ...]), ...]"""
+    with _lock:
+        requests = [("tcg_http_requests_total", {"method": m, "route": r, "status": str(s)}, n)
+                    for (m, r, s), n in _requests.items()]
+        request_seconds = _histogram_samples("tcg_http_request_duration_seconds", _request_seconds)
+        db_seconds = _histogram_samples("tcg_http_request_db_seconds", _db_seconds)
+        queries = [("tcg_db_queries_total", {"function": f}, n) for f, (n, _, _) in _queries.items()]
+        query_seconds = [("tcg_db_query_seconds_total", {"function": f}, s) for f, (_, s, _) in _queries.items()]
+        query_errors = [("tcg_db_query_errors_total", {"function": f}, e) for f, (_, _, e) in _queries.items()]
+        statements = [("tcg_db_statements_total", {"function": f}, n) for f, (n, _) in _statements.items()]
+        statement_seconds = [("tcg_db_statement_seconds_total", {"function": f}, s) for f, (_, s) in _statements.items()]
+        cancelled = [("tcg_db_cancelled_queries_total", {"function": f, "reason": r}, n)
+                     for (f, r), (n, _) in _cancelled.items()]
+        cancelled_seconds = [("tcg_db_cancelled_query_seconds_total", {"function": f, "reason": r}, s)
+                             for (f, r), (_, s) in _cancelled.items()]
+        disconnects = [("tcg_http_client_disconnects_total", {"route": r}, n) for r, n in _disconnects.items()]
+    result = [
+        ("tcg_http_requests_total", "counter", "HTTP 請求數 (依 route 與狀態碼)", requests),
+        ("tcg_http_request_duration_seconds", "histogram", "HTTP 請求總時間", request_seconds),
+        ("tcg_http_request_db_seconds", "histogram", "每個 HTTP 請求花在資料庫的時間", db_seconds),
+        ("tcg_db_queries_total", "counter", "db 函式執行次數", queries),
+        ("tcg_db_query_seconds_total", "counter", "db 函式累計時間 (含取得連線)", query_seconds),
+        ("tcg_db_query_errors_total", "counter", "db 函式失敗次數", query_errors),
+        ("tcg_db_statements_total", "counter", "SQL 執行次數 (依呼叫的 db 函式)", statements),
+        ("tcg_db_statement_seconds_total", "counter", "SQL 累計執行時間 (依呼叫的 db 函式)", statement_seconds),
+        ("tcg_db_cancelled_queries_total", "counter", "被取消的 db 函式 (reason: statement_timeout / client_disconnect)", cancelled),
+        ("tcg_db_cancelled_query_seconds_total", "counter", "被取消的 db 函式在取消前已執行的時間", cancelled_seconds),
+        ("tcg_http_client_disconnects_total", "counter", "回應前用戶端就已斷線的請求數", disconnects),
+    ]
+    for collector in _collectors:
+        try:
+            for name, type_, help_, values in collector():
+                result.append((name, type_, help_, [(name, labels, value) for labels, value in values]))
+        except Exception as e:
+            print(f"Metrics collector error: {e}")
+    return result
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format(families_):
+    lines = []
+    for name, type_, help_, samples in families_:
+        lines.append(f"# HELP {name} {help_}")
+        lines.append(f"# TYPE {name} {type_}")
+        for sample, labels, value in samples:
+            if labels:
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f"{sample}{{{label_text}}} {value}")
+            else:
+                lines.append(f"{sample} {value}")
+    return "\n".join(lines) + "\n"
+
+# --- 多行程模式：合併所有 worker ---
+_flush_thread = None
+_stop = threading.Event()
+
+def _path(pid):
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+def _flush():
+    tmp = _path(os.getpid()) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(families(), f)
+    os.replace(tmp, _path(os.getpid()))
+
+def _flusher():
+    while not _stop.wait(METRICS_FLUSH_INTERVAL):
+        try:
+            _flush()
+        except Exception as e:
+            print(f"Metrics flush error: {e}")
+
+def start():
+    global _flush_thread
+    if WEB_CONCURRENCY <= 1 or (_flush_thread is not None and _flush_thread.is_alive()):
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _stop.clear()
+    _flush_thread = threading.Thread(target=_flusher, name="metrics-flush", daemon=True)
+    _flush_thread.start()
+
+def stop():
+    global _flush_thread
+    _stop.set()
+    if _flush_thread is not None:
+        _flush_thread.join(1)
+        _flush_thread = None
+    if WEB_CONCURRENCY > 1:
+        try:
+            os.remove(_path(os.getpid()))
+        except OSError:
+            pass
+
+def _merged():
+    """讀取所有 worker 的數值 (本行程使用即時數值)，每個樣本加上 worker label"""
+    workers = {str(os.getpid()): families()}
+    stale = time.time() - METRICS_FLUSH_INTERVAL * 3
+    for filename in os.listdir(METRICS_DIR):
+        pid = filename.removesuffix(".json")
+        if not filename.endswith(".json") or pid in workers:
+            continue
+        try:
+            if os.path.getmtime(os.path.join(METRICS_DIR, filename)) < stale:
+                continue  # 已結束的 worker
+            with open(os.path.join(METRICS_DIR, filename)) as f:
+                workers[pid] = json.load(f)
+        except (OSError, ValueError):
+            continue
+    merged = {}
+    for pid, families_ in workers.items():
+        for name, type_, help_, samples in families_:
+            family = merged.setdefault(name, (name, type_, help_, []))
+            family[3].extend((sample, {**labels, "worker": pid}, value) for sample, labels, value in samples)
+    return list(merged.values())
+
+def render():
+    if WEB_CONCURRENCY > 1 and os.path.isdir(METRICS_DIR):
+        return _format(_merged())
+    return _format(families())
+
+def _after_fork():
+    global _lock, _flush_thread
+    # fork 前累積的數值屬於父行程
+    _lock = threading.Lock()
+    _requests.clear()
+    _request_seconds.clear()
+    _db_seconds.clear()
+    _queries.clear()
+    _statements.clear()
+    _cancelled.clear()
+    _disconnects.clear()
+    _flush_thread = None
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,138 @@
+"""
+資料庫 schema migration (於專案根目錄)：
+    python -m backend.migrate            # 套用尚未執行的 migration
+    python -m backend.migrate --status   # 列出各 migration 是否已套用
+
+backend/migrations/ 下的 NNNN_名稱.sql 依編號執行，已套用的版本記在 schema_migrations 資料表。
+一般的 migration 整個檔案在同一個交易內執行 (連同寫入 schema_migrations)，並設定 MIGRATE_LOCK_TIMEOUT：
+拿不到資料表的鎖時直接失敗，不讓 DDL 排在長交易後面、把之後的所有查詢一起卡住。
+第一行為 "-- migrate: no-transaction" 的檔案 (例如 CREATE INDEX CONCURRENTLY) 則逐句以 autocommit 執行，
+語句須可重複執行 (IF NOT EXISTS)，中途失敗後重新執行即可從失敗處繼續。
+
+從 backup 還原、已有資料表但沒有 schema_migrations 的資料庫，0001 (初始 schema) 直接記為已套用。
+連線使用 DB_DIRECT_HOST / DB_DIRECT_PORT (未設定時同 DB_HOST / DB_PORT)，不經過 PgBouncer。
+"""
+import argparse
+import os
+import re
+import sys
+import psycopg2
+from dotenv import load_dotenv
+from .db import DIRECT_DB_CONFIG
+
+load_dotenv()
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+MIGRATE_LOCK_TIMEOUT = os.getenv("MIGRATE_LOCK_TIMEOUT", "5s")
+NO_TRANSACTION = "-- migrate: no-transaction"
+# 同時只允許一個 migrate 行程 (pg_advisory_lock 的 key)
+ADVISORY_LOCK_KEY = 7_140_114
+
+_INDEX_NAME = re.compile(r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+"?([^"\s]+)"?', re.I)
+
+def migrations():
+    """[(版本, 名稱, 檔案路徑)]，依版本排序"""
+    found = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = re.match(r"(\d+)_(.+)\.sql$", filename)
+        if match:
+            found.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return found
+
+def _statements(sql):
+    """把 no-transaction 檔案拆成單一語句 (不支援字串或函式本體內的分號)"""
+    lines = [line for line in sql.splitlines() if not line.strip().startswith("--")]
+    return [s.strip() for s in "\n".join(lines).split(";") if s.strip()]
+
+def _applied(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+def _baseline(cur, applied):
+    """從 backup 還原的資料庫：初始 schema 已存在"""
+    if applied:
+        return applied
+    cur.execute("""SELECT to_regclass('public."PLAYER"') IS NOT NULL""")
+    if cur.fetchone()[0]:
+        version, name, _ = migrations()[0]
+        cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        print(f"Existing schema found, marked {version:04d}_{name} as applied")
+        return {version}
+    return applied
+
+def _drop_invalid_index(cur, statement):
+    """CONCURRENTLY 建立失敗會留下 INVALID 索引，IF NOT EXISTS 會因此跳過，先刪除再重建"""
+    match = _INDEX_NAME.search(statement)
+    if not match:
+        return
+    cur.execute("""
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid
+    """, (match.group(1),))
+    if cur.fetchone():
+        print(f"  dropping invalid index {match.group(1)}")
+        cur.execute(f'DROP INDEX CONCURRENTLY "{match.group(1)}"')
+
+def _apply(conn, version, name, path):
+    with open(path, encoding="utf-8") as f:
+        sql = f.read()
+    print(f"Applying {version:04d}_{name}")
+    with conn.cursor() as cur:
+        if sql.lstrip().startswith(NO_TRANSACTION):
+            for statement in _statements(sql):
+                _drop_invalid_index(cur, statement)
+                print(f"  {statement.splitlines()[0][:100]}")
+                cur.execute(statement)
+            cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            return
+        cur.execute("BEGIN")
+        try:
+            cur.execute("SET LOCAL lock_timeout = %s", (MIGRATE_LOCK_TIMEOUT,))
+            cur.execute(sql)
+            cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+
+def migrate(config=DIRECT_DB_CONFIG, status=False):
+    """套用尚未執行的 migration，回傳套用的數量"""
+    conn = psycopg2.connect(**config)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (ADVISORY_LOCK_KEY,))
+            applied = _baseline(cur, _applied(cur))
+        pending = [m for m in migrations() if m[0] not in applied]
+        if status:
+            for version, name, _ in migrations():
+                print(f"{'applied' if version in applied else 'pending':<9}{version:04d}_{name}")
+            return 0
+        for version, name, path in pending:
+            _apply(conn, version, name, path)
+        print(f"{len(pending)} migration(s) applied" if pending else "Schema is up to date")
+        return len(pending)
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--status", action="store_true", help="只列出各 migration 是否已套用")
+    parser.add_argument("--dbname", help="目標資料庫 (預設為 .env 的 DB_NAME)")
+    args = parser.parse_args()
+    config = dict(DIRECT_DB_CONFIG, dbname=args.dbname or DIRECT_DB_CONFIG["dbname"])
+    try:
+        migrate(config, args.status)
+    except psycopg2.Error as e:
+        print(f"Migration failed: {type(e).__name__}: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
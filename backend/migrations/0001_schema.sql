@@ -0,0 +1,109 @@
+-- 初始 schema：與 DBMS_final_project.backup 相同的資料表、主鍵、唯一鍵與外鍵 (不含資料)。
+-- 從 backup 還原的資料庫第一次執行 migrate 時直接記為已套用 (baseline)。
+
+CREATE TABLE "SERIES" (
+    "series_id" SERIAL PRIMARY KEY,
+    "series_name" VARCHAR(100) NOT NULL
+);
+
+CREATE TABLE "CARD" (
+    "c_id" SERIAL PRIMARY KEY,
+    "c_name" VARCHAR(100) NOT NULL,
+    "c_type" VARCHAR(20),
+    "c_rarity" VARCHAR(50),
+    "series_id" INTEGER REFERENCES "SERIES" ("series_id")
+);
+
+CREATE TABLE "PLAYER" (
+    "p_id" SERIAL PRIMARY KEY,
+    "p_name" VARCHAR(50) NOT NULL,
+    "email" VARCHAR(100) NOT NULL UNIQUE,
+    "password" VARCHAR(100) NOT NULL
+);
+
+CREATE TABLE "SHOP" (
+    "s_id" SERIAL PRIMARY KEY,
+    "s_name" VARCHAR(50) NOT NULL UNIQUE,
+    "s_addr" VARCHAR(200),
+    "s_phone" VARCHAR(20),
+    "password" VARCHAR(100) NOT NULL
+);
+
+CREATE TABLE "DECK" (
+    "d_id" SERIAL PRIMARY KEY,
+    "d_name" VARCHAR(50) NOT NULL
+);
+
+CREATE TABLE "PLAYER_BUILDS_DECK" (
+    "p_id" INTEGER NOT NULL REFERENCES "PLAYER" ("p_id"),
+    "d_id" INTEGER NOT NULL REFERENCES "DECK" ("d_id") ON DELETE CASCADE,
+    PRIMARY KEY ("p_id", "d_id")
+);
+
+CREATE TABLE "DECK_CONSISTS_OF_CARD" (
+    "d_id" INTEGER NOT NULL REFERENCES "DECK" ("d_id") ON DELETE CASCADE,
+    "c_id" INTEGER NOT NULL REFERENCES "CARD" ("c_id"),
+    "qty" INTEGER NOT NULL,
+    PRIMARY KEY ("d_id", "c_id")
+);
+
+CREATE TABLE "PLAYER_HAS_CARD" (
+    "p_id" INTEGER NOT NULL REFERENCES "PLAYER" ("p_id"),
+    "c_id" INTEGER NOT NULL REFERENCES "CARD" ("c_id"),
+    "qty" INTEGER NOT NULL,
+    PRIMARY KEY ("p_id", "c_id")
+);
+
+CREATE TABLE "PRODUCT" (
+    "prod_id" SERIAL PRIMARY KEY,
+    "prod_name" VARCHAR(100) NOT NULL,
+    "prod_type" VARCHAR(20),
+    "c_id" INTEGER REFERENCES "CARD" ("c_id")
+);
+
+CREATE TABLE "SHOP_SELLS_PRODUCT" (
+    "s_id" INTEGER NOT NULL REFERENCES "SHOP" ("s_id"),
+    "prod_id" INTEGER NOT NULL REFERENCES "PRODUCT" ("prod_id"),
+    "qty" INTEGER NOT NULL,
+    "price" INTEGER NOT NULL,
+    PRIMARY KEY ("s_id", "prod_id")
+);
+
+CREATE TABLE "SHOP_STORES_PRODUCT" (
+    "s_id" INTEGER NOT NULL REFERENCES "SHOP" ("s_id"),
+    "prod_id" INTEGER NOT NULL REFERENCES "PRODUCT" ("prod_id"),
+    "qty" INTEGER NOT NULL,
+    PRIMARY KEY ("s_id", "prod_id")
+);
+
+CREATE TABLE "SALES" (
+    "sales_id" SERIAL PRIMARY KEY,
+    "datetime" TIMESTAMP NOT NULL,
+    "p_id" INTEGER REFERENCES "PLAYER" ("p_id"),
+    "s_id" INTEGER REFERENCES "SHOP" ("s_id")
+);
+
+CREATE TABLE "SALES_DETAIL" (
+    "sales_id" INTEGER NOT NULL REFERENCES "SALES" ("sales_id"),
+    "prod_id" INTEGER NOT NULL REFERENCES "PRODUCT" ("prod_id"),
+    "qty" INTEGER NOT NULL,
+    PRIMARY KEY ("sales_id", "prod_id")
+);
+
+CREATE TABLE "EVENT" (
+    "e_id" SERIAL PRIMARY KEY,
+    "e_name" VARCHAR(100) NOT NULL,
+    "e_format" VARCHAR(20),
+    "e_date" DATE NOT NULL,
+    "e_time" TIME NOT NULL,
+    "e_size" VARCHAR(10) NOT NULL,
+    "e_roundtype" VARCHAR(20),
+    "org_shop_id" INTEGER REFERENCES "SHOP" ("s_id")
+);
+
+CREATE TABLE "PLAYER_PARTICIPATES_EVENT_WITH_DECK" (
+    "p_id" INTEGER NOT NULL REFERENCES "PLAYER" ("p_id"),
+    "e_id" INTEGER NOT NULL REFERENCES "EVENT" ("e_id"),
+    "d_id" INTEGER REFERENCES "DECK" ("d_id"),
+    PRIMARY KEY ("p_id", "e_id")
+);
@@ -0,0 +1,34 @@
+-- migrate: no-transaction
+-- backend/db.py 熱門查詢使用的索引。CREATE INDEX CONCURRENTLY 建立時不鎖住寫入，但不能在交易內執行，
+-- 所以此檔的每個語句各自執行；中途失敗留下的 INVALID 索引由 migrate 先刪除再重建。
+--
+-- 已由主鍵涵蓋 (最左欄位相同)，不另建索引：
+--   PLAYER_HAS_CARD (p_id, c_id)          get_player_cards、get_missing_cards_for_deck、upsert/delete_player_card、buy_product
+--   DECK_CONSISTS_OF_CARD (d_id, c_id)    get_deck_composition、get_missing_cards_for_deck、upsert_deck_card
+--   PLAYER_BUILDS_DECK (p_id, d_id)       get_player_decks、remove_deck
+--   PLAYER_PARTICIPATES_EVENT_WITH_DECK (p_id, e_id)  get_player_participations_detailed、leave_event
+--   SHOP_SELLS_PRODUCT (s_id, prod_id)    get_shop_inventory、buy_product、move_product_to_shelf
+--   SHOP_STORES_PRODUCT (s_id, prod_id)   get_shop_storage、restock_shop_product
+--   SALES_DETAIL (sales_id, prod_id)      get_sales_detail 的明細 join
+--   PLAYER (email)、SHOP (s_name)         登入 (唯一鍵)
+
+-- get_sales_detail: WHERE s_id = ? ORDER BY datetime DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "SALES_s_id_datetime_idx"
+    ON "SALES" ("s_id", "datetime" DESC);
+
+-- get_all_upcoming_events: WHERE e_date >= CURRENT_DATE ORDER BY e_date, e_time, e_id (keyset 分頁)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "EVENT_e_date_e_time_e_id_idx"
+    ON "EVENT" ("e_date", "e_time", "e_id");
+
+-- join_event 的報名人數、get_all_upcoming_events 的 current_participants: WHERE e_id = ?
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "PLAYER_PARTICIPATES_EVENT_WITH_DECK_e_id_idx"
+    ON "PLAYER_PARTICIPATES_EVENT_WITH_DECK" ("e_id");
+
+-- get_market_listings: WHERE qty > 0 ORDER BY price, s_id, prod_id (keyset 分頁)，售完的商品不進索引
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "SHOP_SELLS_PRODUCT_listing_idx"
+    ON "SHOP_SELLS_PRODUCT" ("price", "s_id", "prod_id") WHERE "qty" > 0;
+
+-- filter_cards: ORDER BY c_name, c_id (keyset 分頁)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "CARD_c_name_c_id_idx"
+    ON "CARD" ("c_name", "c_id");
+
@@ -0,0 +1,14 @@
+-- 購買與賽事報名的 Idempotency-Key (見 backend/db.py 的 _idempotent)。
+-- result 與購買或報名在同一個交易內寫入；超過 IDEMPOTENCY_TTL 的列由 purge_idempotency_keys 分批刪除。
+
+CREATE TABLE "IDEMPOTENCY_KEY" (
+    "endpoint" VARCHAR(50) NOT NULL,
+    "key" VARCHAR(255) NOT NULL,
+    "fingerprint" CHAR(64) NOT NULL,
+    "result" JSONB,
+    "created_at" TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY ("endpoint", "key")
+);
+
+-- purge_idempotency_keys: WHERE created_at < now() - TTL
+CREATE INDEX "IDEMPOTENCY_KEY_created_at_idx" ON "IDEMPOTENCY_KEY" ("created_at");
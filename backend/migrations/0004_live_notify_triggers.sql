@@ -0,0 +1,48 @@
+-- 即時更新 (backend/live.py) 的資料來源：報名人數與商城庫存變動時以 pg_notify 送到 tcg_live channel。
+-- 通知在交易 commit 時才送出，同一個交易內內容相同的通知只送一次。
+
+-- 報名 / 退出 / 換賽事：送出受影響賽事的目前人數 (使用 e_id 索引計數)
+CREATE FUNCTION "notify_event_participants"() RETURNS trigger AS $$
+DECLARE
+    changed INTEGER;
+BEGIN
+    FOR changed IN
+        SELECT DISTINCT e FROM unnest(ARRAY[
+            CASE WHEN TG_OP <> 'INSERT' THEN OLD."e_id" END,
+            CASE WHEN TG_OP <> 'DELETE' THEN NEW."e_id" END
+        ]) AS e
+        WHERE e IS NOT NULL
+    LOOP
+        PERFORM pg_notify('tcg_live', json_build_object(
+            'topic', 'events',
+            'e_id', changed,
+            'participants', (SELECT count(*) FROM "PLAYER_PARTICIPATES_EVENT_WITH_DECK" WHERE "e_id" = changed)
+        )::text);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER "PLAYER_PARTICIPATES_EVENT_WITH_DECK_notify_live"
+    AFTER INSERT OR DELETE OR UPDATE OF "e_id" ON "PLAYER_PARTICIPATES_EVENT_WITH_DECK"
+    FOR EACH ROW EXECUTE FUNCTION "notify_event_participants"();
+
+-- 購買 / 上架 / 調價 / 下架：送出該商品在該店家的架上數量與價格 (下架時數量為 0)
+CREATE FUNCTION "notify_listing_stock"() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('tcg_live', json_build_object(
+            'topic', 'market', 's_id', OLD."s_id", 'prod_id', OLD."prod_id", 'qty', 0, 'price', OLD."price"
+        )::text);
+    ELSIF TG_OP = 'INSERT' OR NEW."qty" IS DISTINCT FROM OLD."qty" OR NEW."price" IS DISTINCT FROM OLD."price" THEN
+        PERFORM pg_notify('tcg_live', json_build_object(
+            'topic', 'market', 's_id', NEW."s_id", 'prod_id', NEW."prod_id", 'qty', NEW."qty", 'price', NEW."price"
+        )::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER "SHOP_SELLS_PRODUCT_notify_live"
+    AFTER INSERT OR DELETE OR UPDATE OF "qty", "price" ON "SHOP_SELLS_PRODUCT"
+    FOR EACH ROW EXECUTE FUNCTION "notify_listing_stock"();
@@ -0,0 +1,10 @@
+-- migrate: no-transaction
+-- filter_cards 的卡名搜尋為 c_name ILIKE '%關鍵字%'，前後都有萬用字元，0002 的 btree 索引 (c_name, c_id) 只能用在排序，
+-- 搜尋仍需掃描整張 CARD。pg_trgm 的 GIN 索引把卡名拆成三字元組，ILIKE 可直接用索引找出候選列
+-- (關鍵字少於 3 個字元時無法縮小範圍，規劃器會改用循序掃描)。
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- filter_cards: WHERE c_name ILIKE '%…%'
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "CARD_c_name_trgm_idx"
+    ON "CARD" USING gin ("c_name" gin_trgm_ops);
@@ -0,0 +1,53 @@
+"""
+bcrypt 密碼雜湊。
+
+bcrypt 每次計算約 100–300 ms 的 CPU，直接在 route 內執行會長時間佔住 FastAPI 的 threadpool worker，
+登入尖峰時 (例如公布賽事後) 其他 API 全部跟著排隊。這裡改交給獨立的 process pool (預設大小為 CPU 核心數，多行程模式下由各 worker 平分)，
+async 的登入 / 註冊 route 以 await 等待結果，不佔用 threadpool 也不與其他請求爭搶 GIL。
+
+BCRYPT_ROUNDS 為新密碼的成本 (預設 12，與 bcrypt.gensalt() 相同)；既有雜湊的成本記錄在雜湊字串內，
+調整後舊密碼仍可正常驗證。
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# 多行程模式下 CPU 核心由所有 API worker 平分
+BCRYPT_WORKERS = (int(os.getenv("BCRYPT_WORKERS", "0"))
+                  or max((os.cpu_count() or 1) // max(int(os.getenv("WEB_CONCURRENCY", "1")), 1), 1))
+
+_executor = None
+_lock = threading.Lock()
+
+def _pool():
+    """第一次使用時才建立 process pool"""
+    global _executor
+    with _lock:
+        if _executor is None:
+            # 以 spawn 建立子行程：不 fork 已持有資料庫連線與執行緒的 API 行程
+            _executor = ProcessPoolExecutor(max_workers=BCRYPT_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+def _check(password, hashed):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+async def hash_password(password):
+    return await asyncio.get_running_loop().run_in_executor(_pool(), _hash, password, BCRYPT_ROUNDS)
+
+async def check_password(password, hashed):
+    return await asyncio.get_running_loop().run_in_executor(_pool(), _check, password, hashed)
+
+def shutdown():
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
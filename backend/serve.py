@@ -0,0 +1,27 @@
+"""
+多行程模式啟動後端 (於專案根目錄)：
+    python -m backend.serve
+
+啟動 WEB_CONCURRENCY 個 uvicorn worker (預設為 CPU 核心數)。每個 worker 在 lifespan 內才建立自己的
+連線池、MongoDB 背景寫入與 broadcast listener，並從 DB_MAX_CONNECTIONS 分得自己的連線上限。
+也可以使用 gunicorn (--preload 亦可，fork 後會重新建立所有資源)：
+    WEB_CONCURRENCY=4 gunicorn backend.main:app -k uvicorn.workers.UvicornWorker
+"""
+import os
+import uvicorn
+from dotenv import load_dotenv
+
+def main():
+    load_dotenv()
+    workers = int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1
+    # worker 行程依此分配連線預算與 bcrypt process 數
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    uvicorn.run(
+        "backend.main:app",
+        host=os.getenv("HOST", "127.0.0.1"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=workers,
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+登入 session token (記憶體內)。
+
+登入成功後發給用戶端一個隨機 token，之後以 Authorization: Bearer <token> 呼叫 /session 即可取回登入資訊，
+不必每次造訪都重新送出密碼、重新計算 bcrypt。
+token 在 SESSION_TTL 秒內沒有使用即失效，每次使用會重新計算期限；API 重新啟動後所有 session 失效。
+
+多行程模式下每個 worker 各有一份 session，建立 / 延長 / 撤銷時透過 publisher 廣播給其他 worker，
+收到的訊息交給 apply()。store 以 token 的 SHA-256 為 key，廣播內容不含 token 本身。
+"""
+import hashlib
+import os
+import secrets
+import threading
+import time
+
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(12 * 3600)))
+
+# 由 main 在多行程模式下設定：publisher(op=..., key=..., ...) 廣播給其他 worker
+publisher = None
+
+_lock = threading.Lock()
+_sessions = {}  # SHA-256(token) -> [到期時間, 登入資訊, 上次廣播時間]
+
+def _key(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def _put(key, data, ttl):
+    now = time.monotonic()
+    with _lock:
+        # 順便清掉過期的 session，避免無限成長
+        if len(_sessions) >= 1024:
+            for k in [k for k, (expires, _, _) in _sessions.items() if expires <= now]:
+                del _sessions[k]
+        _sessions[key] = [now + ttl, data, now]
+
+def create(data):
+    token = secrets.token_urlsafe(32)
+    key = _key(token)
+    _put(key, data, SESSION_TTL)
+    if publisher is not None:
+        publisher(op="put", key=key, data=data, ttl=SESSION_TTL)
+    return token
+
+def get(token):
+    """回傳登入資訊並延長期限；token 不存在或已過期時回傳 None"""
+    if not token:
+        return None
+    key = _key(token)
+    now = time.monotonic()
+    with _lock:
+        entry = _sessions.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del _sessions[key]
+            return None
+        entry[0] = now + SESSION_TTL
+        # 延長期限不必每次都廣播，超過 TTL 的十分之一才同步一次
+        sync = publisher is not None and now - entry[2] > SESSION_TTL / 10
+        if sync:
+            entry[2] = now
+        data = entry[1]
+    if sync:
+        publisher(op="put", key=key, data=data, ttl=SESSION_TTL)
+    return data
+
+def revoke(token):
+    key = _key(token)
+    with _lock:
+        _sessions.pop(key, None)
+    if publisher is not None:
+        publisher(op="revoke", key=key)
+
+def apply(msg):
+    """套用其他 worker 廣播的 session 變更"""
+    if msg.get("op") == "put":
+        _put(msg["key"], msg["data"], msg["ttl"])
+    elif msg.get("op") == "revoke":
+        with _lock:
+            _sessions.pop(msg["key"], None)
@@ -0,0 +1,111 @@
+"""
+Single-flight 請求合併。
+
+同一時間內相同 key 的呼叫只會真正執行一次，其餘呼叫等待並共用同一份結果；
+可選擇性地把結果保留 ttl 秒 (micro-cache)，吸收賽事開放報名時同一秒湧入的重複讀取。
+leader 因 retry_on 內的例外失敗時 (例如 leader 的用戶端斷線、查詢被取消)，等待中的呼叫不共用這個錯誤，
+改由其中一個重新執行。
+等待中的呼叫最多等 max_wait 秒 (leader 的查詢卡住時不陪著佔用執行緒)，超過時自己執行；
+等待期間定期呼叫 check，check 丟出例外 (例如自己的用戶端已斷線) 時放棄等待。
+"""
+import threading
+import time
+
+WAIT_SLICE = 0.1  # 有 check 時每隔多久檢查一次 (秒)
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    def __init__(self, ttl=0.0, retry_on=(), max_wait=None, check=None):
+        self.ttl = ttl
+        self.retry_on = retry_on
+        self.max_wait = max_wait
+        self.check = check
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._cache = {}
+        # 統計：實際執行 / 合併到進行中的呼叫 / micro-cache 命中 / 等待逾時後自己執行
+        self.executed = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+        self.wait_timeouts = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        while True:
+            with self._lock:
+                if self.ttl:
+                    hit = self._cache.get(key)
+                    if hit is not None and hit[0] > time.monotonic():
+                        self.cache_hits += 1
+                        return hit[1]
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = _Call()
+                    self._calls[key] = call
+                    self.executed += 1
+                else:
+                    self.coalesced += 1
+
+            if leader:
+                break
+            if not self._wait(call):
+                with self._lock:
+                    self.wait_timeouts += 1
+                return fn(*args, **kwargs)
+            if call.error is None:
+                return call.result
+            if not isinstance(call.error, self.retry_on):
+                raise call.error
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if self.ttl and call.error is None:
+                    self._store(key, call.result)
+            call.done.set()
+
+    def _wait(self, call):
+        """等待 leader 完成，超過 max_wait 時回傳 False"""
+        deadline = None if self.max_wait is None else time.monotonic() + self.max_wait
+        while True:
+            timeout = WAIT_SLICE if self.check else None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            if call.done.wait(timeout):
+                return True
+            if self.check:
+                self.check()
+
+    def _store(self, key, result):
+        now = time.monotonic()
+        # 順便清掉過期的項目，避免 micro-cache 無限成長
+        if len(self._cache) >= 1024:
+            for k in [k for k, (expires, _) in self._cache.items() if expires <= now]:
+                del self._cache[k]
+        self._cache[key] = (now + self.ttl, result)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "cache_hits": self.cache_hits,
+                "wait_timeouts": self.wait_timeouts,
+                "in_flight": len(self._calls),
+            }
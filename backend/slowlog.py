@@ -0,0 +1,124 @@
+"""
+慢查詢紀錄與自動 EXPLAIN。
+
+db 的 cursor 會為每個 SQL 計時並標上呼叫的 db 函式名稱；超過 SLOW_QUERY_MS 的查詢以一行 JSON 寫入
+SLOW_QUERY_LOG (未設定時輸出到 stdout)。參數可能包含密碼雜湊等個資，紀錄只保留參數個數。
+
+超過 SLOW_QUERY_EXPLAIN_MS 的 SELECT 依 SLOW_QUERY_EXPLAIN_SAMPLE 的機率抽樣，交給背景執行緒以另一條連線執行
+EXPLAIN (ANALYZE, BUFFERS) 取得實際的執行計畫 (type 為 "explain" 的紀錄)，不佔用原本請求的時間；
+同一個 db 函式每 SLOW_QUERY_EXPLAIN_INTERVAL 秒最多 EXPLAIN 一次，EXPLAIN 本身也有 statement_timeout。
+"""
+import datetime
+import json
+import os
+import queue
+import random
+import threading
+import time
+import psycopg2.extensions
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "")
+SLOW_QUERY_EXPLAIN_MS = float(os.getenv("SLOW_QUERY_EXPLAIN_MS", "1000"))
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", "0.2"))
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "300"))
+EXPLAIN_TIMEOUT_MS = 30000
+MAX_SQL_LENGTH = 2000
+
+# 由 db 設定：connect() 為 context manager，提供一條執行 EXPLAIN 用的連線 (結束時 rollback)
+connect = None
+
+_write_lock = threading.Lock()
+_explain_lock = threading.Lock()
+_explained_at = {}  # db 函式名稱 -> 上次 EXPLAIN 的時間
+_explain_queue = queue.Queue(maxsize=16)
+_explain_thread = None
+
+def _compact(sql):
+    sql = " ".join(sql.split())
+    return sql if len(sql) <= MAX_SQL_LENGTH else sql[:MAX_SQL_LENGTH] + "..."
+
+def _write(entry):
+    line = json.dumps(entry, ensure_ascii=False, default=str)
+    with _write_lock:
+        if SLOW_QUERY_LOG:
+            with open(SLOW_QUERY_LOG, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        else:
+            print(line)
+
+def record(function, sql, params, seconds, rows):
+    """由 db 的 cursor 呼叫 (已確認超過 SLOW_QUERY_MS)"""
+    ms = seconds * 1000
+    _write({
+        "type": "slow",
+        "time": datetime.datetime.now().isoformat(timespec="milliseconds"),
+        "function": function,
+        "ms": round(ms, 3),
+        "rows": rows,
+        "params": len(params) if params else 0,
+        "sql": _compact(sql),
+    })
+    if ms >= SLOW_QUERY_EXPLAIN_MS and _should_explain(function, sql):
+        try:
+            _explain_queue.put_nowait((function, sql, params, ms))
+            _start_explainer()
+        except queue.Full:
+            pass
+
+def _should_explain(function, sql):
+    # EXPLAIN ANALYZE 會真的執行一次，只處理 SELECT
+    if connect is None or not sql.lstrip().upper().startswith("SELECT"):
+        return False
+    if random.random() >= SLOW_QUERY_EXPLAIN_SAMPLE:
+        return False
+    now = time.monotonic()
+    with _explain_lock:
+        last = _explained_at.get(function)
+        if last is not None and now - last < SLOW_QUERY_EXPLAIN_INTERVAL:
+            return False
+        _explained_at[function] = now
+    return True
+
+def _explain(function, sql, params, ms):
+    with connect() as conn:
+        # 一般 tuple cursor：不經過 db 的計時 cursor，EXPLAIN 本身不會再被記錄
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+            cur.execute(f"SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT_MS}")
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params)
+            plan = cur.fetchone()[0]
+    _write({
+        "type": "explain",
+        "time": datetime.datetime.now().isoformat(timespec="milliseconds"),
+        "function": function,
+        "ms": round(ms, 3),
+        "sql": _compact(sql),
+        "plan": plan,
+    })
+
+def _explainer():
+    while True:
+        item = _explain_queue.get()
+        try:
+            _explain(*item)
+        except Exception as e:
+            print(f"Slow query EXPLAIN failed ({item[0]}): {e}")
+
+def _start_explainer():
+    global _explain_thread
+    with _explain_lock:
+        if _explain_thread is None or not _explain_thread.is_alive():
+            _explain_thread = threading.Thread(target=_explainer, name="slow-query-explain", daemon=True)
+            _explain_thread.start()
+
+def _after_fork():
+    global _write_lock, _explain_lock, _explain_queue, _explain_thread
+    _write_lock = threading.Lock()
+    _explain_lock = threading.Lock()
+    _explain_queue = queue.Queue(maxsize=16)
+    _explain_thread = None
+
+os.register_at_fork(after_in_child=_after_fork)
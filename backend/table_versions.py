@@ -0,0 +1,63 @@
+"""
+每張資料表的版本計數器，作為 HTTP 條件式快取 (ETag / Last-Modified) 的依據。
+
+db.py 的寫入函式在 commit 成功後呼叫 bump() 遞增相關資料表的版本，
+讀取 API 只要比對版本即可判斷資料是否改變，不必實際執行查詢。
+計數器只存在於記憶體中，重新啟動後以新的 BOOT_ID 區分，舊的 ETag 自然失效。
+多行程模式下其他 worker 的寫入經由 broadcast 同步過來；無法確定是否漏掉訊息時以 reset() 讓所有 ETag 失效。
+"""
+import os
+import threading
+import time
+import uuid
+
+BOOT_ID = uuid.uuid4().hex[:8]
+_BOOT_TIME = int(time.time())
+
+_lock = threading.Lock()
+_versions = {}
+_modified = {}
+# 最後一次寫入的 time.monotonic()，供 read-your-writes 判斷
+_bumped_at = {}
+# reset() 的次數與時間
+_epoch = 0
+_reset_at = _BOOT_TIME
+
+def bump(*tables):
+    with _lock:
+        now = int(time.time())
+        for table in tables:
+            _versions[table] = _versions.get(table, 0) + 1
+            # Last-Modified 只有秒的精度：同一秒內的多次寫入也要讓時間嚴格遞增，
+            # 否則用戶端帶著同一秒的 If-Modified-Since 會誤判為未修改
+            _modified[table] = max(now, _modified.get(table, _BOOT_TIME) + 1)
+            _bumped_at[table] = time.monotonic()
+
+def modified_within(tables, seconds):
+    """tables 之中是否有資料表在最近 seconds 秒內被寫入"""
+    threshold = time.monotonic() - seconds
+    with _lock:
+        return any(_bumped_at.get(table, float("-inf")) > threshold for table in tables)
+
+def reset():
+    """讓所有資料表視為已修改"""
+    global _epoch, _reset_at
+    with _lock:
+        _epoch += 1
+        _reset_at = max(int(time.time()), max(_modified.values(), default=_reset_at) + 1, _reset_at + 1)
+
+def snapshot(tables):
+    """回傳 (各資料表版本, 最後修改時間)"""
+    with _lock:
+        versions = (_epoch,) + tuple(_versions.get(table, 0) for table in tables)
+        last_modified = max((_modified.get(table, _BOOT_TIME) for table in tables), default=_BOOT_TIME)
+        last_modified = max(last_modified, _reset_at)
+    return versions, last_modified
+
+def _after_fork():
+    global BOOT_ID, _lock
+    # fork 出來的 worker 各自計數，BOOT_ID 也必須不同，否則不同 worker 可能對不同資料產生相同的 ETag
+    BOOT_ID = uuid.uuid4().hex[:8]
+    _lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_after_fork)
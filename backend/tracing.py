@@ -0,0 +1,184 @@
+"""
+分散式追蹤 (Tracing)。
+
+前端的每次 API 呼叫帶著 W3C traceparent header (00-<trace id>-<span id>-<flags>)，
+後端以 middleware 接續同一個 trace，請求內的 db 操作 (取得連線、每個 SQL、commit) 與 MongoDB 寫入各記錄為一個 span，
+即可還原一個慢請求的時間花在 Streamlit、HTTP、連線池、PostgreSQL 還是 MongoDB。
+
+TRACE_EXPORT 為輸出的 JSON Lines 檔 (一行一個 span，前端可寫入同一個檔案)，未設定時完全停用。
+取樣：用戶端已取樣 (flags=01) 或本地依 TRACE_SAMPLE_RATE 抽中的 trace 一律輸出；
+其餘的 trace 先暫存在記憶體，整個請求超過 TRACE_SLOW_MS 才輸出，所以慢請求一定留得下來。
+可用 python -m bench.trace_view 檢視。
+"""
+import contextvars
+import json
+import os
+import random
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SERVICE = "tcg-api"
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "500"))
+ENABLED = bool(TRACE_EXPORT)
+MAX_SPANS = 1000  # 單一 trace 保留的 span 上限
+
+_write_lock = threading.Lock()
+
+class _Trace:
+    """一個請求在本行程內的所有 span；kept 在請求結束時決定 (None 表示尚未結束)"""
+    __slots__ = ("trace_id", "sampled", "spans", "kept", "lock")
+
+    def __init__(self, trace_id, sampled):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans = []
+        self.kept = None
+        self.lock = threading.Lock()
+
+    def add(self, span):
+        with self.lock:
+            if self.kept is None:
+                if len(self.spans) < MAX_SPANS:
+                    self.spans.append(span)
+                return
+            kept = self.kept
+        # 請求結束後才完成的 span (例如背景寫入 MongoDB)
+        if kept:
+            _export([span])
+
+    def finish(self, root):
+        with self.lock:
+            self.kept = self.sampled or root.duration_ms >= TRACE_SLOW_MS
+            spans, self.spans = self.spans, []
+        if self.kept:
+            _export(spans + [root])
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start_ns", "duration_ms", "attributes")
+
+    def __init__(self, trace, parent_id, name, attributes):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.duration_ms = None
+        self.attributes = attributes
+
+    def end(self):
+        self.duration_ms = (time.time_ns() - self.start_ns) / 1e6
+
+    def traceparent(self):
+        return f"00-{self.trace.trace_id}-{self.span_id}-{'01' if self.trace.sampled else '00'}"
+
+_current = contextvars.ContextVar("trace_span", default=None)
+
+def current():
+    """目前的 span (不在追蹤中的請求時為 None)"""
+    return _current.get()
+
+@contextmanager
+def span(name, **attributes):
+    """在目前的 span 底下建立子 span；不在追蹤中的請求時不做任何事"""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, parent.span_id, name, attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.attributes["error"] = repr(e)[:200]
+        raise
+    finally:
+        _current.reset(token)
+        child.end()
+        parent.trace.add(child)
+
+def add_span(parent, name, start_ns, duration_ms, **attributes):
+    """記錄一個已經計時完成的 span (例如 cursor 已量好的 SQL 時間)"""
+    child = Span(parent.trace, parent.span_id, name, attributes)
+    child.start_ns = start_ns
+    child.duration_ms = duration_ms
+    parent.trace.add(child)
+
+def _parse_traceparent(value):
+    parts = (value or "").strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16), int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32:
+        return None
+    return parts[1], parts[2], int(parts[3], 16) & 1 == 1
+
+def _export(spans):
+    lines = []
+    for s in spans:
+        lines.append(json.dumps({
+            "trace_id": s.trace.trace_id,
+            "span_id": s.span_id,
+            "parent_id": s.parent_id,
+            "name": s.name,
+            "service": SERVICE,
+            "start_ns": s.start_ns,
+            "duration_ms": round(s.duration_ms, 3),
+            "attributes": s.attributes,
+        }, ensure_ascii=False, default=str))
+    try:
+        with _write_lock:
+            with open(TRACE_EXPORT, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+    except OSError as e:
+        print(f"Trace export error: {e}")
+
+# --- ASGI middleware ---
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not ENABLED or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        parent = None
+        for key, value in scope["headers"]:
+            if key == b"traceparent":
+                parent = _parse_traceparent(value.decode("latin-1"))
+                break
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id, sampled = secrets.token_hex(16), None, random.random() < TRACE_SAMPLE_RATE
+        root = Span(_Trace(trace_id, sampled), parent_id, scope["method"], {"path": scope["path"]})
+        token = _current.set(root)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                root.attributes["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            route = scope.get("route")
+            root.name = f"{scope['method']} {getattr(route, 'path', scope['path'])}"
+            root.end()
+            root.trace.finish(root)
+
+def _after_fork():
+    global _write_lock
+    _write_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,233 @@
+"""
+db.py micro-benchmark：以隨機抽樣的 id 逐一呼叫 db 模組的每個函式，回報各函式的 p50 / p95 / 平均延遲 (ms)。
+搭配 bench.datagen 在不同 scale factor 下各跑一次，可看出哪些查詢會隨資料量變慢。
+
+結果附加到 --out 的 JSON Lines 檔 (含 label 與各資料表筆數)，--compare 依函式並列各次結果的 p50。
+寫入函式成對執行 (登錄 / 移除卡牌、建立 / 移除牌組、報名 / 退出、進貨 → 上架 → 購買)，盡量讓資料維持原狀，
+但購買會留下銷售紀錄；建立的玩家、商店與賽事在結束時刪除。--skip-writes 只測讀取函式。
+
+使用方式 (於專案根目錄)：
+    python -m bench.datagen --sf 1 --dbname tcg_bench --truncate
+    python -m bench.bench_db --dbname tcg_bench --label sf1 --out bench_results.jsonl
+    python -m bench.bench_db --compare bench_results.jsonl
+"""
+import argparse
+import datetime
+import json
+import math
+import random
+import secrets
+import time
+from backend import db
+
+def _samples(count):
+    """從資料庫抽樣測試用的 id"""
+    with db.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute('SELECT "p_id", "d_id" FROM "PLAYER_BUILDS_DECK" ORDER BY random() LIMIT %s', (count,))
+            decks = [(row["p_id"], row["d_id"]) for row in cur.fetchall()]
+            cur.execute('SELECT "email" FROM "PLAYER" ORDER BY random() LIMIT %s', (count,))
+            emails = [row["email"] for row in cur.fetchall()]
+            cur.execute('SELECT "s_id", "s_name" FROM "SHOP" ORDER BY random() LIMIT %s', (count,))
+            shops = [(row["s_id"], row["s_name"]) for row in cur.fetchall()]
+            cur.execute('SELECT "s_id", "prod_id", "price" FROM "SHOP_SELLS_PRODUCT" ORDER BY random() LIMIT %s', (count,))
+            listings = [(row["s_id"], row["prod_id"], row["price"]) for row in cur.fetchall()]
+            cur.execute('SELECT "c_id", "c_name", "c_type", "c_rarity" FROM "CARD" ORDER BY random() LIMIT %s', (count,))
+            cards = cur.fetchall()
+            # 尚未額滿的賽事與其報名者 (報名 / 退出時避開已報名的玩家，不動到原有的資料)
+            cur.execute("""
+                SELECT e."e_id", ARRAY_REMOVE(ARRAY_AGG(p."p_id"), NULL) AS players FROM "EVENT" e
+                LEFT JOIN "PLAYER_PARTICIPATES_EVENT_WITH_DECK" p ON e."e_id" = p."e_id"
+                WHERE e."e_size" IN ('REGIONAL', 'MAJOR')
+                GROUP BY e."e_id" HAVING COUNT(p."p_id") < 32
+            """)
+            events = {row["e_id"]: set(row["players"]) for row in cur.fetchall()}
+    return {"decks": decks, "emails": emails, "shops": shops, "listings": listings, "cards": cards, "events": events}
+
+def _row_counts():
+    with db.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT c.relname, c.reltuples::bigint AS n FROM pg_class c
+                JOIN pg_namespace ns ON c.relnamespace = ns.oid
+                WHERE ns.nspname = 'public' AND c.relkind = 'r' ORDER BY c.relname
+            """)
+            return {row["relname"]: row["n"] for row in cur.fetchall()}
+
+def _reads(s):
+    """(函式名稱, 以抽樣資料呼叫一次的函式)"""
+    pick = random.choice
+    return [
+        ("get_player_by_email", lambda: db.get_player_by_email(pick(s["emails"]))),
+        ("get_shop_by_name", lambda: db.get_shop_by_name(pick(s["shops"])[1])),
+        ("get_player_cards", lambda: db.get_player_cards(pick(s["decks"])[0], columnar=True)),
+        ("get_player_cards (limit 50)", lambda: db.get_player_cards(pick(s["decks"])[0], limit=50, columnar=True)),
+        ("get_all_card_names_and_ids (limit 50)", lambda: db.get_all_card_names_and_ids(limit=50, columnar=True)),
+        ("get_player_decks", lambda: db.get_player_decks(pick(s["decks"])[0], columnar=True)),
+        ("get_deck_composition", lambda: db.get_deck_composition(pick(s["decks"])[1], columnar=True)),
+        ("get_missing_cards_for_deck", lambda: db.get_missing_cards_for_deck(*pick(s["decks"]), columnar=True)),
+        ("filter_cards (name)", lambda: db.filter_cards(c_name=pick(s["cards"])["c_name"], limit=50, columnar=True)),
+        ("filter_cards (type, rarity)", lambda: db.filter_cards(c_type=[pick(s["cards"])["c_type"]],
+                                                                c_rarity=pick(s["cards"])["c_rarity"],
+                                                                limit=50, columnar=True)),
+        ("get_player_participations_detailed",
+         lambda: db.get_player_participations_detailed(pick(s["decks"])[0], columnar=True)),
+        ("get_shop_inventory", lambda: db.get_shop_inventory(pick(s["shops"])[0], columnar=True)),
+        ("get_shop_storage", lambda: db.get_shop_storage(pick(s["shops"])[0], columnar=True)),
+        ("get_all_products_list", lambda: db.get_all_products_list(columnar=True)),
+        ("get_sales_detail", lambda: db.get_sales_detail(pick(s["shops"])[0], columnar=True)),
+        ("get_all_upcoming_events (limit 50)", lambda: db.get_all_upcoming_events(limit=50, columnar=True)),
+        ("get_market_listings (limit 50)", lambda: db.get_market_listings(limit=50, columnar=True)),
+    ]
+
+def _writes(s, run):
+    """成對的寫入函式：每組 (函式名稱, 函式) 依序執行，最後一個函式把資料還原；名稱為 None 的步驟不計時"""
+    pick = random.choice
+    counter = iter(range(1_000_000))
+
+    def card_pair():
+        p_id, _ = pick(s["decks"])
+        c_id = pick(s["cards"])["c_id"]
+        return [("upsert_player_card", lambda: db.upsert_player_card(p_id, c_id, 1)),
+                ("delete_player_card", lambda: db.delete_player_card(p_id, c_id, 1))]
+
+    def deck_card_pair():
+        _, d_id = pick(s["decks"])
+        c_id = pick(s["cards"])["c_id"]
+        return [("upsert_deck_card", lambda: db.upsert_deck_card(d_id, c_id, 4)),
+                ("upsert_deck_card (delete)", lambda: db.upsert_deck_card(d_id, c_id, 0))]
+
+    def deck_pair():
+        p_id, _ = pick(s["decks"])
+        name = f"bench-{run}"
+        created = []
+        def find():
+            # create_deck 不回傳 d_id，另外查詢 (不計時)
+            with db.get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT MAX(d."d_id") AS d_id FROM "DECK" d JOIN "PLAYER_BUILDS_DECK" pbd ON d."d_id" = pbd."d_id"
+                        WHERE pbd."p_id" = %s AND d."d_name" = %s
+                    """, (p_id, name))
+                    created.append(cur.fetchone()["d_id"])
+        return [("create_deck", lambda: db.create_deck(p_id, name)), (None, find),
+                ("remove_deck", lambda: db.remove_deck(p_id, created[0]))]
+
+    def event_pair():
+        e_id = pick(list(s["events"]))
+        p_id, d_id = pick([deck for deck in s["decks"] if deck[0] not in s["events"][e_id]])
+        return [("join_event", lambda: db.join_event(p_id, e_id, d_id)),
+                ("leave_event", lambda: db.leave_event(p_id, e_id))]
+
+    def buy_chain():
+        s_id, prod_id, price = pick(s["listings"])
+        p_id, _ = pick(s["decks"])
+        return [("restock_shop_product", lambda: db.restock_shop_product(s_id, prod_id, 1)),
+                ("move_product_to_shelf", lambda: db.move_product_to_shelf(s_id, prod_id, 1, price)),
+                ("buy_product", lambda: db.buy_product(p_id, s_id, prod_id, 1))]
+
+    def creates():
+        i = next(counter)
+        s_id = pick(s["shops"])[0]
+        return [("create_player", lambda: db.create_player("bench", f"bench-{run}-{i}@example.com", "x")),
+                ("create_shop", lambda: db.create_shop(f"bench-{run}-{i}", "", "", "x")),
+                ("create_event", lambda: db.create_event(f"bench-{run}-{i}", "標準", datetime.date.today(),
+                                                         "10:00", "POD", "瑞士輪", s_id))]
+
+    return [card_pair, deck_card_pair, deck_pair, event_pair, buy_chain, creates]
+
+def _cleanup(run):
+    with db.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            pattern = f"bench-{run}%"
+            cur.execute('DELETE FROM "PLAYER" WHERE "email" LIKE %s', (pattern,))
+            cur.execute('DELETE FROM "SHOP" WHERE "s_name" LIKE %s', (pattern,))
+            cur.execute('DELETE FROM "EVENT" WHERE "e_name" LIKE %s', (pattern,))
+            # remove_deck 只移除玩家與牌組的關聯
+            cur.execute('DELETE FROM "DECK" WHERE "d_name" LIKE %s', (pattern,))
+
+def _summary(durations):
+    ordered = sorted(durations)
+    def percentile(p):
+        # nearest-rank
+        return ordered[max(math.ceil(p / 100 * len(ordered)), 1) - 1]
+    return {"n": len(ordered), "p50": round(percentile(50), 3), "p95": round(percentile(95), 3),
+            "mean": round(sum(ordered) / len(ordered), 3)}
+
+def _timed(timings, name, call):
+    start = time.perf_counter()
+    call()
+    timings.setdefault(name, []).append((time.perf_counter() - start) * 1000)
+
+def run(repeat, writes):
+    samples = _samples(max(repeat, 100))
+    timings = {}
+    for name, call in _reads(samples):
+        call()  # warm-up (prepared statement、快取)
+        for _ in range(repeat):
+            _timed(timings, name, call)
+    if writes:
+        run_id = secrets.token_hex(3)
+        try:
+            for group in _writes(samples, run_id):
+                for _ in range(repeat):
+                    for name, call in group():
+                        if name is None:
+                            call()
+                        else:
+                            _timed(timings, name, call)
+        finally:
+            _cleanup(run_id)
+    return {name: _summary(durations) for name, durations in timings.items()}
+
+def compare(path):
+    with open(path, encoding="utf-8") as f:
+        runs = [json.loads(line) for line in f if line.strip()]
+    names = list(dict.fromkeys(name for r in runs for name in r["results"]))
+    width = max(len(name) for name in names) + 2
+    print(f"{'p50 ms':<{width}}" + "".join(f"{r['label'][:14]:>16}" for r in runs))
+    print(f"{'PLAYER rows':<{width}}" + "".join(f"{r['rows'].get('PLAYER', 0):>16,}" for r in runs))
+    print("-" * (width + 16 * len(runs)))
+    for name in names:
+        cells = [r["results"].get(name) for r in runs]
+        print(f"{name:<{width}}" + "".join(f"{c['p50']:>16.2f}" if c else f"{'-':>16}" for c in cells))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dbname", help="測試資料庫 (預設為 .env 的 DB_NAME)")
+    parser.add_argument("--repeat", type=int, default=50, help="每個函式的呼叫次數")
+    parser.add_argument("--label", help="此次結果的名稱 (預設為資料庫名稱與玩家數)")
+    parser.add_argument("--out", help="結果附加到此 JSON Lines 檔")
+    parser.add_argument("--skip-writes", action="store_true", help="只測讀取函式")
+    parser.add_argument("--compare", metavar="PATH", help="比較檔案中已保存的結果後結束")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+        return
+    if args.dbname:
+        # 連線池在第一次查詢時才建立，此時改寫設定即可
+        db.DB_CONFIG["dbname"] = args.dbname
+    random.seed(args.seed)
+    rows = _row_counts()
+    label = args.label or f"{db.DB_CONFIG['dbname']} players={rows.get('PLAYER', 0)}"
+    results = run(args.repeat, not args.skip_writes)
+
+    width = max(len(name) for name in results) + 2
+    header = f"{'function':<{width}}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}"
+    print(label)
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        print(f"{name:<{width}}{r['p50']:>10.2f}{r['p95']:>10.2f}{r['mean']:>10.2f}")
+
+    if args.out:
+        with open(args.out, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"label": label, "time": datetime.datetime.now().isoformat(timespec="seconds"),
+                                "rows": rows, "repeat": args.repeat, "results": results}, ensure_ascii=False) + "\n")
+        print(f"Saved to {args.out}")
+    db.close_pool()
+
+if __name__ == "__main__":
+    main()
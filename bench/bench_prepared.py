@@ -0,0 +1,91 @@
+"""
+Prepared statements micro-benchmark：比較熱門查詢以一般 SQL 與伺服器端 prepared statement 執行的差異。
+
+- plan ms: EXPLAIN (ANALYZE, FORMAT JSON) 回報的 Planning Time 平均值，即每個請求省下的規劃時間
+  (prepared 先執行數次讓 PostgreSQL 改用快取的 generic plan，與長時間運作的連線相同)
+- call ms: 透過 db 模組呼叫查詢函式的平均延遲 (含連線池取用、網路往返與 fetch)
+
+需要連得上 .env 設定的資料庫。
+使用方式 (於專案根目錄)：
+    python -m bench.bench_prepared --repeat 200 --p-id 1 --s-id 1 --d-id 1
+"""
+import argparse
+import time
+import psycopg2.extensions
+from backend import db
+from bench.bench_serialization import _endpoints
+
+def _capture(fetch):
+    """呼叫一次查詢函式，記錄它送出的 SQL 與參數"""
+    captured = []
+    execute = db._execute
+    def record(cur, sql, params=()):
+        captured.append((sql, tuple(params)))
+        execute(cur, sql, params)
+    db._execute = record
+    try:
+        fetch(True)
+    finally:
+        db._execute = execute
+    return captured[0]
+
+def _planning_ms(cur, sql, params, repeat):
+    total = 0.0
+    for _ in range(repeat):
+        cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, params)
+        total += cur.fetchone()[0][0]["Planning Time"]
+    return total / repeat
+
+def _plan(sql, params, repeat):
+    """回傳 (一般 SQL, prepared) 的平均規劃時間 (ms)"""
+    name = "bench_" + db._statement_name(sql)
+    placeholders = ", ".join(["%s"] * len(params))
+    execute = f"EXECUTE {name} ({placeholders})" if params else f"EXECUTE {name}"
+    with db.get_db_connection() as conn:
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+            plain = _planning_ms(cur, sql, params, repeat)
+            cur.execute(f"PREPARE {name} AS {db._numbered(sql)}")
+            try:
+                for _ in range(6):  # 第 6 次起 PostgreSQL 才會考慮 generic plan
+                    cur.execute(execute, params)
+                prepared = _planning_ms(cur, execute, params, repeat)
+            finally:
+                cur.execute(f"DEALLOCATE {name}")
+    return plain, prepared
+
+def _call_ms(fetch, prepared, repeat):
+    db.PREPARED_STATEMENTS = prepared
+    fetch(True)  # warm-up (prepared 時順便 PREPARE)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fetch(True)
+    return (time.perf_counter() - start) * 1000 / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--p-id", type=int, default=1)
+    parser.add_argument("--s-id", type=int, default=1)
+    parser.add_argument("--d-id", type=int, default=1)
+    args = parser.parse_args()
+
+    enabled = db.PREPARED_STATEMENTS
+    header = (f"{'endpoint':<42}{'plan ms':>10}{'prepared':>10}{'saved':>9}"
+              f"{'call ms':>10}{'prepared':>10}{'speedup':>9}")
+    print(header)
+    print("-" * len(header))
+    saved_total = 0.0
+    for endpoint, fetch in _endpoints(args).items():
+        sql, params = _capture(fetch)
+        plain_plan, prepared_plan = _plan(sql, params, args.repeat)
+        plain_call = _call_ms(fetch, False, args.repeat)
+        prepared_call = _call_ms(fetch, True, args.repeat)
+        saved_total += plain_plan - prepared_plan
+        speedup = plain_call / prepared_call if prepared_call else 0.0
+        print(f"{endpoint:<42}{plain_plan:>10.3f}{prepared_plan:>10.3f}{plain_plan - prepared_plan:>9.3f}"
+              f"{plain_call:>10.3f}{prepared_call:>10.3f}{speedup:>8.2f}x")
+    print(f"\n所有查詢各執行一次共省下 {saved_total:.3f} ms 規劃時間")
+    db.PREPARED_STATEMENTS = enabled
+
+if __name__ == "__main__":
+    main()
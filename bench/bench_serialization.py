@@ -0,0 +1,88 @@
+"""
+列表 API 序列化 micro-benchmark：比較每個列表 API 在改版前後的 rows/second。
+
+- before: RealDictCursor 逐列建立 dict + jsonable_encoder + json.dumps (FastAPI 預設路徑)
+- after:  tuple cursor + orjson (預設 JSON 格式)
+- columns: tuple cursor + orjson 欄式 JSON (application/vnd.tcg.columns+json)
+- arrow:  tuple cursor + Arrow IPC (有安裝 pyarrow 時)
+
+時間包含查詢 / fetch 與序列化，需要連得上 .env 設定的資料庫。
+使用方式 (於專案根目錄)：
+    python -m bench.bench_serialization --repeat 50 --p-id 1 --s-id 1 --d-id 1
+"""
+import argparse
+import json
+import time
+from fastapi.encoders import jsonable_encoder
+from backend import db
+from backend import arrow_ipc
+from backend import fast_json
+
+def _endpoints(args):
+    return {
+        "/market": lambda columnar: db.get_market_listings(columnar=columnar),
+        "/events": lambda columnar: db.get_all_upcoming_events(columnar=columnar),
+        "/cards": lambda columnar: db.get_all_card_names_and_ids(columnar=columnar),
+        "/products_list": lambda columnar: db.get_all_products_list(columnar=columnar),
+        "/player/{p_id}/cards": lambda columnar: db.get_player_cards(args.p_id, columnar=columnar),
+        "/player/{p_id}/decks": lambda columnar: db.get_player_decks(args.p_id, columnar=columnar),
+        "/player/{p_id}/events": lambda columnar: db.get_player_participations_detailed(args.p_id, columnar=columnar),
+        "/deck/{d_id}/composition": lambda columnar: db.get_deck_composition(args.d_id, columnar=columnar),
+        "/player/{p_id}/decks/{d_id}/missing_cards": lambda columnar: db.get_missing_cards_for_deck(args.p_id, args.d_id, columnar=columnar),
+        "/shop/{s_id}/products": lambda columnar: db.get_shop_inventory(args.s_id, columnar=columnar),
+        "/shop/{s_id}/storage": lambda columnar: db.get_shop_storage(args.s_id, columnar=columnar),
+        "/shop/{s_id}/sales_detail": lambda columnar: db.get_sales_detail(args.s_id, columnar=columnar),
+    }
+
+def _before(fetch):
+    rows = fetch(False)
+    body = json.dumps(jsonable_encoder(rows), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode("utf-8")
+    return len(rows), len(body)
+
+def _after(fetch):
+    rows = fetch(True)
+    return len(rows), len(fast_json.dumps(fast_json.records(rows)))
+
+def _columns(fetch):
+    rows = fetch(True)
+    return len(rows), len(fast_json.dumps(fast_json.columns_payload(rows)))
+
+def _arrow(fetch):
+    rows = fetch(True)
+    return len(rows), len(arrow_ipc.encode(rows))
+
+def _measure(fn, fetch, repeat):
+    fn(fetch)  # warm-up
+    total_rows, size = 0, 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        n, size = fn(fetch)
+        total_rows += n
+    elapsed = time.perf_counter() - start
+    return (total_rows / elapsed if elapsed else 0.0), size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--p-id", type=int, default=1)
+    parser.add_argument("--s-id", type=int, default=1)
+    parser.add_argument("--d-id", type=int, default=1)
+    args = parser.parse_args()
+
+    modes = [("before", _before), ("after", _after), ("columns", _columns)]
+    if arrow_ipc.available():
+        modes.append(("arrow", _arrow))
+
+    header = f"{'endpoint':<42}" + "".join(f"{name + ' rows/s':>16}" for name, _ in modes) + f"{'speedup':>9}"
+    print(header)
+    print("-" * len(header))
+    for endpoint, fetch in _endpoints(args).items():
+        results = [_measure(fn, fetch, args.repeat) for _, fn in modes]
+        speedup = results[1][0] / results[0][0] if results[0][0] else 0.0
+        line = f"{endpoint:<42}" + "".join(f"{rate:>16,.0f}" for rate, _ in results) + f"{speedup:>8.2f}x"
+        print(line)
+        print(f"{'  bytes':<42}" + "".join(f"{size:>16,}" for _, size in results))
+
+if __name__ == "__main__":
+    main()
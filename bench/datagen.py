@@ -0,0 +1,237 @@
+"""
+合成資料產生器：依 scale factor 以 COPY 填滿所有資料表，用來觀察查詢在大資料量下的表現。
+
+scale factor (--sf) 為 1 時約為 1 萬位玩家、500 張卡、10 萬筆銷售明細；--sf 100 時為
+100 萬位玩家、5 萬張卡、1000 萬筆銷售明細。每位玩家有一副牌組 (d_id 與 p_id 相同)，
+熱門的卡牌、商店與商品以偏斜分布選出，賽事日期分布在今天前後半年。
+所有玩家與商店的密碼皆為 "password"。同一個 --seed 產生相同的資料。
+
+會清空 (TRUNCATE) 目標資料庫的所有資料表，請指向專用的測試資料庫 (--dbname 或 .env 的 DB_NAME)；
+資料表已有資料時須加上 --truncate 才會執行。
+使用方式 (於專案根目錄)：
+    python -m bench.datagen --sf 1 --dbname tcg_bench --truncate
+"""
+import argparse
+import datetime
+import random
+import sys
+import time
+import bcrypt
+import psycopg2
+from backend import db
+
+TABLES = [
+    "SERIES", "CARD", "PLAYER", "SHOP", "DECK", "PLAYER_BUILDS_DECK", "DECK_CONSISTS_OF_CARD",
+    "PLAYER_HAS_CARD", "PRODUCT", "SHOP_SELLS_PRODUCT", "SHOP_STORES_PRODUCT", "EVENT",
+    "PLAYER_PARTICIPATES_EVENT_WITH_DECK", "SALES", "SALES_DETAIL",
+]
+SEQUENCES = [
+    ("SERIES", "series_id"), ("CARD", "c_id"), ("PLAYER", "p_id"), ("SHOP", "s_id"), ("DECK", "d_id"),
+    ("PRODUCT", "prod_id"), ("EVENT", "e_id"), ("SALES", "sales_id"),
+]
+
+CARD_TYPES = ["Fire", "Water", "Grass", "Lightning", "Psychic", "Fighting", "Trainer", "Energy"]
+RARITIES = [("Common", 60), ("Uncommon", 25), ("Rare", 12), ("Secret", 3)]
+PRODUCT_TYPES = [("Single", 40), ("Pack", 30), ("Box", 15), ("Supply", 15)]
+EVENT_SIZES = [("POD", 50), ("LOCAL", 30), ("REGIONAL", 15), ("MAJOR", 5)]
+SIZE_MAPPING = {"POD": 8, "LOCAL": 16, "REGIONAL": 32, "MAJOR": 64}
+EVENT_FORMATS = ["標準", "開放", "限制"]
+ROUND_TYPES = ["瑞士輪", "單淘汰"]
+CARDS_PER_DECK = 10
+CARDS_PER_PLAYER = 10
+PRODUCTS_PER_SHOP = 50
+
+def scale(sf):
+    """各資料表的筆數"""
+    cards = max(50, int(500 * sf))
+    return {
+        "players": max(20, int(10_000 * sf)),
+        "cards": cards,
+        "series": max(5, cards // 100),
+        "shops": max(3, int(50 * sf)),
+        "products": max(20, int(200 * sf)),
+        "events": max(10, int(100 * sf)),
+        "sales_lines": max(100, int(100_000 * sf)),
+    }
+
+def _skewed(rng, n):
+    """1..n，偏向較小的 id (熱門的卡牌 / 商店 / 商品)"""
+    return int(n * rng.random() ** 2) + 1
+
+def _weighted(rng, choices):
+    return rng.choices([value for value, _ in choices], [weight for _, weight in choices])[0]
+
+class _CopySource:
+    """把 row generator 包成 copy_expert 讀取的檔案 (tab 分隔的 COPY text 格式)"""
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ""
+        self.count = 0
+
+    def _line(self, row):
+        self.count += 1
+        return "\t".join("\\N" if value is None else str(value) for value in row) + "\n"
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = []
+            for row in self._rows:
+                chunk.append(self._line(row))
+                if len(chunk) >= 1000:
+                    break
+            if not chunk:
+                break
+            self._buffer += "".join(chunk)
+        if size < 0:
+            data, self._buffer = self._buffer, ""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    readline = read
+
+# --- 各資料表的資料 ---
+def _cards(rng, n):
+    for c_id in range(1, n["cards"] + 1):
+        yield (c_id, f"Card {c_id}", rng.choice(CARD_TYPES), _weighted(rng, RARITIES), rng.randint(1, n["series"]))
+
+def _players(n, password):
+    for p_id in range(1, n["players"] + 1):
+        yield (p_id, f"Player {p_id}", f"player{p_id}@example.com", password)
+
+def _shops(n, password):
+    for s_id in range(1, n["shops"] + 1):
+        yield (s_id, f"Shop {s_id}", f"Address {s_id}", f"02-{s_id:08d}", password)
+
+def _deck_cards(rng, n):
+    for d_id in range(1, n["players"] + 1):
+        for c_id in sorted({_skewed(rng, n["cards"]) for _ in range(CARDS_PER_DECK)}):
+            yield (d_id, c_id, rng.randint(1, 4))
+
+def _player_cards(rng, n):
+    for p_id in range(1, n["players"] + 1):
+        for c_id in sorted({_skewed(rng, n["cards"]) for _ in range(CARDS_PER_PLAYER)}):
+            yield (p_id, c_id, rng.randint(1, 4))
+
+def _products(rng, n):
+    for prod_id in range(1, n["products"] + 1):
+        prod_type = _weighted(rng, PRODUCT_TYPES)
+        c_id = _skewed(rng, n["cards"]) if prod_type == "Single" else None
+        yield (prod_id, f"Product {prod_id}", prod_type, c_id)
+
+def _shop_products(n, seed):
+    """每間商店販售 / 儲存的商品 (上架與倉庫共用同一份清單)"""
+    rng = random.Random(seed)
+    k = min(PRODUCTS_PER_SHOP, n["products"])
+    return {s_id: sorted(rng.sample(range(1, n["products"] + 1), k)) for s_id in range(1, n["shops"] + 1)}
+
+def _shop_sells(rng, shop_products):
+    for s_id, products in shop_products.items():
+        for prod_id in products:
+            # 約一成已售完 (qty = 0)
+            yield (s_id, prod_id, 0 if rng.random() < 0.1 else rng.randint(1, 50), rng.randint(1, 100) * 50)
+
+def _shop_stores(rng, shop_products):
+    for s_id, products in shop_products.items():
+        for prod_id in products:
+            yield (s_id, prod_id, rng.randint(0, 200))
+
+def _events(rng, n):
+    today = datetime.date.today()
+    for e_id in range(1, n["events"] + 1):
+        yield (e_id, f"Event {e_id}", rng.choice(EVENT_FORMATS), today + datetime.timedelta(days=rng.randint(-180, 180)),
+               rng.choice(["10:00:00", "13:00:00", "19:00:00"]), _weighted(rng, EVENT_SIZES), rng.choice(ROUND_TYPES),
+               _skewed(rng, n["shops"]))
+
+def _participations(rng, n, events):
+    for e_id, _, _, _, _, e_size, _, _ in events:
+        capacity = min(SIZE_MAPPING[e_size], n["players"])
+        for p_id in sorted(rng.sample(range(1, n["players"] + 1), rng.randint(0, capacity))):
+            yield (p_id, e_id, p_id)
+
+def _sales(seed, n, shop_products):
+    """產生 (SALES 列, [SALES_DETAIL 列]) ；兩張表各跑一次，相同 seed 得到相同結果"""
+    rng = random.Random(seed)
+    now = datetime.datetime.now().replace(microsecond=0)
+    sales_id, lines = 0, 0
+    while lines < n["sales_lines"]:
+        sales_id += 1
+        s_id = _skewed(rng, n["shops"])
+        sold_at = now - datetime.timedelta(seconds=rng.randint(0, 365 * 86400))
+        products = rng.sample(shop_products[s_id], min(rng.randint(1, 3), len(shop_products[s_id])))
+        lines += len(products)
+        yield ((sales_id, sold_at, rng.randint(1, n["players"]), s_id),
+               [(sales_id, prod_id, rng.randint(1, 3)) for prod_id in products])
+
+def _copy(cur, table, columns, rows):
+    start = time.perf_counter()
+    source = _CopySource(rows)
+    cols = ", ".join(f'"{c}"' for c in columns)
+    cur.copy_expert(f'COPY "{table}" ({cols}) FROM STDIN', source)
+    print(f"  {table:<38}{source.count:>12,} rows {time.perf_counter() - start:>8.1f} s")
+
+def generate(conn, sf, seed):
+    n = scale(sf)
+    rng = random.Random(seed)
+    password = bcrypt.hashpw(b"password", bcrypt.gensalt(4)).decode()
+    shop_products = _shop_products(n, seed + 1)
+    events = list(_events(random.Random(seed + 2), n))
+
+    with conn.cursor() as cur:
+        cur.execute("SET synchronous_commit = off")
+        cur.execute("TRUNCATE " + ", ".join(f'"{t}"' for t in TABLES) + " RESTART IDENTITY CASCADE")
+        _copy(cur, "SERIES", ["series_id", "series_name"],
+              ((i, f"Series {i}") for i in range(1, n["series"] + 1)))
+        _copy(cur, "CARD", ["c_id", "c_name", "c_type", "c_rarity", "series_id"], _cards(rng, n))
+        _copy(cur, "PLAYER", ["p_id", "p_name", "email", "password"], _players(n, password))
+        _copy(cur, "SHOP", ["s_id", "s_name", "s_addr", "s_phone", "password"], _shops(n, password))
+        _copy(cur, "DECK", ["d_id", "d_name"], ((d, f"Deck {d}") for d in range(1, n["players"] + 1)))
+        _copy(cur, "PLAYER_BUILDS_DECK", ["p_id", "d_id"], ((p, p) for p in range(1, n["players"] + 1)))
+        _copy(cur, "DECK_CONSISTS_OF_CARD", ["d_id", "c_id", "qty"], _deck_cards(rng, n))
+        _copy(cur, "PLAYER_HAS_CARD", ["p_id", "c_id", "qty"], _player_cards(rng, n))
+        _copy(cur, "PRODUCT", ["prod_id", "prod_name", "prod_type", "c_id"], _products(rng, n))
+        _copy(cur, "SHOP_SELLS_PRODUCT", ["s_id", "prod_id", "qty", "price"], _shop_sells(rng, shop_products))
+        _copy(cur, "SHOP_STORES_PRODUCT", ["s_id", "prod_id", "qty"], _shop_stores(rng, shop_products))
+        _copy(cur, "EVENT", ["e_id", "e_name", "e_format", "e_date", "e_time", "e_size", "e_roundtype", "org_shop_id"],
+              events)
+        _copy(cur, "PLAYER_PARTICIPATES_EVENT_WITH_DECK", ["p_id", "e_id", "d_id"], _participations(rng, n, events))
+        _copy(cur, "SALES", ["sales_id", "datetime", "p_id", "s_id"],
+              (sale for sale, _ in _sales(seed + 3, n, shop_products)))
+        _copy(cur, "SALES_DETAIL", ["sales_id", "prod_id", "qty"],
+              (line for _, details in _sales(seed + 3, n, shop_products) for line in details))
+        for table, column in SEQUENCES:
+            cur.execute(f"""SELECT setval(pg_get_serial_sequence('"{table}"', '{column}'),
+                                          COALESCE(MAX("{column}"), 0) + 1, false) FROM "{table}" """)
+    conn.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sf", type=float, default=1.0, help="scale factor")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--dbname", help="目標資料庫 (預設為 .env 的 DB_NAME)")
+    parser.add_argument("--truncate", action="store_true", help="資料表已有資料時仍清空並重新產生")
+    args = parser.parse_args()
+
+    config = dict(db.DB_CONFIG, dbname=args.dbname or db.DB_CONFIG["dbname"])
+    conn = psycopg2.connect(**config)
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT EXISTS (SELECT 1 FROM "PLAYER") OR EXISTS (SELECT 1 FROM "CARD")')
+            if cur.fetchone()[0] and not args.truncate:
+                print(f"資料庫 {config['dbname']} 已有資料，確定要清空請加上 --truncate")
+                sys.exit(1)
+        conn.rollback()
+
+        print(f"Generating sf={args.sf} into {config['dbname']}: {scale(args.sf)}")
+        start = time.perf_counter()
+        generate(conn, args.sf, args.seed)
+        # 更新統計資訊，讓 planner 依新的資料量選擇執行計畫
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE")
+        print(f"Done in {time.perf_counter() - start:.1f} s")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
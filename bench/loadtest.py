@@ -0,0 +1,345 @@
+"""
+HTTP 壓力測試與正確性檢查：對執行中的 API 送出並行請求，回報 throughput 與 p50/p95/p99 延遲，
+結束後直接查詢資料庫檢查不變量。
+
+情境 (--scenario，預設全部)：
+- browse: 瀏覽 /market、/cards (含篩選)、/events 的混合讀取，持續 --duration 秒
+- retry:  鎖住搶購商品讓一次購買逾時，放開後以同一個 Idempotency-Key 重送兩次，只能成立一筆銷售
+- buy:    --buyers 個請求同時搶購同一個商品 (架上庫存 --stock)
+- join:   --players 位玩家同時報名同一場賽事 (POD，上限 8 人)
+
+每次執行會先建立獨立的測試商店、商品與賽事 (seed)，測試玩家 loadtest<N>@example.com 重複使用。
+不變量：架上庫存不為負、賽事報名人數不超過上限、測試商品的 SALES_DETAIL 總數等於庫存減少量，
+且與成功的購買 / 報名請求數一致，逾時後重送的購買只成立一筆；任一項失敗時以 exit code 1 結束，可放進發版前的檢查。
+
+需要連得上 .env 設定的資料庫，且 API 已啟動 (uvicorn backend.main:app 或 python -m backend.serve)。
+使用方式 (於專案根目錄)：
+    python -m bench.loadtest --concurrency 32 --duration 20 --json results.json
+"""
+import argparse
+import datetime
+import json
+import math
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+import requests
+from backend import db
+
+SIZE_MAPPING = {"POD": 8, "LOCAL": 16, "REGIONAL": 32, "MAJOR": 64}
+
+# --- Seed ---
+def seed(players, stock):
+    """建立本次執行專用的商店、商品 (架上庫存 stock) 與 POD 賽事，並確保有 players 位測試玩家 (各有一副牌組)"""
+    run_id = uuid.uuid4().hex[:8]
+    password = bcrypt.hashpw(b"loadtest", bcrypt.gensalt(4)).decode()
+    with db.get_db_connection(writes=("SHOP", "PRODUCT", "SHOP_SELLS_PRODUCT", "EVENT", "PLAYER", "DECK",
+                                      "PLAYER_BUILDS_DECK")) as conn:
+        with conn.cursor() as cur:
+            cur.execute('INSERT INTO "SHOP" ("s_name", "s_addr", "s_phone", "password") VALUES (%s, %s, %s, %s) '
+                        'RETURNING "s_id"', (f"loadtest-{run_id}", "loadtest", "0000", password))
+            s_id = cur.fetchone()["s_id"]
+            cur.execute('INSERT INTO "PRODUCT" ("prod_name", "prod_type") VALUES (%s, %s) RETURNING "prod_id"',
+                        (f"loadtest-{run_id}", "Pack"))
+            prod_id = cur.fetchone()["prod_id"]
+            cur.execute('INSERT INTO "SHOP_SELLS_PRODUCT" ("s_id", "prod_id", "qty", "price") VALUES (%s, %s, %s, %s)',
+                        (s_id, prod_id, stock, 100))
+            cur.execute('INSERT INTO "EVENT" ("e_name", "e_format", "e_date", "e_time", "e_size", "e_roundtype", '
+                        '"org_shop_id") VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING "e_id"',
+                        (f"loadtest-{run_id}", "標準", datetime.date.today() + datetime.timedelta(days=7),
+                         datetime.time(12, 0), "POD", "瑞士輪", s_id))
+            e_id = cur.fetchone()["e_id"]
+
+            roster = []
+            for i in range(players):
+                email = f"loadtest{i}@example.com"
+                cur.execute('SELECT "p_id" FROM "PLAYER" WHERE "email" = %s', (email,))
+                row = cur.fetchone()
+                if row is None:
+                    cur.execute('INSERT INTO "PLAYER" ("p_name", "email", "password") VALUES (%s, %s, %s) '
+                                'RETURNING "p_id"', (f"loadtest{i}", email, password))
+                    row = cur.fetchone()
+                p_id = row["p_id"]
+                cur.execute('SELECT "d_id" FROM "PLAYER_BUILDS_DECK" WHERE "p_id" = %s ORDER BY "d_id" LIMIT 1', (p_id,))
+                deck = cur.fetchone()
+                if deck is None:
+                    cur.execute('INSERT INTO "DECK" ("d_name") VALUES (%s) RETURNING "d_id"', ("loadtest",))
+                    deck = cur.fetchone()
+                    cur.execute('INSERT INTO "PLAYER_BUILDS_DECK" ("p_id", "d_id") VALUES (%s, %s)', (p_id, deck["d_id"]))
+                roster.append((p_id, deck["d_id"]))
+    return {"run_id": run_id, "s_id": s_id, "prod_id": prod_id, "e_id": e_id, "stock": stock, "players": roster}
+
+def cleanup(fixture):
+    with db.get_db_connection(writes=("PLAYER_PARTICIPATES_EVENT_WITH_DECK", "EVENT", "SALES_DETAIL", "SALES",
+                                      "SHOP_SELLS_PRODUCT", "PRODUCT", "SHOP")) as conn:
+        with conn.cursor() as cur:
+            cur.execute('DELETE FROM "PLAYER_PARTICIPATES_EVENT_WITH_DECK" WHERE "e_id" = %s', (fixture["e_id"],))
+            cur.execute('DELETE FROM "EVENT" WHERE "e_id" = %s', (fixture["e_id"],))
+            cur.execute('DELETE FROM "SALES_DETAIL" WHERE "sales_id" IN (SELECT "sales_id" FROM "SALES" WHERE "s_id" = %s)',
+                        (fixture["s_id"],))
+            cur.execute('DELETE FROM "SALES" WHERE "s_id" = %s', (fixture["s_id"],))
+            cur.execute('DELETE FROM "SHOP_SELLS_PRODUCT" WHERE "s_id" = %s', (fixture["s_id"],))
+            cur.execute('DELETE FROM "PRODUCT" WHERE "prod_id" = %s', (fixture["prod_id"],))
+            cur.execute('DELETE FROM "SHOP" WHERE "s_id" = %s', (fixture["s_id"],))
+
+# --- 統計 ---
+class Results:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.ok = 0
+        self.rejected = 0  # 4xx：庫存不足、人數已滿等業務上的拒絕
+        self.errors = 0    # 5xx 或連線失敗
+        self.elapsed = 0.0
+
+    def record(self, seconds, status):
+        with self.lock:
+            self.latencies.append(seconds)
+            if status is not None and status < 400:
+                self.ok += 1
+            elif status is not None and status < 500:
+                self.rejected += 1
+            else:
+                self.errors += 1
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            # nearest-rank
+            return latencies[max(math.ceil(p / 100 * len(latencies)), 1) - 1] * 1000
+
+        return {
+            "scenario": self.name,
+            "requests": len(latencies),
+            "ok": self.ok,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "throughput": len(latencies) / self.elapsed if self.elapsed else 0.0,
+            "p50_ms": percentile(50),
+            "p95_ms": percentile(95),
+            "p99_ms": percentile(99),
+        }
+
+_local = threading.local()
+
+def _session():
+    # 每個執行緒一個 keep-alive 連線
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
+def _call(results, method, url, timeout=30, **kwargs):
+    start = time.perf_counter()
+    try:
+        status = _session().request(method, url, timeout=timeout, **kwargs).status_code
+    except requests.RequestException:
+        status = None
+    results.record(time.perf_counter() - start, status)
+    return status
+
+# --- 情境 ---
+BROWSE_MIX = [
+    (40, "/market", None),
+    (20, "/market", {"limit": 50}),
+    (15, "/cards", None),
+    (15, "/cards", {"name": "a", "limit": 50}),
+    (10, "/events", None),
+]
+
+def run_browse(url, concurrency, duration):
+    results = Results("browse")
+    weights = [w for w, _, _ in BROWSE_MIX]
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        while time.perf_counter() < deadline:
+            _, path, params = random.choices(BROWSE_MIX, weights)[0]
+            _call(results, "GET", url + path, params=params)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    results.elapsed = time.perf_counter() - start
+    return results, {}
+
+def _stampede(concurrency, calls):
+    """第一波 (concurrency 個) 請求等到同一時間點才一起送出，其餘請求隨後補上"""
+    parties = min(concurrency, len(calls))
+    barrier = threading.Barrier(parties)
+
+    def run(indexed):
+        i, call = indexed
+        if i < parties:
+            try:
+                barrier.wait(timeout=10)
+            except threading.BrokenBarrierError:
+                pass
+        return call()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        statuses = list(executor.map(run, enumerate(calls)))
+    return statuses, time.perf_counter() - start
+
+def _sales_count(fixture):
+    with db.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute('SELECT COUNT(*) AS n FROM "SALES" WHERE "s_id" = %s', (fixture["s_id"],))
+            return cur.fetchone()["n"]
+
+def run_retry(url, fixture):
+    """
+    第一次購買等在被鎖住的架上商品上，用戶端 1 秒後逾時 (不計入統計)；放開鎖後以同一個 Idempotency-Key 重送兩次，
+    兩次都應成功且只多一筆 SALES (不論第一次是被取消還是在放開鎖後完成)。
+    """
+    results = Results("retry")
+    body = {"p_id": fixture["players"][0][0], "s_id": fixture["s_id"], "prod_id": fixture["prod_id"], "qty": 1}
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+    before = _sales_count(fixture)
+    start = time.perf_counter()
+    with db.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1 FROM "SHOP_SELLS_PRODUCT" WHERE "s_id" = %s AND "prod_id" = %s FOR UPDATE',
+                        (fixture["s_id"], fixture["prod_id"]))
+            try:
+                _session().post(url + "/market/buy", json=body, headers=headers, timeout=1)
+            except requests.Timeout:
+                pass
+    statuses = [_call(results, "POST", url + "/market/buy", json=body, headers=headers) for _ in range(2)]
+    results.elapsed = time.perf_counter() - start
+    return results, {"buy_ok": int(statuses[0] == 200), "retry_ok": statuses.count(200),
+                     "retry_sales": _sales_count(fixture) - before}
+
+def run_buy(url, concurrency, fixture, buyers):
+    results = Results("buy")
+    roster = fixture["players"]
+    calls = [lambda i=i: _call(results, "POST", url + "/market/buy", json={
+        "p_id": roster[i % len(roster)][0], "s_id": fixture["s_id"], "prod_id": fixture["prod_id"], "qty": 1,
+    }) for i in range(buyers)]
+    statuses, results.elapsed = _stampede(concurrency, calls)
+    return results, {"buy_ok": sum(1 for status in statuses if status == 200)}
+
+def run_join(url, concurrency, fixture):
+    results = Results("join")
+    calls = [lambda p_id=p_id, d_id=d_id: _call(results, "POST", url + "/player/join_event", json={
+        "p_id": p_id, "e_id": fixture["e_id"], "d_id": d_id,
+    }) for p_id, d_id in fixture["players"]]
+    statuses, results.elapsed = _stampede(concurrency, calls)
+    return results, {"join_ok": sum(1 for status in statuses if status == 200)}
+
+# --- 不變量 ---
+def check_invariants(fixture, counts):
+    """回傳 [(名稱, 是否通過, 說明), ...]"""
+    checks = []
+    with db.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute('SELECT COUNT(*) AS n FROM "SHOP_SELLS_PRODUCT" WHERE "qty" < 0')
+            negative = cur.fetchone()["n"]
+            checks.append(("架上庫存不為負", negative == 0, f"{negative} 筆庫存為負"))
+
+            cur.execute("""
+                SELECT e."e_id", e."e_size", COUNT(p."p_id") AS n
+                FROM "EVENT" e JOIN "PLAYER_PARTICIPATES_EVENT_WITH_DECK" p ON p."e_id" = e."e_id"
+                GROUP BY e."e_id", e."e_size"
+            """)
+            over = [row for row in cur.fetchall() if row["n"] > SIZE_MAPPING.get(row["e_size"], float("inf"))]
+            checks.append(("賽事報名不超過上限", not over,
+                           ", ".join(f"e_id={row['e_id']} {row['n']}/{row['e_size']}" for row in over) or "ok"))
+
+            cur.execute('SELECT "qty" FROM "SHOP_SELLS_PRODUCT" WHERE "s_id" = %s AND "prod_id" = %s',
+                        (fixture["s_id"], fixture["prod_id"]))
+            remaining = cur.fetchone()["qty"]
+            cur.execute("""
+                SELECT COALESCE(SUM(sd."qty"), 0) AS sold, COUNT(*) AS sales
+                FROM "SALES" s JOIN "SALES_DETAIL" sd ON sd."sales_id" = s."sales_id"
+                WHERE s."s_id" = %s AND sd."prod_id" = %s
+            """, (fixture["s_id"], fixture["prod_id"]))
+            row = cur.fetchone()
+            decrement = fixture["stock"] - remaining
+            checks.append(("SALES_DETAIL 總數等於庫存減少量", row["sold"] == decrement,
+                           f"sold={row['sold']} decrement={decrement}"))
+            if "buy_ok" in counts:
+                checks.append(("成功購買數等於銷售筆數", counts["buy_ok"] == row["sales"],
+                               f"ok={counts['buy_ok']} sales={row['sales']}"))
+
+            cur.execute('SELECT COUNT(*) AS n FROM "PLAYER_PARTICIPATES_EVENT_WITH_DECK" WHERE "e_id" = %s',
+                        (fixture["e_id"],))
+            joined = cur.fetchone()["n"]
+            if "retry_sales" in counts:
+                checks.append(("逾時後以同一個 Idempotency-Key 重送只成立一筆銷售",
+                               counts["retry_ok"] == 2 and counts["retry_sales"] == 1,
+                               f"ok={counts['retry_ok']}/2 sales={counts['retry_sales']}"))
+            if "join_ok" in counts:
+                expected = min(len(fixture["players"]), SIZE_MAPPING["POD"])
+                checks.append(("成功報名數等於報名人數且額滿", counts["join_ok"] == joined == expected,
+                               f"ok={counts['join_ok']} joined={joined} expected={expected}"))
+    return checks
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--scenario", choices=["all", "browse", "retry", "buy", "join"], default="all")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10, help="browse 的持續秒數")
+    parser.add_argument("--stock", type=int, default=50, help="搶購商品的架上庫存")
+    parser.add_argument("--buyers", type=int, default=200, help="搶購的請求數 (每次買 1 個)")
+    parser.add_argument("--players", type=int, default=40, help="報名賽事的玩家數 (POD 上限 8 人)")
+    parser.add_argument("--json", help="另外把結果寫入此 JSON 檔，方便比較各版本")
+    parser.add_argument("--cleanup", action="store_true", help="結束後刪除本次建立的商店、商品、賽事與銷售紀錄")
+    args = parser.parse_args()
+
+    fixture = seed(args.players, args.stock)
+    print(f"seed: run={fixture['run_id']} s_id={fixture['s_id']} prod_id={fixture['prod_id']} "
+          f"e_id={fixture['e_id']} players={len(fixture['players'])}\n")
+
+    summaries, counts = [], {}
+    # retry 在 buy 之前執行，搶購商品還有庫存
+    scenarios = ["browse", "retry", "buy", "join"] if args.scenario == "all" else [args.scenario]
+    for scenario in scenarios:
+        if scenario == "browse":
+            results, extra = run_browse(args.url, args.concurrency, args.duration)
+        elif scenario == "retry":
+            results, extra = run_retry(args.url, fixture)
+        elif scenario == "buy":
+            results, extra = run_buy(args.url, args.concurrency, fixture, args.buyers)
+        else:
+            results, extra = run_join(args.url, args.concurrency, fixture)
+        summaries.append(results.summary())
+        for key, value in extra.items():
+            counts[key] = counts.get(key, 0) + value
+
+    header = (f"{'scenario':<10}{'requests':>10}{'ok':>8}{'rejected':>10}{'errors':>8}"
+              f"{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    print(header)
+    print("-" * len(header))
+    for s in summaries:
+        print(f"{s['scenario']:<10}{s['requests']:>10}{s['ok']:>8}{s['rejected']:>10}{s['errors']:>8}"
+              f"{s['throughput']:>10.1f}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}")
+
+    checks = check_invariants(fixture, counts)
+    print()
+    for name, passed, detail in checks:
+        print(f"[{'PASS' if passed else 'FAIL'}] {name}: {detail}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"time": datetime.datetime.now().isoformat(timespec="seconds"), "args": vars(args),
+                       "results": summaries,
+                       "invariants": [{"name": n, "passed": p, "detail": d} for n, p, d in checks]},
+                      f, ensure_ascii=False, indent=2)
+    if args.cleanup:
+        cleanup(fixture)
+    if not all(passed for _, passed, _ in checks) or any(s["errors"] for s in summaries):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
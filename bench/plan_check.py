@@ -0,0 +1,187 @@
+"""
+執行計畫回歸檢查：在大資料量的測試資料庫上呼叫 db.py 的每個函式，記下它送出的每個 SQL，
+再以 EXPLAIN (FORMAT JSON) 檢查執行計畫，避免修改 SQL 後查詢悄悄退化成循序掃描。
+
+檢查項目：
+- 大資料表 (LARGE_TABLES，例如 SALES、PLAYER_HAS_CARD) 不得出現 Seq Scan
+- PLAYER_HAS_CARD 的查詢必須使用索引
+- 估計成本 (Total Cost) 不超過 --max-cost (回傳整張清單的函式見 COST_EXEMPT)
+
+寫入函式在不會 commit 的連線上執行 (結束時 rollback)，不會改動資料。
+--save 保存目前的計畫 (不含成本數字)，之後以 --baseline 比較時，失敗的 SQL 會列出與保存時的計畫差異；
+任一項檢查失敗時 exit code 為 1。
+
+使用方式 (於專案根目錄)：
+    python -m bench.datagen --sf 1 --dbname tcg_bench --truncate
+    python -m backend.migrate --dbname tcg_bench
+    python -m bench.plan_check --dbname tcg_bench --save plans.json
+    python -m bench.plan_check --dbname tcg_bench --baseline plans.json
+"""
+import argparse
+import difflib
+import json
+import random
+import re
+import sys
+from contextlib import contextmanager
+import psycopg2.extensions
+from backend import db
+from bench.bench_db import _reads, _samples, _writes
+
+# 資料量隨玩家數或銷售量成長的資料表
+LARGE_TABLES = {"SALES", "SALES_DETAIL", "PLAYER", "PLAYER_HAS_CARD", "DECK", "DECK_CONSISTS_OF_CARD",
+                "PLAYER_BUILDS_DECK"}
+INDEXED_TABLES = {"PLAYER_HAS_CARD"}
+# INDEXED_TABLES 上不得出現的掃描方式 (Bitmap Heap Scan 的 Relation Name 在 heap 節點上，子節點才是索引，不列入)
+NON_INDEX_SCANS = {"Seq Scan", "Tid Scan", "Tid Range Scan"}
+# 依設計回傳整張清單 (沒有 limit) 的函式，成本隨資料量成長，只檢查掃描方式
+COST_EXEMPT = {"get_sales_detail", "get_all_products_list"}
+# get_sales_detail 回傳商店的所有銷售明細：SALES 必須走 s_id 索引，但大商店的明細與玩家改以
+# hash join 整表掃描比逐筆查主鍵便宜，由 planner 依資料量決定
+SEQ_SCAN_ALLOWED = {"get_sales_detail": {"SALES_DETAIL", "PLAYER"}}
+
+def _line(node, depth):
+    text = node["Node Type"]
+    if node.get("Index Name"):
+        text += f" using {node['Index Name']}"
+    if node.get("Relation Name"):
+        text += f" on {node['Relation Name']}"
+    for key in ("Index Cond", "Filter", "Join Filter", "Hash Cond"):
+        if node.get(key):
+            # 常數換成 ?，參數不同的同一個計畫不會出現差異
+            condition = re.sub(r"\b\d+(\.\d+)?\b", "?", re.sub(r"'[^']*'", "'?'", node[key]))
+            text += f"  {key}: {condition}"
+    return "  " * depth + text
+
+def _nodes(node, depth=0):
+    yield node, depth
+    for child in node.get("Plans", []):
+        yield from _nodes(child, depth + 1)
+
+def render(plan):
+    """計畫的樹狀文字 (不含成本，方便比較差異)"""
+    return [_line(node, depth) for node, depth in _nodes(plan)]
+
+def check(function, plan, max_cost):
+    """回傳違反的規則 (空清單表示通過)"""
+    problems = []
+    for node, _ in _nodes(plan):
+        relation = node.get("Relation Name")
+        if (node["Node Type"] == "Seq Scan" and relation in LARGE_TABLES
+                and relation not in SEQ_SCAN_ALLOWED.get(function, ())):
+            problems.append(f"Seq Scan on {relation}")
+        elif relation in INDEXED_TABLES and node["Node Type"] in NON_INDEX_SCANS:
+            problems.append(f"{node['Node Type']} on {relation} (expected an index scan)")
+    if function not in COST_EXEMPT and plan["Total Cost"] > max_cost:
+        problems.append(f"estimated cost {plan['Total Cost']:.0f} > {max_cost:.0f}")
+    return problems
+
+# --- 收集每個函式送出的 SQL ---
+class _Rollback(Exception):
+    pass
+
+def _rollback_connection(connection):
+    """
+    包住 db._connection：連線池 (含 replica)、read_snapshot 的交易與 statement timeout 都與正式執行相同，
+    但區塊結束時丟出 _Rollback 讓 _connection 以 rollback 結束，寫入函式不會改動資料。
+    read_snapshot 內的查詢沿用外層連線，_Rollback 只離開內層，由外層的 read_snapshot 結束時 rollback。
+    """
+    @contextmanager
+    def rollback_connection(writes, retries, readonly):
+        try:
+            with connection(writes, retries, readonly) as conn:
+                yield conn
+                raise _Rollback()
+        except _Rollback:
+            pass
+    return rollback_connection
+
+def capture(samples):
+    """[(函式名稱, SQL, 參數)]，同一個函式的多個 SQL 依執行順序排列"""
+    statements = []
+    execute = db._TimedCursorMixin.execute
+    connection = db._connection
+
+    def record(self, query, vars=None):
+        statements.append((db._query_tag.get(), query, vars))
+        return execute(self, query, vars)
+
+    calls = list(_reads(samples))
+    for group in _writes(samples, "plan"):
+        calls += group()
+    # 以一般 SQL 執行才能記下原本的查詢 (EXECUTE 只有 prepared statement 名稱)
+    prepared, db.PREPARED_STATEMENTS = db.PREPARED_STATEMENTS, False
+    db._TimedCursorMixin.execute = record
+    db._connection = _rollback_connection(connection)
+    try:
+        for _, call in calls:
+            call()
+    finally:
+        db._TimedCursorMixin.execute = execute
+        db._connection = connection
+        db.PREPARED_STATEMENTS = prepared
+
+    seen, unique = set(), []
+    for function, query, vars in statements:
+        # 只檢查 db 模組函式的 SQL (略過 bench_db 輔助查詢)
+        if not hasattr(db, function or "") or not re.match(r"\s*(--[^\n]*\n\s*)*(SELECT|INSERT|UPDATE|DELETE|WITH)\b", query, re.I):
+            continue
+        if (function, query) not in seen:
+            seen.add((function, query))
+            unique.append((function, query, vars))
+    return unique
+
+def explain(cur, query, vars):
+    cur.execute("EXPLAIN (FORMAT JSON) " + query, vars)
+    return cur.fetchone()[0][0]["Plan"]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dbname", help="測試資料庫 (預設為 .env 的 DB_NAME)")
+    parser.add_argument("--max-cost", type=float, default=5000, help="估計成本的上限")
+    parser.add_argument("--save", metavar="PATH", help="保存目前的計畫")
+    parser.add_argument("--baseline", metavar="PATH", help="與保存的計畫比較，失敗時列出差異")
+    parser.add_argument("--verbose", action="store_true", help="列出每個 SQL 的計畫")
+    args = parser.parse_args()
+
+    if args.dbname:
+        db.DB_CONFIG["dbname"] = args.dbname
+    random.seed(0)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    statements = capture(_samples(20))
+    plans, failures = {}, 0
+    counter = {}
+    with db.get_db_connection() as conn:
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+            for function, query, vars in statements:
+                counter[function] = counter.get(function, 0) + 1
+                key = f"{function}#{counter[function]}"
+                plan = explain(cur, query, vars)
+                lines = render(plan)
+                plans[key] = lines
+                problems = check(function, plan, args.max_cost)
+                print(f"{'FAIL' if problems else 'ok':<6}{key:<45}cost={plan['Total Cost']:>10.1f}  {'; '.join(problems)}")
+                if problems:
+                    failures += 1
+                    if key in baseline:
+                        diff = difflib.unified_diff(baseline[key], lines, "baseline", "current", lineterm="")
+                        print("\n".join("        " + line for line in diff) or "        (plan unchanged)")
+                    else:
+                        print("        " + query.strip().splitlines()[0][:120])
+                if problems or args.verbose:
+                    print("\n".join("        " + line for line in lines))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(plans, f, ensure_ascii=False, indent=1)
+        print(f"Saved {len(plans)} plans to {args.save}")
+    print(f"{len(statements) - failures}/{len(statements)} statements passed")
+    db.close_pool()
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
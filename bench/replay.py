@@ -0,0 +1,161 @@
+"""
+重播 CAPTURE_LOG 記錄的流量 (見 backend/capture.py)，比較兩個版本在真實流量下的延遲分布。
+
+請求依原本的開始時間排程：--speed 1 為原速、--speed N 為 N 倍速 (時間間隔縮為 1/N)、--speed 0 為全速
+(依原本的順序盡快送出，最多 --concurrency 個同時進行)，不同使用者的請求維持原本的交錯順序。
+匿名化的字串以相同長度的隨機字串代替，所以登入、註冊等請求會以 4xx 結束，仍計入延遲。
+重播的對象不要設定 CAPTURE_LOG，否則重播的請求也會被記錄下來。
+
+使用方式 (於專案根目錄)：
+    python -m bench.replay capture.jsonl --speed 4 --out build_a.json
+    python -m bench.replay capture.jsonl --speed 4 --out build_b.json    # 切換到另一個版本後
+    python -m bench.replay --compare build_a.json build_b.json
+"""
+import argparse
+import json
+import random
+import string
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bench.loadtest import Results, _session
+
+def load(paths):
+    entries = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            entries += [json.loads(line) for line in f if line.strip()]
+    entries.sort(key=lambda e: e["t"])
+    return entries
+
+def _restore(value):
+    """把匿名化的字串換成相同長度的隨機字串"""
+    if isinstance(value, dict):
+        if set(value) == {"$s"}:
+            return "".join(random.choices(string.ascii_lowercase, k=value["$s"]))
+        if set(value) == {"$bytes"}:
+            return None
+        return {k: _restore(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_restore(v) for v in value]
+    return value
+
+def build(entry):
+    """(method, path, kwargs)"""
+    path = entry["r"].format(**_restore(entry["p"]))
+    kwargs = {"params": [(k, _restore(v)) for k, v in entry["q"]]}
+    if entry.get("b") is not None:
+        kwargs["json"] = _restore(entry["b"])
+    if entry.get("a"):
+        kwargs["headers"] = {"Accept": entry["a"]}
+    return entry["m"], path, kwargs
+
+def replay(url, entries, speed, concurrency):
+    results = {}
+    lock = threading.Lock()
+    slots = threading.Semaphore(concurrency)
+
+    def send(entry):
+        method, path, kwargs = build(entry)
+        key = f"{entry['m']} {entry['r']}"
+        with lock:
+            result = results.get(key) or results.setdefault(key, Results(key))
+        start = time.perf_counter()
+        try:
+            status = _session().request(method, url + path, timeout=30, **kwargs).status_code
+        except Exception:
+            status = None
+        result.record(time.perf_counter() - start, status)
+        slots.release()
+
+    origin = entries[0]["t"]
+    start = time.perf_counter()
+    late = 0
+    with ThreadPoolExecutor(concurrency) as pool:
+        for entry in entries:
+            if speed > 0:
+                delay = (entry["t"] - origin) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -0.05:
+                    late += 1  # 同時進行的請求已達 --concurrency，無法準時送出
+            slots.acquire()
+            pool.submit(send, entry)
+    elapsed = time.perf_counter() - start
+    for result in results.values():
+        result.elapsed = elapsed
+    return results, elapsed, late
+
+def _summary(results, elapsed):
+    total = Results("total")
+    for result in results.values():
+        total.latencies += result.latencies
+        total.ok += result.ok
+        total.rejected += result.rejected
+        total.errors += result.errors
+    total.elapsed = elapsed
+    return [total.summary()] + [r.summary() for r in sorted(results.values(), key=lambda r: -len(r.latencies))]
+
+def _print(rows):
+    header = f"{'route':<48}{'requests':>9}{'4xx':>6}{'5xx':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(f"{r['scenario'][:47]:<48}{r['requests']:>9}{r['rejected']:>6}{r['errors']:>6}"
+              f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}")
+
+def compare(path_a, path_b):
+    with open(path_a, encoding="utf-8") as f:
+        a = {r["scenario"]: r for r in json.load(f)["routes"]}
+    with open(path_b, encoding="utf-8") as f:
+        b = {r["scenario"]: r for r in json.load(f)["routes"]}
+    header = f"{'route':<48}" + "".join(f"{p + ' A':>9}{p + ' B':>9}{'diff':>8}" for p in ("p50", "p95", "p99"))
+    print(header)
+    print("-" * len(header))
+    for route in [r for r in a if r in b]:
+        cells = ""
+        for p in ("p50_ms", "p95_ms", "p99_ms"):
+            before, after = a[route][p], b[route][p]
+            change = f"{(after - before) / before * 100:+.0f}%" if before else "-"
+            cells += f"{before:>9.1f}{after:>9.1f}{change:>8}"
+        print(f"{route[:47]:<48}{cells}")
+    missing = sorted(set(a) ^ set(b))
+    if missing:
+        print(f"Only in one run: {', '.join(missing)}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", help="CAPTURE_LOG 檔案 (多個 worker 或多天的紀錄可一起重播)")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--speed", type=float, default=1.0, help="重播倍速，0 表示全速")
+    parser.add_argument("--concurrency", type=int, default=64, help="同時進行的請求上限")
+    parser.add_argument("--out", help="把結果寫入此 JSON 檔，供 --compare 比較")
+    parser.add_argument("--compare", nargs=2, metavar=("A", "B"), help="比較兩次重播的結果後結束")
+    parser.add_argument("--seed", type=int, default=0, help="匿名字串的亂數種子")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if not args.paths:
+        parser.error("需要 CAPTURE_LOG 檔案或 --compare")
+    random.seed(args.seed)
+    entries = load(args.paths)
+    if not entries:
+        sys.exit(f"No requests to replay in {', '.join(args.paths)} (empty capture log?)")
+    span = entries[-1]["t"] - entries[0]["t"]
+    print(f"Replaying {len(entries)} requests captured over {span:.1f} s at "
+          f"{'max speed' if args.speed <= 0 else f'{args.speed:g}x'}")
+    results, elapsed, late = replay(args.url.rstrip("/"), entries, args.speed, args.concurrency)
+    rows = _summary(results, elapsed)
+    _print(rows)
+    print(f"Finished in {elapsed:.1f} s ({len(entries) / elapsed:.0f} req/s)" +
+          (f", {late} requests started late (--concurrency limit)" if late else ""))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"speed": args.speed, "elapsed": elapsed, "routes": rows}, f, ensure_ascii=False, indent=1)
+        print(f"Saved to {args.out}")
+
+if __name__ == "__main__":
+    main()
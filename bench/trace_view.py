@@ -0,0 +1,73 @@
+"""
+檢視 TRACE_EXPORT 輸出的 trace：列出最慢的幾個 trace，並以樹狀顯示每個 span 的開始時間與耗時，
+前端 (tcg-frontend) 與後端 (tcg-api) 的 span 依 trace id 合併。
+
+使用方式 (於專案根目錄)：
+    python -m bench.trace_view traces.jsonl --top 5
+    python -m bench.trace_view traces.jsonl --trace <trace id>
+"""
+import argparse
+import json
+import sys
+from collections import defaultdict
+
+def _load(paths):
+    traces = defaultdict(list)
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    span = json.loads(line)
+                    traces[span["trace_id"]].append(span)
+    return traces
+
+def _roots(spans):
+    ids = {span["span_id"] for span in spans}
+    return [span for span in spans if span["parent_id"] not in ids]
+
+def _duration(spans):
+    roots = _roots(spans)
+    start = min(span["start_ns"] for span in roots)
+    end = max(span["start_ns"] + span["duration_ms"] * 1e6 for span in roots)
+    return (end - start) / 1e6
+
+def _print_trace(trace_id, spans):
+    children = defaultdict(list)
+    for span in spans:
+        children[span["parent_id"]].append(span)
+    roots = sorted(_roots(spans), key=lambda span: span["start_ns"])
+    origin = roots[0]["start_ns"]
+    print(f"trace {trace_id}  {_duration(spans):.1f} ms")
+
+    def walk(span, depth):
+        attributes = " ".join(f"{k}={v}" for k, v in span["attributes"].items())
+        offset = (span["start_ns"] - origin) / 1e6
+        print(f"  {offset:>9.2f} {span['duration_ms']:>9.2f} ms  {'  ' * depth}{span['name']} "
+              f"[{span['service']}] {attributes}"[:200])
+        for child in sorted(children[span["span_id"]], key=lambda s: s["start_ns"]):
+            walk(child, depth + 1)
+
+    for root in roots:
+        walk(root, 0)
+    print()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="TRACE_EXPORT 檔案 (前後端分開輸出時可給多個)")
+    parser.add_argument("--top", type=int, default=5, help="顯示最慢的 N 個 trace")
+    parser.add_argument("--trace", help="只顯示指定的 trace id")
+    args = parser.parse_args()
+
+    traces = _load(args.paths)
+    if args.trace:
+        if args.trace not in traces:
+            sys.exit(f"Trace {args.trace} not found in {', '.join(args.paths)}")
+        _print_trace(args.trace, traces[args.trace])
+        return
+    print(f"{'offset ms':>11} {'duration':>12}")
+    for trace_id, spans in sorted(traces.items(), key=lambda item: _duration(item[1]), reverse=True)[:args.top]:
+        _print_trace(trace_id, spans)
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,148 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import requests
 import pandas as pd
+import contextvars
 import datetime
+import fnmatch
+import json
+import os
+import random
+import secrets
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from streamlit_option_menu import option_menu
 
+try:
+    import pyarrow as pa
+except ImportError:  # 沒有 pyarrow 時退回 JSON
+    pa = None
+
 API_URL = "http://localhost:8000"
 
+# 列表 API 支援以 Apache Arrow IPC 或欄式 JSON 回傳，可直接讀成 DataFrame
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+COLUMNS_MEDIA_TYPE = "application/vnd.tcg.columns+json"
+
+# --- 效能優化：共用 HTTP 連線 (Keep-alive Session) ---
+# 所有 API 呼叫共用一個 requests.Session，沿用 keep-alive 連線而不是每次重新建立 TCP 連線。
+# timeout 為 (連線, 讀取) 秒數；登入 / 註冊需要在後端計算 bcrypt，讀取時間給寬一點。
+HTTP_POOL_SIZE = 32
+GET_TIMEOUT = (3.05, 5)
+POST_TIMEOUT = (3.05, 15)
+
+@st.cache_resource
+def _http_session():
+    session = requests.Session()
+    # 只有冪等的 GET 會在讀取失敗或 502/503/504 時以指數退避重試，POST 不重送避免重複寫入
+    retry = Retry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# --- 效能優化：分散式追蹤 (Tracing) ---
+# 每次 Streamlit 執行 (rerun) 為一個 trace，每個 API 呼叫為其中一個 span，並以 traceparent header 交給後端接續
+# (見 backend/tracing.py)。設定 TRACE_EXPORT 後才啟用，span 以 JSON Lines 寫入該檔案 (可與後端共用同一個檔案)；
+# 依 TRACE_SAMPLE_RATE 抽樣，未抽中但整次執行超過 TRACE_SLOW_MS 的 trace 也會保留。
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "500"))
+
+_trace_span = contextvars.ContextVar("trace_span", default=None)
+
+def _new_span(trace, parent_id, name, **attributes):
+    return {"trace": trace, "span_id": secrets.token_hex(8), "parent_id": parent_id, "name": name,
+            "start_ns": time.time_ns(), "attributes": attributes}
+
+def _end_span(span):
+    span["duration_ms"] = round((time.time_ns() - span["start_ns"]) / 1e6, 3)
+    trace = span.pop("trace")
+    with trace["lock"]:
+        trace["spans"].append(span)
+
+@contextmanager
+def _trace_run(name, **attributes):
+    """整次 Streamlit 執行的 root span，結束時決定是否輸出"""
+    if not TRACE_EXPORT:
+        yield
+        return
+    trace = {"trace_id": secrets.token_hex(16), "sampled": random.random() < TRACE_SAMPLE_RATE,
+             "spans": [], "lock": threading.Lock()}
+    root = _new_span(trace, None, name, **attributes)
+    token = _trace_span.set(root)
+    try:
+        yield
+    finally:
+        _trace_span.reset(token)
+        _end_span(root)
+        if trace["sampled"] or root["duration_ms"] >= TRACE_SLOW_MS:
+            lines = [json.dumps({"trace_id": trace["trace_id"], **span, "service": "tcg-frontend"},
+                                ensure_ascii=False, default=str) for span in trace["spans"]]
+            try:
+                with open(TRACE_EXPORT, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+            except OSError as e:
+                print(f"Trace export error: {e}")
+
+def _request(method, endpoint, **kwargs):
+    """經由共用 session 呼叫 API；追蹤中時附上 traceparent 並記錄這次呼叫的 span"""
+    parent = _trace_span.get()
+    if parent is None:
+        return _http_session().request(method, f"{API_URL}/{endpoint}", **kwargs)
+    trace = parent["trace"]
+    span = _new_span(trace, parent["span_id"], f"HTTP {method} /{endpoint}")
+    flags = "01" if trace["sampled"] else "00"
+    kwargs["headers"] = {**(kwargs.get("headers") or {}),
+                         "traceparent": f"00-{trace['trace_id']}-{span['span_id']}-{flags}"}
+    try:
+        res = _http_session().request(method, f"{API_URL}/{endpoint}", **kwargs)
+        span["attributes"]["status"] = res.status_code
+        return res
+    except Exception as e:
+        span["attributes"]["error"] = repr(e)[:200]
+        raise
+    finally:
+        _end_span(span)
+
+# --- 效能優化：平行載入 (Parallel Fetch) ---
+FETCH_WORKERS = 8
+
+@st.cache_resource
+def _fetch_executor():
+    return ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="fetch")
+
+def fetch_many(loaders):
+    """
+    同時執行同一頁面上互不相依的載入，loaders 為 {名稱: 無參數函式}，回傳 {名稱: 結果}。
+    頁面等待時間取決於最慢的一個請求，而不是所有請求的總和。
+    """
+    ctx = get_script_run_ctx()
+
+    def run(loader):
+        # 讓工作執行緒也能使用 st.cache_data / st.session_state
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return loader()
+
+    # 每個載入各自複製 contextvars，工作執行緒內的 API 呼叫也屬於同一個 trace
+    futures = {name: _fetch_executor().submit(contextvars.copy_context().run, run, loader)
+               for name, loader in loaders.items()}
+    return {name: future.result() for name, future in futures.items()}
+
 # --- API Helper Functions ---
 def api_login(username, password, role):
     payload = {
@@ -14,13 +151,29 @@ def api_login(username, password, role):
         "role": "player" if role == "玩家 (Player)" else "shop"
     }
     try:
-        res = requests.post(f"{API_URL}/login", json=payload)
+        res = _request("POST", "login", json=payload, timeout=POST_TIMEOUT)
         if res.status_code == 200:
             return True, res.json()
         return False, res.json().get("detail", "登入失敗")
     except:
         return False, "無法連線後端"
 
+def api_restore_session(token):
+    """以登入時取得的 session token 取回登入資訊，不必重新輸入密碼"""
+    try:
+        res = _request("GET", "session", headers={"Authorization": f"Bearer {token}"}, timeout=GET_TIMEOUT)
+        if res.status_code == 200:
+            return res.json()
+    except Exception as e:
+        print(f"Session restore error: {e}")
+    return None
+
+def api_logout(token):
+    try:
+        _request("POST", "logout", headers={"Authorization": f"Bearer {token}"}, timeout=POST_TIMEOUT)
+    except Exception as e:
+        print(f"Logout error: {e}")
+
 def api_register(role, name, account, password, addr=None, phone=None):
     payload = {
         "role": "player" if role == "玩家 (Player)" else "shop",
@@ -31,35 +184,313 @@ def api_register(role, name, account, password, addr=None, phone=None):
         "phone": phone
     }
     try:
-        res = requests.post(f"{API_URL}/register", json=payload)
+        res = _request("POST", "register", json=payload, timeout=POST_TIMEOUT)
         return res.status_code == 200, res.json().get("detail", "")
     except:
         return False, "連線錯誤"
 
-# --- 效能優化：使用 st.cache_data ---
-@st.cache_data(ttl=60, show_spinner=False)
+# --- 效能優化：HTTP 條件式快取 (ETag) ---
+# 保留最近取得的 (ETag, DataFrame)，st.cache_data 過期或被清除後先以 If-None-Match 重新驗證，
+# 後端資料沒變時回 304，直接沿用舊的 DataFrame，不必重新查詢與傳輸
+ETAG_STORE_SIZE = 256
+
+class _EtagStore:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, etag, df):
+        with self.lock:
+            self.entries[key] = (etag, df)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+@st.cache_resource
+def _etag_store():
+    return _EtagStore(ETAG_STORE_SIZE)
+
+# --- 效能優化：精準快取失效 (Targeted Invalidation) ---
+# 寫入 API -> 會被它影響的讀取 API (fnmatch 樣式，{欄位} 以 payload 代入)。
+# 寫入成功後只讓這些 endpoint 的快取失效，其他頁面的快取維持有效。
+INVALIDATION_MAP = {
+    "player/add_card": ["player/{p_id}/cards", "player/{p_id}/decks/*/missing_cards",
+                        "views/player/{p_id}/deck_builder"],
+    "player/remove_card": ["player/{p_id}/cards", "player/{p_id}/decks/*/missing_cards",
+                           "views/player/{p_id}/deck_builder"],
+    "player/create_deck": ["player/{p_id}/decks", "views/player/{p_id}/*"],
+    "player/remove_deck": ["player/{p_id}/decks", "player/{p_id}/events", "views/player/{p_id}/*"],
+    "deck/add_card": ["deck/{d_id}/composition", "player/*/decks/{d_id}/missing_cards",
+                      "views/player/*/deck_builder"],
+    "player/join_event": ["events", "player/{p_id}/events", "views/player/*/event_registration"],
+    "player/leave_event": ["events", "player/{p_id}/events", "views/player/*/event_registration"],
+    "market/buy": ["market", "player/{p_id}/cards", "player/{p_id}/decks/*/missing_cards",
+                   "views/player/{p_id}/deck_builder", "shop/{s_id}/products", "shop/{s_id}/sales_detail"],
+    "shop/restock": ["shop/{s_id}/storage"],
+    "shop/list_product": ["shop/{s_id}/storage", "shop/{s_id}/products", "market"],
+    "shop/create_event": ["events", "views/player/*/event_registration"],
+}
+
+class _CacheGenerations:
+    """
+    每個 endpoint 的快取世代。世代是 st.cache_data 的 key 之一，
+    遞增後舊的快取項目不再被命中 (並在 ttl 到期後回收)，等同只清除該 endpoint 的快取。
+    """
+    def __init__(self):
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def of(self, endpoint):
+        with self.lock:
+            return self.generations.setdefault(endpoint, 0)
+
+    def bump(self, patterns):
+        with self.lock:
+            for endpoint in self.generations:
+                if any(fnmatch.fnmatchcase(endpoint, pattern) for pattern in patterns):
+                    self.generations[endpoint] += 1
+
+@st.cache_resource
+def _cache_generations():
+    return _CacheGenerations()
+
+def invalidate(endpoint, payload):
+    patterns = INVALIDATION_MAP.get(endpoint)
+    if patterns is None:
+        # 未宣告影響範圍的寫入 API，保守地清除所有快取
+        _fetch_cached.clear()
+        _fetch_view_cached.clear()
+        return
+    _cache_generations().bump([pattern.format(**payload) for pattern in patterns])
+
 def fetch_data(endpoint, params=None):
     """
     快取版本的 GET 請求，現在支援查詢參數。
     """
+    return _fetch_cached(endpoint, params, _cache_generations().of(endpoint))
+
+def _conditional_get(endpoint, params, accept, parse):
+    """
+    帶 If-None-Match 的 GET：後端回 304 時沿用 _etag_store 內的舊結果，
+    回 200 時以 parse(res) 解析並連同 ETag 存起來。失敗時回傳 None。
+    """
+    headers = {"Accept": accept}
+    store = _etag_store()
+    store_key = (endpoint, repr(params))
+    cached = store.get(store_key)
+    if cached is not None:
+        headers["If-None-Match"] = cached[0]
     try:
-        res = requests.get(f"{API_URL}/{endpoint}", params=params, timeout=5)
+        res = _request("GET", endpoint, params=params, headers=headers, timeout=GET_TIMEOUT)
+        if res.status_code == 304 and cached is not None:
+            return cached[1]
         if res.status_code == 200:
-            return pd.DataFrame(res.json())
-        # 如果 API 返回 404/500 等，回傳空 DataFrame 避免程式崩潰
+            value = parse(res)
+            if res.headers.get("ETag"):
+                store.put(store_key, res.headers["ETag"], value)
+            return value
+        # 如果 API 返回 404/500 等，由呼叫端回傳空結果避免程式崩潰
         print(f"API Error for {endpoint}: {res.status_code}")
     except Exception as e:
         print(f"Fetch error: {e}")
-    return pd.DataFrame()
+    return None
+
+def _parse_frame(res):
+    content_type = res.headers.get("Content-Type", "")
+    if content_type.startswith(ARROW_MEDIA_TYPE):
+        df = pa.ipc.open_stream(res.content).read_pandas()
+    elif content_type.startswith(COLUMNS_MEDIA_TYPE):
+        data = res.json()
+        df = pd.DataFrame(data["rows"], columns=data["columns"])
+    else:
+        df = pd.DataFrame(res.json())
+    # 分頁 API 會在 header 回傳下一頁的 cursor
+    df.attrs["next_cursor"] = res.headers.get("X-Next-Cursor")
+    return df
+
+def _parse_view(res):
+    """聚合 API：每個表格轉成 DataFrame，其餘值 (例如選定的 d_id) 原樣保留"""
+    view = {}
+    for name, value in res.json().items():
+        if isinstance(value, dict) and "columns" in value:
+            df = pd.DataFrame(value["rows"], columns=value["columns"])
+        elif isinstance(value, list):
+            df = pd.DataFrame(value)
+        else:
+            view[name] = value
+            continue
+        # 聚合 API 只有一個表格會分頁，cursor 一律附在每個 DataFrame 上，交給 page_controls 讀取
+        df.attrs["next_cursor"] = res.headers.get("X-Next-Cursor")
+        view[name] = df
+    return view
+
+# --- 效能優化：使用 st.cache_data ---
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_cached(endpoint, params, generation):
+    """
+    generation 只用來區分快取 key，見 _CacheGenerations。
+    有安裝 pyarrow 時要求 Arrow IPC 格式，否則要求欄式 JSON，省去逐列解析 dict。
+    """
+    if pa is not None:
+        accept = f"{ARROW_MEDIA_TYPE}, {COLUMNS_MEDIA_TYPE};q=0.9, application/json;q=0.8"
+    else:
+        accept = f"{COLUMNS_MEDIA_TYPE}, application/json;q=0.9"
+    df = _conditional_get(endpoint, params, accept, _parse_frame)
+    return df if df is not None else pd.DataFrame()
+
+# --- 效能優化：頁面聚合 API ---
+def fetch_view(endpoint, params=None):
+    """
+    一次取得整個頁面需要的資料 (後端 /views/...)，回傳 {名稱: DataFrame}。
+    取代同一頁面上多次的 fetch_data，只需一次 HTTP 往返。
+    """
+    return _fetch_view_cached(endpoint, params, _cache_generations().of(endpoint))
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_view_cached(endpoint, params, generation):
+    view = _conditional_get(endpoint, params, f"{COLUMNS_MEDIA_TYPE}, application/json;q=0.9", _parse_view)
+    return view if view is not None else {}
+
+# --- 效能優化：Keyset 分頁 ---
+PAGE_SIZE = 50
+
+def fetch_page(endpoint, key, params=None, page_size=PAGE_SIZE, fetch=fetch_data):
+    """
+    分頁版本的 fetch_data (聚合 API 則傳入 fetch=fetch_view)。session_state 保存每一頁起始的 cursor，
+    翻頁時只把 cursor 交給後端，第 N 頁與第 1 頁的查詢成本相同。
+    """
+    state_key = f"pager_{key}"
+    # 查詢條件改變時回到第一頁
+    if state_key not in st.session_state or st.session_state[state_key]["params"] != params:
+        st.session_state[state_key] = {"params": params, "cursors": [None]}
+    cursors = st.session_state[state_key]["cursors"]
+
+    query = dict(params or {})
+    query["limit"] = page_size
+    if cursors[-1]:
+        query["cursor"] = cursors[-1]
+    return fetch(endpoint, params=query)
+
+def page_controls(key, df):
+    """顯示上一頁 / 下一頁按鈕，須在同一個 key 的 fetch_page 之後呼叫"""
+    cursors = st.session_state[f"pager_{key}"]["cursors"]
+    next_cursor = df.attrs.get("next_cursor")
+    if len(cursors) == 1 and not next_cursor:
+        return
+
+    col_prev, col_page, col_next = st.columns([1, 2, 1], vertical_alignment="center")
+    if col_prev.button("上一頁", key=f"{key}_prev", disabled=len(cursors) == 1, width="stretch"):
+        cursors.pop()
+        st.rerun()
+    col_page.caption(f"第 {len(cursors)} 頁")
+    if col_next.button("下一頁", key=f"{key}_next", disabled=not next_cursor, width="stretch"):
+        cursors.append(next_cursor)
+        st.rerun()
+
+# --- 效能優化：即時更新 (Server-Sent Events) ---
+# 每個 Streamlit 行程對每個 topic 只開一條 /live/{topic} SSE 連線 (st.cache_resource 共用)，背景執行緒保存推送的最新值；
+# 賽事與商城表格放在 st.fragment(run_every=LIVE_REFRESH) 內，只重繪表格並套用最新的報名人數與庫存，不再重新呼叫 API。
+# 連線中斷或收到 resync 時清空推送的值，改回顯示 API 讀到的資料。設定 LIVE_UPDATES=1 才啟用 (後端需同樣設定)。
+LIVE_UPDATES = os.getenv("LIVE_UPDATES", "0") == "1"
+LIVE_REFRESH = 2  # 秒
+LIVE_READ_TIMEOUT = 30  # 後端每 15 秒送一次 heartbeat
+
+class LiveFeed:
+    def __init__(self, topic, key_fields):
+        self.topic = topic
+        self.key_fields = key_fields
+        self.values = {}
+        self.lock = threading.Lock()
+        threading.Thread(target=self._run, name=f"live-{topic}", daemon=True).start()
+
+    def _run(self):
+        delay = 1
+        while True:
+            try:
+                with requests.get(f"{API_URL}/live/{self.topic}", stream=True,
+                                  timeout=(3.05, LIVE_READ_TIMEOUT)) as res:
+                    if res.status_code == 404:
+                        print(f"Live feed {self.topic} disabled: the API does not have LIVE_UPDATES=1")
+                        return
+                    res.raise_for_status()
+                    delay = 1
+                    event = None
+                    for line in res.iter_lines(decode_unicode=True):
+                        if line.startswith("event:"):
+                            event = line[6:].strip()
+                        elif line.startswith("data:"):
+                            self._apply(event, json.loads(line[5:]))
+            except (requests.RequestException, ValueError) as e:
+                print(f"Live feed {self.topic} error: {e}")
+            with self.lock:
+                self.values.clear()
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    def _apply(self, event, data):
+        with self.lock:
+            if event == "resync":
+                self.values.clear()
+            elif event == self.topic:
+                self.values[tuple(data[k] for k in self.key_fields)] = data
+
+    def overlay(self, df, column, field):
+        """以推送的最新值取代 df[column] (依 key_fields 對應)，回傳新的 DataFrame"""
+        with self.lock:
+            latest = {key: data[field] for key, data in self.values.items()}
+        if not latest or df.empty:
+            return df
+        df = df.copy()
+        keys = list(zip(*(df[k] for k in self.key_fields)))
+        df[column] = [latest.get(key, value) for key, value in zip(keys, df[column])]
+        return df
+
+@st.cache_resource
+def live_feed(topic):
+    return LiveFeed(topic, {"events": ("e_id",), "market": ("s_id", "prod_id")}[topic])
+
+# --- 效能優化：冪等重送 (Idempotency-Key) ---
+# 購買與報名每次操作產生一個 Idempotency-Key，逾時、連線中斷或 502/503/504 時以同一個 key 重送：
+# 後端只會執行一次，重送取得第一次的結果，所以可以用比 POST_TIMEOUT 短得多的逾時，不必等慢的那一次。
+IDEMPOTENT_ENDPOINTS = {"market/buy", "player/join_event"}
+IDEMPOTENT_TIMEOUT = (3.05, 4)
+IDEMPOTENT_RETRIES = 3
+
+def _post(endpoint, payload):
+    if endpoint not in IDEMPOTENT_ENDPOINTS:
+        return _request("POST", endpoint, json=payload, timeout=POST_TIMEOUT)
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+    for attempt in range(IDEMPOTENT_RETRIES + 1):
+        delay = 0.2 * 2 ** attempt
+        try:
+            res = _request("POST", endpoint, json=payload, headers=headers, timeout=IDEMPOTENT_TIMEOUT)
+            if res.status_code not in (502, 503, 504) or attempt == IDEMPOTENT_RETRIES:
+                return res
+            try:
+                delay = min(float(res.headers.get("Retry-After", delay)), 2.0)
+            except ValueError:
+                pass
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == IDEMPOTENT_RETRIES:
+                raise
+        time.sleep(delay)
 
 def send_data(endpoint, payload):
     """
     POST 請求。
     """
     try:
-        res = requests.post(f"{API_URL}/{endpoint}", json=payload)
+        res = _post(endpoint, payload)
         if res.status_code == 200:
-            fetch_data.clear() # 成功寫入後，清除所有快取
+            invalidate(endpoint, payload) # 成功寫入後，只清除受影響 endpoint 的快取
             return True
         else:
             st.error(f"操作失敗: {res.json().get('detail', '後端錯誤')}")
@@ -76,8 +507,44 @@ if 'user_type' not in st.session_state:
 if 'user_info' not in st.session_state:
     st.session_state['user_info'] = {}
 
+# 登入後 session token 保存在 cookie，不放進網址 (query string 會留在瀏覽器歷史、Referer 與 proxy 的 log 中)。
+# 重新整理或再次造訪時，新的 session 由 st.context.cookies 讀出 token 以 /session 恢復登入，不必重新驗證密碼。
+# Streamlit 無法送出 Set-Cookie，cookie 由高度為 0 的 component 在瀏覽器端寫入；SESSION_TTL 與後端相同。
+SESSION_COOKIE = "tcg_session"
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(12 * 3600)))
+
+def _write_session_cookie(token):
+    """token 為空字串時清除 cookie"""
+    cookie = json.dumps(f"{SESSION_COOKIE}={token}; Path=/; Max-Age={SESSION_TTL if token else 0}; SameSite=Strict")
+    components.html(f"""<script>
+        const secure = window.parent.location.protocol === "https:" ? "; Secure" : "";
+        window.parent.document.cookie = {cookie} + secure;
+    </script>""", height=0)
+
+if 'token' not in st.session_state:
+    st.session_state['token'] = None
+    token = st.context.cookies.get(SESSION_COOKIE)
+    if token:
+        restored = api_restore_session(token)
+        if restored:
+            st.session_state['logged_in'] = True
+            st.session_state['user_type'] = restored['role']
+            st.session_state['user_info'] = restored['user']
+            st.session_state['token'] = token
+        # 成功時重新寫入以延長 cookie 期限 (後端的期限同樣從這次使用重新計算)，token 已失效時清除
+        st.session_state['session_cookie'] = token if restored else ""
+
+# 登入、登出後的下一次執行才寫入 cookie (st.rerun 會中斷這次執行的 component)
+if 'session_cookie' in st.session_state:
+    _write_session_cookie(st.session_state.pop('session_cookie'))
+
 def logout():
+    if st.session_state.get('token'):
+        api_logout(st.session_state['token'])
     st.session_state.clear()
+    # st.context.cookies 在這個 session 內不會更新，略過下一次執行的恢復登入
+    st.session_state['token'] = None
+    st.session_state['session_cookie'] = ""
     st.rerun()
 
 # --- Pages ---
@@ -98,6 +565,9 @@ def login_page():
                     st.session_state['logged_in'] = True
                     st.session_state['user_type'] = result['role']
                     st.session_state['user_info'] = result['user']
+                    st.session_state['token'] = result.get('token')
+                    if result.get('token'):
+                        st.session_state['session_cookie'] = result['token']
                     st.success("登入成功")
                     st.rerun()
                 else:
@@ -124,6 +594,72 @@ def login_page():
                 if success: st.success("註冊成功")
                 else: st.error("註冊失敗")
 
+@st.fragment(run_every=LIVE_REFRESH if LIVE_UPDATES else None)
+def market_table(df_market):
+    """商城列表：架上數量以即時推送的最新值顯示"""
+    if LIVE_UPDATES:
+        df_market = live_feed("market").overlay(df_market, "qty", "qty")
+    st.dataframe(
+        df_market,
+        width="stretch",
+        column_config={
+            "s_id": None, "prod_id": None, "c_id": None, # 隱藏 ID
+            "menu_label": None, "display_name": None, # 隱藏輔助欄位
+            "s_name": "販售店家",
+            "prod_name": "商品名稱",
+            "prod_type": "類型",
+            "price": st.column_config.NumberColumn("單價", format="$%d"),
+            "qty": st.column_config.NumberColumn("庫存", help="剩餘數量")
+        },
+        hide_index=True,
+        height=500
+    )
+
+@st.fragment(run_every=LIVE_REFRESH if LIVE_UPDATES else None)
+def events_table(df_events, size_mapping, name_mapping):
+    """賽事列表：報名人數以即時推送的最新值顯示"""
+    if LIVE_UPDATES:
+        df_events = live_feed("events").overlay(df_events, "current_participants", "participants")
+    df_events["size_limit"] = df_events["e_size"].map(size_mapping).astype(int)
+    df_events["size_display"] = df_events["e_size"].map(name_mapping)
+    df_events["occupancy_rate"] = df_events.apply(
+        lambda row: (row["current_participants"] / row["size_limit"] * 100) if row["size_limit"] > 0 else 0,
+        axis=1
+    )
+    df_events["status_text"] = (
+        df_events["size_display"] + " (" + 
+        df_events["current_participants"].astype(str) + "/" + 
+        df_events["size_limit"].astype(str) + ")"
+    )
+    
+    # 設定表格顯示格式
+    st.dataframe(
+        df_events,
+        width="stretch",
+        column_config={
+            "e_id": None,
+            "e_name": "活動名稱",
+            "e_date": st.column_config.DateColumn("日期", format="YYYY-MM-DD"),
+            "e_time": st.column_config.TimeColumn("時間", format="HH:mm"),
+            "e_format": "賽制",
+            "e_roundtype": "賽制輪次",
+            "s_name": "舉辦店家",
+            "status_text": "賽事規模 (目前/上限)",
+            "occupancy_rate": st.column_config.ProgressColumn(
+                "報名狀況",
+                help="目前人數 / 規模上限",
+                format="%.0f%%",
+                min_value=0,
+                max_value=100,
+            ),
+            "e_size": None,
+            "current_participants": None,
+            "size_limit": None,
+            "size_display": None
+        },
+        hide_index=True
+    )
+
 def player_dashboard():
     user = st.session_state['user_info']
     p_id = user['p_id']
@@ -146,14 +682,19 @@ def player_dashboard():
         # --- 我的收藏 ---
         if menu == "我的收藏":
             st.header("我的卡片")
-            df = fetch_data(f"player/{p_id}/cards")
+            loaded = fetch_many({
+                "my_cards": lambda: fetch_page(f"player/{p_id}/cards", "my_cards"),
+                "all_cards": lambda: fetch_data("cards"),
+            })
+            df = loaded["my_cards"]
             if not df.empty:
                 st.dataframe(df, width="stretch", column_config={"c_id": None})
             else:
                 st.info("您沒有登錄的卡片，請點擊下方「登錄新卡片」設定收藏")
+            page_controls("my_cards", df)
 
             with st.expander("登錄新卡片"):
-                all_cards = fetch_data("cards")
+                all_cards = loaded["all_cards"]
                 
                 if not all_cards.empty:
                     # 步驟 A: 建立一個不重複的顯示名稱 (格式: 名稱 [稀有度])
@@ -237,18 +778,27 @@ def player_dashboard():
             st.divider()
 
             # --- 區域 2: 選擇要管理的牌組 (主控台) ---
-            df_decks = fetch_data(f"player/{p_id}/decks")
+            # 一次取得牌組列表、卡牌總表，以及選定牌組的組成與缺卡
+            selected_d_id = st.session_state.get("deck_builder_d_id")
+            view_params = {"d_id": selected_d_id} if selected_d_id is not None else None
+            view = fetch_view(f"views/player/{p_id}/deck_builder", params=view_params)
+            df_decks = view.get("decks", pd.DataFrame())
             
             if df_decks.empty:
                 st.info("目前沒有牌組，請先在上方建立一個吧！")
             else:
                 # 製作選單： 讓玩家選一個牌組，後續所有操作都針對這個牌組
-                deck_options = dict(zip(df_decks['牌組名稱'], df_decks['d_id']))
-                deck_names = list(deck_options.keys())
+                deck_options = dict(zip(df_decks['d_id'], df_decks['牌組名稱']))
+                # 選過的牌組已被刪除時回到第一副
+                if selected_d_id not in deck_options:
+                    st.session_state.pop("deck_builder_d_id", None)
                 
-                # 使用 selectbox 成為頁面的「狀態選擇器」
-                selected_deck_name = st.selectbox("選擇要管理的牌組", deck_names)
-                selected_d_id = deck_options[selected_deck_name]
+                # 使用 selectbox 成為頁面的「狀態選擇器」，選擇改變後的重新執行會帶著新的 d_id 取得聚合資料
+                selected_d_id = st.selectbox("選擇要管理的牌組", list(deck_options.keys()),
+                                             format_func=deck_options.get, key="deck_builder_d_id")
+                selected_deck_name = deck_options[selected_d_id]
+                if selected_d_id != view.get("d_id"):
+                    view = fetch_view(f"views/player/{p_id}/deck_builder", params={"d_id": selected_d_id})
 
                 # --- 區域 3: 針對選定牌組的功能區 (Tabs) ---
                 tab1, tab2, tab3 = st.tabs(["內容編輯", "缺卡檢測", "刪除牌組"])
@@ -259,7 +809,7 @@ def player_dashboard():
                     
                     with col_list:
                         st.caption(f"「{selected_deck_name}」目前的組成")
-                        current_comp = fetch_data(f"deck/{selected_d_id}/composition")
+                        current_comp = view.get("composition", pd.DataFrame())
                         if not current_comp.empty:
                             st.dataframe(current_comp, width="stretch", height=400)
                         else:
@@ -267,7 +817,7 @@ def player_dashboard():
 
                     with col_edit:
                         st.caption("新增 / 修改卡片")
-                        all_cards_list = fetch_data("cards")
+                        all_cards_list = view.get("cards", pd.DataFrame())
                         
                         if not all_cards_list.empty:
                             all_cards_list['display_label'] = all_cards_list['c_name'] + " [" + all_cards_list['c_rarity'] + "]"
@@ -293,8 +843,8 @@ def player_dashboard():
                     st.markdown(f"### 正在檢查：{selected_deck_name}")
                     if st.button("開始比對庫存"):
                         with st.spinner("正在掃描您的卡片庫存..."):
-                            # 直接使用選定的 ID，不用再選一次
-                            missing_df = fetch_data(f"player/{p_id}/decks/{selected_d_id}/missing_cards")
+                            # 缺卡已隨聚合 API 一起取得，不用再發一次請求
+                            missing_df = view.get("missing_cards", pd.DataFrame())
                             
                             if missing_df.empty:
                                 st.success("太棒了！您擁有組成這副牌組的所有卡片。")
@@ -365,20 +915,25 @@ def player_dashboard():
                 params['card_type'] = search_type
 
             if st.button("執行查詢", type="primary"):
+                # 記住查詢條件，翻頁重新執行時才能保留結果
+                st.session_state["card_search_params"] = params
+
+            if "card_search_params" in st.session_state:
                 with st.spinner("查詢中..."):
-                    df_results = fetch_data("cards", params=params)
+                    df_results = fetch_page("cards", "card_search", params=st.session_state["card_search_params"])
                     
                     if df_results.empty:
                         st.info("查無符合條件的卡牌。")
                     else:
-                        st.success(f"找到 {len(df_results)} 張符合條件的卡牌:")
-                        st.dataframe(df_results, width="stretch")
+                        st.success(f"本頁顯示 {len(df_results)} 張符合條件的卡牌:")
+                        st.dataframe(df_results, width="stretch", column_config={"c_id": None})
+                    page_controls("card_search", df_results)
 
         elif menu == "線上商城":
             st.header("線上卡牌商城")
             
-            # 1. 取得資料
-            df_market = fetch_data("market")
+            # 1. 取得資料 (依價格分頁)
+            df_market = fetch_page("market", "market")
             
             if not df_market.empty:
                 # 整理顯示用的欄位
@@ -395,26 +950,17 @@ def player_dashboard():
                     " - $" + df_market["price"].astype(str)
                 )
 
+                # 下單區與表格使用同一份即時庫存，可選的數量不會超過目前架上的數量
+                if LIVE_UPDATES:
+                    df_market = live_feed("market").overlay(df_market, "qty", "qty")
+
                 # 佈局：左側列表，右側購買操作
                 col_list, col_buy = st.columns([2, 1])
 
                 with col_list:
                     st.subheader("商品一覽")
-                    st.dataframe(
-                        df_market,
-                        width="stretch",
-                        column_config={
-                            "s_id": None, "prod_id": None, "c_id": None, # 隱藏 ID
-                            "menu_label": None, "display_name": None, # 隱藏輔助欄位
-                            "s_name": "販售店家",
-                            "prod_name": "商品名稱",
-                            "prod_type": "類型",
-                            "price": st.column_config.NumberColumn("單價", format="$%d"),
-                            "qty": st.column_config.NumberColumn("庫存", help="剩餘數量")
-                        },
-                        hide_index=True,
-                        height=500
-                    )
+                    market_table(df_market)
+                    page_controls("market", df_market)
 
                 with col_buy:
                     with st.container(border=True):
@@ -423,7 +969,7 @@ def player_dashboard():
                         # 建立選單 Map: Label -> (s_id, prod_id, price, max_qty)
                         # 這樣選了 Label 就可以知道所有需要的資訊
                         market_map = {}
-                        for idx, row in df_market.iterrows():
+                        for idx, row in df_market[df_market["qty"] > 0].iterrows():
                             market_map[row['menu_label']] = {
                                 's_id': row['s_id'],
                                 'prod_id': row['prod_id'],
@@ -432,40 +978,44 @@ def player_dashboard():
                                 'name': row['display_name']
                             }
 
-                        sel_item_label = st.selectbox("選擇商品", list(market_map.keys()))
+                        if not market_map:
+                            st.warning("這一頁的商品都已售完。")
+                        else:
+                            sel_item_label = st.selectbox("選擇商品", list(market_map.keys()))
                         
-                        # 根據選擇的商品，取得詳細資訊
-                        target_item = market_map[sel_item_label]
+                            # 根據選擇的商品，取得詳細資訊
+                            target_item = market_map[sel_item_label]
                         
-                        st.info(f"您選擇了：\n**{target_item['name']}**\n\n單價：${target_item['price']}")
+                            st.info(f"您選擇了：\n**{target_item['name']}**\n\n單價：${target_item['price']}")
                         
-                        buy_qty = st.number_input(
-                            "購買數量", 
-                            min_value=1, 
-                            max_value=target_item['max_qty'], 
-                            value=1
-                        )
+                            buy_qty = st.number_input(
+                                "購買數量", 
+                                min_value=1, 
+                                max_value=target_item['max_qty'], 
+                                value=1
+                            )
                         
-                        total_price = target_item['price'] * buy_qty
-                        st.metric("總金額", f"${total_price}")
+                            total_price = target_item['price'] * buy_qty
+                            st.metric("總金額", f"${total_price}")
                         
-                        st.divider()
-                        st.caption("注意：下單後庫存將立即保留，請至店家現場付款取貨。")
+                            st.divider()
+                            st.caption("注意：下單後庫存將立即保留，請至店家現場付款取貨。")
                         
-                        if st.button("確認下單", type="primary", use_container_width=True):
-                            payload = {
-                                "p_id": p_id,
-                                "s_id": target_item['s_id'],
-                                "prod_id": target_item['prod_id'],
-                                "qty": buy_qty
-                            }
+                            if st.button("確認下單", type="primary", use_container_width=True):
+                                payload = {
+                                    "p_id": p_id,
+                                    "s_id": target_item['s_id'],
+                                    "prod_id": target_item['prod_id'],
+                                    "qty": buy_qty
+                                }
                             
-                            if send_data("market/buy", payload):
-                                st.success(f"訂單已送出！(單號已建立)")
-                                st.rerun()
+                                if send_data("market/buy", payload):
+                                    st.success(f"訂單已送出！(單號已建立)")
+                                    st.rerun()
 
             else:
                 st.info("目前商城沒有任何商品上架。")
+                page_controls("market", df_market)
 
         elif menu == "賽事報名":
             st.header("賽事報名中心")
@@ -480,14 +1030,11 @@ def player_dashboard():
                 "POD": "桌邊賽", "LOCAL": "例行賽", "REGIONAL": "區域賽", "MAJOR": "旗艦賽"
             }
 
-            # 1. 取得賽事列表
-            df_events = fetch_data("events")
-            
-            # 2. 取得玩家自己的牌組 (報名必備)
-            df_my_decks = fetch_data(f"player/{p_id}/decks")
-
-            # 3. 取得玩家已報名的賽事
-            my_participations = fetch_data(f"player/{p_id}/events")
+            # 一次取得賽事列表 (依日期分頁)、玩家自己的牌組 (報名必備) 與已報名的賽事
+            view = fetch_page(f"views/player/{p_id}/event_registration", "events", fetch=fetch_view)
+            df_events = view.get("events", pd.DataFrame())
+            df_my_decks = view.get("decks", pd.DataFrame())
+            my_participations = view.get("participations", pd.DataFrame())
     
             if not my_participations.empty and "e_id" in my_participations.columns:
                 joined_event_ids = set(my_participations["e_id"].tolist())
@@ -520,7 +1067,7 @@ def player_dashboard():
                         my_participations['cancel_label'] = (
                             my_participations['e_name'] + " (" + 
                             my_participations['e_date'].astype(str) + " " + 
-                            pd.to_datetime(my_participations['e_time']).dt.strftime('%H:%M') + ")"
+                            my_participations['e_time'].astype(str).str[:5] + ")"
                         )
                     else:
                         my_participations['cancel_label'] = "活動 ID: " + my_participations['e_id'].astype(str)
@@ -549,46 +1096,8 @@ def player_dashboard():
             # --- 顯示所有賽事列表 ---
             if not df_events.empty:
                 st.subheader("近期賽事")
-
-                df_events["size_limit"] = df_events["e_size"].map(size_mapping).astype(int)
-                df_events["size_display"] = df_events["e_size"].map(name_mapping)
-                df_events["occupancy_rate"] = df_events.apply(
-                    lambda row: (row["current_participants"] / row["size_limit"] * 100) if row["size_limit"] > 0 else 0,
-                    axis=1
-                )
-                df_events["status_text"] = (
-                    df_events["size_display"] + " (" + 
-                    df_events["current_participants"].astype(str) + "/" + 
-                    df_events["size_limit"].astype(str) + ")"
-                )
-                
-                # 設定表格顯示格式
-                st.dataframe(
-                    df_events,
-                    width="stretch",
-                    column_config={
-                        "e_id": None,
-                        "e_name": "活動名稱",
-                        "e_date": st.column_config.DateColumn("日期", format="YYYY-MM-DD"),
-                        "e_time": st.column_config.TimeColumn("時間", format="HH:mm"),
-                        "e_format": "賽制",
-                        "e_roundtype": "賽制輪次",
-                        "s_name": "舉辦店家",
-                        "status_text": "賽事規模 (目前/上限)",
-                        "occupancy_rate": st.column_config.ProgressColumn(
-                            "報名狀況",
-                            help="目前人數 / 規模上限",
-                            format="%.0f%%",
-                            min_value=0,
-                            max_value=100,
-                        ),
-                        "e_size": None,
-                        "current_participants": None,
-                        "size_limit": None,
-                        "size_display": None
-                    },
-                    hide_index=True
-                )
+                events_table(df_events, size_mapping, name_mapping)
+                page_controls("events", df_events)
 
                 st.divider()
 
@@ -605,7 +1114,7 @@ def player_dashboard():
                     else:
                         # 步驟 A: 選擇賽事
                         # 製作選單：顯示名稱 + 日期 + 時間 以防同名
-                        available_events['display_label'] = available_events['e_name'] + " (" + available_events['e_date'].astype(str) + " " + pd.to_datetime(available_events['e_time']).dt.strftime('%H:%M') + ")"
+                        available_events['display_label'] = available_events['e_name'] + " (" + available_events['e_date'].astype(str) + " " + available_events['e_time'].astype(str).str[:5] + ")"
                         event_map = dict(zip(available_events['display_label'], available_events['e_id']))
                         
                         c1, c2 = st.columns(2)
@@ -637,6 +1146,7 @@ def player_dashboard():
 
             else:
                 st.info("目前沒有可用的賽事。")
+                page_controls("events", df_events)
 
 def shop_dashboard():
     user = st.session_state['user_info']
@@ -661,10 +1171,17 @@ def shop_dashboard():
             # 使用 Tabs 分流功能，讓介面不擁擠
             tab1, tab2 = st.tabs(["銷售櫃台 (已上架)", "倉庫管理 (進貨/補貨)"])
 
+            # 兩個分頁的資料同時載入
+            loaded = fetch_many({
+                "shelf": lambda: fetch_page(f"shop/{s_id}/products", "shelf"),
+                "storage": lambda: fetch_data(f"shop/{s_id}/storage"),
+                "products": lambda: fetch_data("products_list"),
+            })
+
             # --- Tab 1: 銷售櫃台 (檢視目前販售中商品) ---
             with tab1:
                 st.subheader("架上商品列表")
-                df_shelf = fetch_data(f"shop/{s_id}/products")
+                df_shelf = loaded["shelf"]
                 
                 if not df_shelf.empty:
                     if "prod_type" in df_shelf.columns:
@@ -687,6 +1204,7 @@ def shop_dashboard():
                     )
                 else:
                     st.info("目前架上空空如也，請去倉庫上架商品。")
+                page_controls("shelf", df_shelf)
 
             # --- Tab 2: 倉庫管理 (核心邏輯區) ---
             with tab2:
@@ -695,7 +1213,7 @@ def shop_dashboard():
                 # 1. 左側：顯示倉庫目前的庫存
                 with col_storage_view:
                     st.subheader("倉庫庫存")
-                    df_storage = fetch_data(f"shop/{s_id}/storage")
+                    df_storage = loaded["storage"]
                     
                     if not df_storage.empty:
                         if "prod_type" in df_storage.columns:
@@ -723,7 +1241,7 @@ def shop_dashboard():
                     # --- 區塊 A: 進貨 (從外部叫貨) ---
                     with st.expander("進貨", expanded=True):
                         st.caption("從總商品列表加入倉庫")
-                        all_prods = fetch_data("products_list")
+                        all_prods = loaded["products"]
                         
                         if not all_prods.empty:
                             if "prod_type" in all_prods.columns:
@@ -906,10 +1424,11 @@ def shop_dashboard():
                 st.info("目前沒有任何銷售記錄。")
 
 if __name__ == "__main__":
-    if not st.session_state['logged_in']:
-        login_page()
-    else:
-        if st.session_state['user_type'] == 'player':
-            player_dashboard()
+    with _trace_run("streamlit.run", user_type=st.session_state['user_type']):
+        if not st.session_state['logged_in']:
+            login_page()
         else:
-            shop_dashboard()
\ No newline at end of file
+            if st.session_state['user_type'] == 'player':
+                player_dashboard()
+            else:
+                shop_dashboard()
\ No newline at end of file